@@ -1,11 +1,38 @@
 import sqlite3
-from flask import Flask, jsonify, request, send_file, url_for, send_from_directory
+from flask import Flask, Response, g, has_request_context, jsonify, request, send_file, url_for, send_from_directory
 from flask_cors import CORS
 import os
-import pandas as pd
 import io
+import json
+import functools
+import queue
+import threading
+import time
+from datetime import date
 from werkzeug.utils import secure_filename
-import uuid
+# (修改) pandas / openpyxl 体积较大，只在 Excel 导入导出接口内部按需导入，
+# 避免拖慢每个 worker 的启动时间和常驻内存
+
+from batch_writes import BatchExecutionError, BatchValidationError, execute_batch, validate_operations
+from detail_sections import (DEFAULT_PAGE_SIZE, decode_cursor, keyset_filter, narrow_to_cursors, page, parse_include,
+                             parse_limit, query_limit)
+from dict_cache import DictionaryCache
+from events import EventBroker, format_sse
+from fixed_point import column_scales, frame_to_storage, from_storage, sum_sql, to_storage
+from fleets import FleetRegistry, add_totals, merge_ranked, merge_series, merge_top, scatter
+from granularity import bucket_totals, parse_granularity, parse_max_points, series_granularity, trend
+from journal import (DEFAULT_BATCH_SIZE, ack_consumer, batch_size, has_gap, iter_changes, latest_seq, oldest_seq,
+                     read_changes)
+from maintenance import MaintenanceScheduler, maintenance_status
+from top_counts import MAX_TOP_N, TOP_KINDS, intern_locations, parse_top_n, top_items
+from images import IMAGE_VARIANTS, collect_orphan_images, ensure_variant, save_original
+from migrations import migrate
+from partitions import partition_source
+from plates import normalize_plate, plate_map
+from response_cache import ResponseCache, data_version, request_key
+from singleflight import SingleFlight
+from staging import append_frame
+from warmup import Warmer, request_shapes
 
 # --- 配置 ---
 # 构建数据库文件的绝对路径
@@ -15,10 +42,26 @@ import uuid
 # 定义数据库文件路径
 # (修改) 更新数据库文件的相对路径，指向 backend/data/ 目录
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
-DB_FILE = os.path.join(SCRIPT_DIR, 'data', 'vehicle_data_optimized.db')
+# (新增) 允许通过环境变量 FLEET_DB_FILE 覆盖数据库路径，便于生产部署
+DB_FILE = os.environ.get('FLEET_DB_FILE', os.path.join(SCRIPT_DIR, 'data', 'vehicle_data_optimized.db'))
+# (新增) 多个 worker 进程之间转发数据变更事件所用的文件 (见 events.py)
+EVENTS_FILE = os.environ.get('FLEET_EVENTS_FILE', DB_FILE + '.events')
+# (新增) 连接参数，便于用 loadtest.py 对比不同设置下的锁竞争:
+#        FLEET_BUSY_TIMEOUT 为遇到写锁时的等待毫秒数 (默认 5000，与 sqlite3 模块一致)，
+#        FLEET_JOURNAL_MODE 非空时在每个连接上设置 journal_mode (例如 WAL)
+BUSY_TIMEOUT_MS = int(os.environ.get('FLEET_BUSY_TIMEOUT', 5000))
+JOURNAL_MODE = os.environ.get('FLEET_JOURNAL_MODE', '')
+# (新增) SSE 连接空闲时发送心跳的间隔 (秒)，防止代理服务器断开连接
+SSE_HEARTBEAT_SECONDS = 15
+# (新增) 每个 SSE 连接占用一个 gthread 线程: 每个进程最多 FLEET_SSE_MAX_STREAMS 个连接
+#        (默认 FLEET_THREADS 的一半)，每个连接最长 FLEET_SSE_MAX_SECONDS 秒后关闭，由浏览器重连
+SSE_MAX_STREAMS = int(os.environ.get('FLEET_SSE_MAX_STREAMS', max(1, int(os.environ.get('FLEET_THREADS', 4)) // 2)))
+SSE_MAX_SECONDS = int(os.environ.get('FLEET_SSE_MAX_SECONDS', 300))
 # (新增) 上传文件夹配置
 UPLOAD_FOLDER = os.path.join(SCRIPT_DIR, 'uploads', 'vehicle_images')
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
+# (新增) 图片文件名与内容一一对应，浏览器可以长期缓存 (一年)
+IMAGE_CACHE_MAX_AGE = 365 * 24 * 3600
 
 # (新增) 中英文列名映射
 COLUMN_MAPPING = {
@@ -65,6 +108,28 @@ COLUMN_MAPPING = {
     }
 }
 
+# (新增) 上传时可以用名称代替字典表 ID 的列 (ID 列中填写名称也可以)，
+#        不存在的名称会自动创建，见 ingest.py 和 DictionaryCache.get_or_create
+NAME_COLUMN_MAPPING = {
+    'vehicles': {'department_name': '部门'},
+    'violations': {'violation_type': '违章类型'},
+    'maintenance': {'provider_name': '维保服务商'},
+}
+
+
+# (新增) 数据管理页可写的表及其主键列
+ID_COLUMNS = {
+    'vehicles': 'vehicle_id',
+    'violations': 'violation_id',
+    'maintenance': 'maintenance_id',
+    'monthly_fuel_summary': 'summary_id'
+}
+# (新增) 批量写入允许的列: 模板中的列加上主键
+WRITABLE_COLUMNS = {table: set(COLUMN_MAPPING[table]) | {id_column} for table, id_column in ID_COLUMNS.items()}
+
+# (新增) 通过 vehicle_id 关联 vehicles 的事实表
+FACT_TABLES = ('violations', 'maintenance', 'monthly_fuel_summary')
+
 
 # --- Flask 应用初始化 ---
 app = Flask(__name__)
@@ -76,15 +141,350 @@ CORS(app)
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
 
+# (新增) --- 多车队分片 (见 fleets.py) ---
+# FLEET_SHARDS 指向车队注册表文件；各接口的 fleet 参数选择车队，不提供时为默认车队 (DB_FILE)
+FLEETS = FleetRegistry.load(os.environ.get('FLEET_SHARDS'))
+
+
+def current_fleet():
+    """当前请求的 fleet 参数对应的车队 (fleets.Fleet)；请求之外为默认车队。"""
+    fleet_id = request.args.get('fleet') if has_request_context() else None
+    return FLEETS.resolve(fleet_id, DB_FILE)
+
+
 # --- 数据库连接辅助函数 ---
 def get_db_connection():
     """创建并返回一个到 SQLite 数据库的连接。"""
-    conn = sqlite3.connect(DB_FILE)
+    # (修改) 连接当前请求所选车队的数据库
+    conn = sqlite3.connect(current_fleet().db_file, timeout=BUSY_TIMEOUT_MS / 1000)
+    if JOURNAL_MODE:
+        conn.execute(f"PRAGMA journal_mode = {JOURNAL_MODE}")
     # 设置 row_factory，使得查询结果可以像字典一样通过列名访问，方便后续转换为 JSON
     conn.row_factory = sqlite3.Row
     return conn
 
 
+# (新增) 只读快照 (见 snapshot.py)。设置 FLEET_READ_SNAPSHOT=1 后，概览、部门、车辆等汇总接口
+#        从主库的快照读取，不与数据管理的写入争用同一个数据库文件
+USE_READ_SNAPSHOT = os.environ.get('FLEET_READ_SNAPSHOT', '') not in ('', '0')
+READ_SNAPSHOT = None
+
+
+def get_read_snapshot():
+    """启用只读快照时返回 snapshot.ReadSnapshot，否则返回 None。快照只用于默认车队。"""
+    global READ_SNAPSHOT
+    if not current_fleet().is_default:
+        return None
+    if READ_SNAPSHOT is None and USE_READ_SNAPSHOT:
+        from snapshot import ReadSnapshot
+        READ_SNAPSHOT = ReadSnapshot(DB_FILE)
+    return READ_SNAPSHOT
+
+
+def get_read_connection():
+    """汇总类接口使用的连接: 启用只读快照时连接快照，否则与 get_db_connection() 相同。"""
+    snapshot = get_read_snapshot()
+    if snapshot is None:
+        return get_db_connection()
+    conn = snapshot.connect()
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def read_data_version():
+    """汇总类接口所读数据的版本 (见 response_cache.data_version)。"""
+    conn = get_read_connection()
+    try:
+        return data_version(conn)
+    finally:
+        conn.close()
+
+
+# (新增) --- 进程间共享的只读状态 ---
+# 字典表 (部门、违章类型、维保单位) 体积很小且极少变化，缓存 id -> 名称 的映射。
+# 生产环境下 gunicorn 以 preload 方式在 master 进程中导入本模块并调用
+# preload_shared_state()，fork 出来的 worker 通过写时复制共享这份数据；
+# 收到 SIGHUP 平滑重载时，master 会重新加载一次 (见 gunicorn.conf.py)。
+# 之后每个 worker 通过版本号自行发现字典表的变化 (见 dict_cache.py)。
+DICTIONARY_CACHE = DictionaryCache()
+
+
+def preload_shared_state():
+    """升级数据库结构并加载字典表缓存。数据库不存在时跳过。"""
+    if not os.path.exists(DB_FILE):
+        return DICTIONARY_CACHE.maps
+    conn = get_db_connection()
+    try:
+        migrate(conn)
+        maps = DICTIONARY_CACHE.refresh(conn)
+    finally:
+        conn.close()
+    # (新增) 启用只读快照时先按升级后的主库刷新快照，索引和预热都基于快照
+    snapshot = get_read_snapshot()
+    if snapshot is not None:
+        snapshot.refresh()
+    conn = get_read_connection()
+    try:
+        get_range_index(conn, block=True)
+        # (新增) 预热常用的汇总接口并等待完成，fork 出的 worker 直接继承已填充的响应缓存
+        WARMER.warm_now(data_version(conn))
+        return maps
+    finally:
+        conn.close()
+
+
+# (新增) 非默认车队各自的字典表缓存、前缀和索引和样本: 车队 ID -> FleetState
+FLEET_STATES = {}
+FLEET_STATES_LOCK = threading.Lock()
+
+
+class FleetState:
+    """一个非默认车队在本进程中的共享状态，与模块级的 DICTIONARY_CACHE、RANGE_INDEX、SAMPLE_STORE 对应。"""
+
+    def __init__(self, db_file):
+        self.db_file = db_file
+        self.dictionaries = DictionaryCache()
+        self.range_index = None
+        self.sample_store = None
+
+
+def fleet_state(fleet):
+    """返回车队的 FleetState，第一次访问 (或数据库文件变化) 时先升级该车队的数据库结构。"""
+    with FLEET_STATES_LOCK:
+        state = FLEET_STATES.get(fleet.fleet_id)
+        if state is None or state.db_file != fleet.db_file:
+            conn = sqlite3.connect(fleet.db_file, timeout=BUSY_TIMEOUT_MS / 1000)
+            try:
+                migrate(conn)
+            finally:
+                conn.close()
+            state = FLEET_STATES[fleet.fleet_id] = FleetState(fleet.db_file)
+        return state
+
+
+@app.before_request
+def record_activity():
+    """(新增) 记录最近一次请求的时间，后台维护据此判断服务是否空闲。"""
+    MAINTENANCE.touch()
+
+
+@app.before_request
+def check_fleet():
+    """(新增) fleet 参数指向未注册或数据库不存在的车队时返回 404。"""
+    try:
+        fleet = current_fleet()
+    except KeyError as e:
+        return jsonify({"error": f"未知的车队: {e.args[0]}"}), 404
+    if not fleet.is_default:
+        if not os.path.exists(fleet.db_file):
+            return jsonify({"error": f"车队 {fleet.fleet_id} 的数据库不存在"}), 404
+        fleet_state(fleet)
+
+
+def dictionary_cache():
+    """当前车队的字典表缓存 (dict_cache.DictionaryCache)。"""
+    fleet = current_fleet()
+    return DICTIONARY_CACHE if fleet.is_default else fleet_state(fleet).dictionaries
+
+
+def get_dictionaries(conn):
+    """返回 {'departments': {id: 名称}, 'violation_types': {...}, 'service_providers': {...}}。"""
+    return dictionary_cache().get(conn)
+
+
+# (新增) 按月份的前缀和索引，任意月份区间的汇总和排名不再扫描原始记录 (见 range_index.py)。
+# 依赖 numpy，第一次使用时才导入；preload 时在 master 进程中构建，worker 共享。
+RANGE_INDEX = None
+
+
+def get_range_index(conn, block=False):
+    """
+    返回与数据库同步后的前缀和索引 (range_index.PrefixSums)。
+    (修改) 索引在后台全量重建期间返回旧索引，并标记当前响应不写入缓存；block 为真时等待重建完成。
+    """
+    global RANGE_INDEX
+    from range_index import RangeIndex
+    fleet = current_fleet()
+    if not fleet.is_default:
+        state = fleet_state(fleet)
+        if state.range_index is None:
+            state.range_index = RangeIndex()
+        range_index = state.range_index
+    else:
+        if RANGE_INDEX is None:
+            RANGE_INDEX = RangeIndex()
+        range_index = RANGE_INDEX
+    index = range_index.sync(conn, block)
+    if range_index.rebuilding and has_request_context():
+        g.stale_index = True
+    return index
+
+
+# (新增) 近似查询模式 (approx=true) 使用的分层样本 (见 sampling.py)，第一次使用时才在后台构建
+SAMPLE_STORE = None
+
+
+def get_sample(conn):
+    """
+    返回按变更日志增量维护的分层样本 (sampling.StratifiedSample)。
+    (修改) 样本正在后台构建时返回 None (调用方改用精确结果) 或旧样本，并标记当前响应不写入缓存。
+    """
+    global SAMPLE_STORE
+    from sampling import SampleStore
+    fleet = current_fleet()
+    if not fleet.is_default:
+        state = fleet_state(fleet)
+        if state.sample_store is None:
+            state.sample_store = SampleStore()
+        store = state.sample_store
+    else:
+        if SAMPLE_STORE is None:
+            SAMPLE_STORE = SampleStore()
+        store = SAMPLE_STORE
+    sample = store.sync(conn)
+    if store.building and has_request_context():
+        g.stale_index = True
+    return sample
+
+
+def approx_requested():
+    """approx 参数为 true / 1 / yes 时使用近似查询模式。"""
+    return request.args.get('approx', '').lower() in ('1', 'true', 'yes')
+
+
+# (新增) --- 汇总接口的响应缓存和预热 (见 response_cache.py、warmup.py) ---
+RESPONSE_CACHE = ResponseCache()
+# (新增) 缓存未命中时，并发的相同请求只计算一次 (见 singleflight.py)；
+#        设置 FLEET_SINGLEFLIGHT_DIR 后 (gunicorn 多 worker 时的默认值见 gunicorn.conf.py) 通过文件锁在多个 worker 之间合并
+SINGLE_FLIGHT = SingleFlight(os.environ.get('FLEET_SINGLEFLIGHT_DIR') or None)
+
+
+def cached_response(view):
+    """
+    装饰 GET 汇总接口: 以 (路径, 规范化参数) 和当前数据版本缓存成功的 JSON 响应。
+    数据版本变化时同时安排后台预热 (见 warmup.Warmer.schedule)。
+    (新增) 未命中时相同的并发请求合并为一次计算，共享同一个响应体。
+    (新增) 缓存键包含 fleet 参数，各车队的数据版本互不影响；预热只针对默认车队。
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        version = read_data_version()
+        if version is None:
+            return view(*args, **kwargs)
+        if current_fleet().is_default:
+            WARMER.schedule(version)
+        key = request_key(request.path, request.args)
+        body = RESPONSE_CACHE.get(key, version)
+        if body is not None:
+            return Response(body, mimetype='application/json')
+
+        def compute():
+            response = app.make_response(view(*args, **kwargs))
+            # (新增) 基于旧索引 (后台重建中) 算出的响应不缓存
+            return response.status_code, response.mimetype, response.get_data(), not g.pop('stale_index', False)
+
+        status, mimetype, body, cacheable = SINGLE_FLIGHT.do(key, version, compute)
+        if cacheable and status == 200 and mimetype == 'application/json':
+            RESPONSE_CACHE.put(key, version, body)
+        return Response(body, status=status, mimetype=mimetype)
+    return wrapper
+
+
+def warmup_urls():
+    """当前数据下需要预热的请求 (月份来自前缀和索引，部门来自字典表缓存)。"""
+    conn = get_read_connection()
+    try:
+        months = get_range_index(conn).months
+        department_ids = sorted(get_dictionaries(conn)['departments'])
+    finally:
+        conn.close()
+    return request_shapes(months, department_ids)
+
+
+# (修改) 与 single-flight 共用 FLEET_SINGLEFLIGHT_DIR: 整个服务同一数据版本只由一个 worker 预热
+WARMER = Warmer(lambda: app.test_client(), warmup_urls, shared_dir=os.environ.get('FLEET_SINGLEFLIGHT_DIR') or None)
+
+# (新增) --- 数据库后台维护 (ANALYZE、WAL 检查点、空闲页回收，见 maintenance.py) ---
+# 每个进程一个后台线程，gunicorn 在 fork 出 worker 之后启动 (见 gunicorn.conf.py 中的 post_fork)
+MAINTENANCE = MaintenanceScheduler(lambda: [(fleet.fleet_id, fleet.db_file) for fleet in FLEETS.fleets(DB_FILE)])
+
+
+def trend_params():
+    """读取趋势图的 granularity (week/month/quarter/year) 和 max_points 参数，不合法时抛出 ValueError。"""
+    return parse_granularity(request.args.get('granularity')), parse_max_points(request.args.get('max_points'))
+
+
+# (新增) --- 数据变更事件 ---
+EVENT_BROKER = EventBroker(EVENTS_FILE)
+
+# 各表用于确定 "受影响月份" 的时间列
+EVENT_TIME_COLUMNS = {
+    'violations': 'violation_time',
+    'maintenance': 'request_time',
+}
+
+
+def _row_month(table, row):
+    """返回一行事实数据所属的月份 (YYYY-MM)，无法确定时返回 None"""
+    if table == 'monthly_fuel_summary':
+        try:
+            return f"{int(row['year'])}-{int(row['month']):02d}"
+        except (KeyError, TypeError, ValueError):
+            return None
+    value = row.get(EVENT_TIME_COLUMNS.get(table, ''))
+    return str(value)[:7] if value else None
+
+
+def publish_change(conn, table, op, rows):
+    """
+    在写操作提交后发布数据变更事件。
+    事件包含受影响的表、车牌号、部门 ID 和月份；months 为 None 表示影响所有月份 (例如车辆信息变更)。
+    (新增) fleet 为变更所属的车队 ID。
+    发布失败不影响写操作本身的结果。
+    """
+    rows = [dict(row) for row in rows if row]
+    plates = sorted({str(row['plate_number']) for row in rows if row.get('plate_number')})
+    departments = {int(row['department_id']) for row in rows if table == 'vehicles' and row.get('department_id') is not None}
+    try:
+        if plates:
+            departments.update(
+                int(row[0]) for row in conn.execute(
+                    'SELECT DISTINCT department_id FROM vehicles WHERE plate_number IN (SELECT value FROM json_each(?))',
+                    (json.dumps(plates),)
+                ) if row[0] is not None
+            )
+    except sqlite3.Error:
+        pass
+    months = None if table not in FACT_TABLES else sorted({m for m in (_row_month(table, row) for row in rows) if m})
+    fleet = current_fleet()
+    event = {
+        'table': table,
+        'op': op,
+        'plates': plates,
+        'departments': sorted(departments),
+        'months': months,
+        'fleet': fleet.fleet_id,  # (新增) 变更所属的车队
+    }
+
+    def announce():
+        EVENT_BROKER.publish(event)
+        if not fleet.is_default:
+            return
+        # (新增) 数据已变化，在后台按新版本重新预热汇总接口
+        try:
+            WARMER.schedule(read_data_version())
+        except sqlite3.Error:
+            pass
+
+    # (修改) 启用只读快照时由后台线程合并刷新快照，快照包含这次写入后再发布事件，
+    #        客户端收到事件后重新请求即可读到新数据 (见 snapshot.ReadSnapshot.refresh_later)
+    snapshot = get_read_snapshot()
+    if snapshot is not None:
+        snapshot.refresh_later(announce)
+    else:
+        announce()
+
+
 # --- API 路由定义 ---
 
 # 根路由，用于简单测试后端是否正在运行
@@ -105,10 +505,12 @@ def get_vehicles():
         conn = get_db_connection()
         # 2. 执行 SQL 查询
         vehicles = conn.execute('SELECT * FROM vehicles LIMIT 10').fetchall()
+        # (新增) 定点存储的金额换算回原单位 (见 fixed_point.py)
+        scales = column_scales(conn)
         # 3. 关闭数据库连接
         conn.close()
         # 4. 将查询结果 (Row 对象列表) 转换为字典列表，然后用 jsonify 转换为 JSON 格式的响应
-        return jsonify([dict(row) for row in vehicles])
+        return jsonify([from_storage(scales, 'vehicles', dict(row)) for row in vehicles])
     except sqlite3.Error as e:
         # 如果发生数据库相关的错误，返回一个包含错误信息的 JSON 和 500 状态码
         return jsonify({"error": f"数据库错误: {e}"}), 500
@@ -119,145 +521,99 @@ def get_vehicles():
 # --- 新增 ---
 # 为概览页提供汇总数据的 API 接口
 @app.route('/api/overview/summary', methods=['GET'])
+@cached_response
 def get_overview_summary():
     """
     API 端点，用于获取概览页所需的汇总数据。
     (新增) 支持 start_month 和 end_month URL参数进行时间范围过滤。
+    (新增) 支持 granularity (week/month/quarter/year) 和 max_points 参数，见 granularity.py。
+    (新增) approx=true 时汇总和趋势来自分层样本 (见 sampling.py)，返回估计值、
+           confidence_intervals 和 approximate 标记；按周请求时趋势回退为按月。
+           样本尚在构建时返回精确结果，approximate 为 false。
     """
+    approx = approx_requested()
+    try:
+        granularity, max_points = trend_params()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     try:
         # 从 URL 查询参数中获取月份，如果没有则为 None
         start_month = request.args.get('start_month') # 格式: YYYY-MM
         end_month = request.args.get('end_month')     # 格式: YYYY-MM
 
-        conn = get_db_connection()
+        conn = get_read_connection()
+        dictionaries = get_dictionaries(conn)
         
         # 1. 查询 KPI (这些通常是全时间范围的，不受筛选影响)
         total_vehicles = conn.execute('SELECT COUNT(*) FROM vehicles').fetchone()[0]
-        total_departments = conn.execute('SELECT COUNT(*) FROM departments').fetchone()[0]
+        total_departments = len(dictionaries['departments'])
         
         # (新增) 查询各部门车辆数分布
-        vehicles_per_department = conn.execute("""
-            SELECT d.department_id, d.name, COUNT(v.vehicle_id) as count
-            FROM departments d
-            LEFT JOIN vehicles v ON d.department_id = v.department_id
-            GROUP BY d.department_id, d.name
-            ORDER BY count DESC
-        """).fetchall()
+        # (修改) 只按整数 department_id 分组，部门名称从字典表缓存中补齐
+        vehicle_counts = {
+            row['department_id']: row['count']
+            for row in conn.execute("""
+                SELECT department_id, COUNT(vehicle_id) as count
+                FROM vehicles
+                GROUP BY department_id
+            """).fetchall()
+        }
+        vehicles_per_department = sorted(
+            ({'department_id': dept_id, 'name': name, 'count': vehicle_counts.get(dept_id, 0)}
+             for dept_id, name in dictionaries['departments'].items()),
+            key=lambda row: row['count'], reverse=True
+        )
 
         # (已移除) 不再查询各部门车辆数
 
-        # --- 动态构建趋势查询的 WHERE 子句 ---
-        
-        # (修改) 重构WHERE子句的构建逻辑，使其更清晰和健壮
-        time_filter_params = {}
-        # 为带别名和不带别名的查询分别准备 WHERE 子句
-        violation_where_aliased = "WHERE v.violation_time IS NOT NULL"
-        violation_where_no_alias = "WHERE violation_time IS NOT NULL"
-        maint_where_aliased = "WHERE m.request_time IS NOT NULL"
-        maint_where_no_alias = "WHERE request_time IS NOT NULL"
-        fuel_where = ""
-
-        if start_month and end_month:
-            time_filter_params = {'start': f'{start_month}-01', 'end': f'{end_month}-31'}
-            
-            # 为每个子句附加时间范围条件
-            violation_where_aliased += " AND date(v.violation_time) BETWEEN date(:start) AND date(:end)"
-            violation_where_no_alias += " AND date(violation_time) BETWEEN date(:start) AND date(:end)"
-            maint_where_aliased += " AND date(m.request_time) BETWEEN date(:start) AND date(:end)"
-            maint_where_no_alias += " AND date(request_time) BETWEEN date(:start) AND date(:end)"
-            fuel_where = "WHERE date(year || '-' || printf('%02d', month) || '-01') BETWEEN date(:start) AND date(:end)"
-
-
-        # 3. 查询月度违章趋势
-        violation_trend = conn.execute(f"""
-            SELECT strftime('%Y-%m', violation_time) as month, COUNT(violation_id) as count
-            FROM violations
-            {violation_where_no_alias}
-            GROUP BY month ORDER BY month
-        """, time_filter_params).fetchall()
-
-        # 4. 查询月度油耗和里程趋势
-        fuel_mileage_trend = conn.execute(f"""
-            SELECT year || '-' || printf('%02d', month) as month, 
-                   SUM(total_fuel_amount) as total_fuel,
-                   SUM(distance_driven) as total_distance,
-                   SUM(total_fuel_cost) as total_fuel_cost
-            FROM monthly_fuel_summary s
-            {fuel_where}
-            GROUP BY month ORDER BY month
-        """, time_filter_params).fetchall()
-
-        # 5. 查询月度维保费用趋势
-        maintenance_trend = conn.execute(f"""
-            SELECT strftime('%Y-%m', request_time) as month, 
-                   SUM(maintenance_cost) as total_cost,
-                   COUNT(maintenance_id) as total_count
-            FROM maintenance
-            {maint_where_no_alias}
-            GROUP BY month ORDER BY month
-        """, time_filter_params).fetchall()
+        # 3. (修改) 违章、油耗里程、维保趋势来自前缀和索引中预先累计的桶，不再扫描事实表
+        #    (新增) 近似模式下来自分层样本的估计值
+        sample = get_sample(conn) if approx else None
+        range_index = sample or get_range_index(conn)
+        violation_granularity, violation_labels, violation_series = range_index.series(
+            'violations', granularity, start_month, end_month)[:3]
+        fuel_granularity, fuel_labels, fuel_series = range_index.series(
+            'monthly_fuel_summary', granularity, start_month, end_month)[:3]
+        maint_granularity, maint_labels, maint_series = range_index.series(
+            'maintenance', granularity, start_month, end_month)[:3]
         
         # (新增) --- 查询深度洞察 KPI ---
+        # (修改) 最高频违章路段、违章原因和最常用维保单位都读取按月维护的计数表 (见 top_counts.py)，
+        #        不再对违章地点文本做 GROUP BY
         insight_kpis = {}
         
         # 最高频违章路段
-        top_location = conn.execute(f"""
-            SELECT v.violation_location, COUNT(v.violation_id) as count
-            FROM violations v
-            {violation_where_aliased} AND v.violation_location IS NOT NULL AND v.violation_location != ''
-            GROUP BY v.violation_location
-            ORDER BY count DESC LIMIT 1
-        """, time_filter_params).fetchone()
-        insight_kpis['top_violation_location'] = dict(top_location) if top_location else None
-
-        # 最高频违章原因
-        top_reason = conn.execute(f"""
-            SELECT t.description, COUNT(v.violation_id) as count
-            FROM violations v
-            JOIN violation_types t ON v.violation_type_id = t.violation_type_id
-            {violation_where_aliased}
-            GROUP BY t.description
-            ORDER BY count DESC LIMIT 1
-        """, time_filter_params).fetchone()
-        insight_kpis['top_violation_reason'] = dict(top_reason) if top_reason else None
+        top_location = top_items(conn, 'location', 1, start_month, end_month)
+        insight_kpis['top_violation_location'] = (
+            {'violation_location': top_location[0]['name'], 'count': top_location[0]['count']} if top_location else None
+        )
+
+        # 最高频违章原因 (名称从字典表缓存中获取)
+        top_reason = top_items(conn, 'violation_type', 1, start_month, end_month, dictionaries['violation_types'])
+        insight_kpis['top_violation_reason'] = (
+            {'description': top_reason[0]['name'], 'count': top_reason[0]['count']} if top_reason else None
+        )
 
         # 最常用维保单位
-        top_provider = conn.execute(f"""
-            SELECT p.name, COUNT(m.maintenance_id) as count
-            FROM maintenance m
-            JOIN service_providers p ON m.provider_id = p.provider_id
-            {maint_where_aliased}
-            GROUP BY p.name
-            ORDER BY count DESC LIMIT 1
-        """, time_filter_params).fetchone()
-        insight_kpis['top_maintenance_provider'] = dict(top_provider) if top_provider else None
+        top_provider = top_items(conn, 'provider', 1, start_month, end_month, dictionaries['service_providers'])
+        insight_kpis['top_maintenance_provider'] = (
+            {'name': top_provider[0]['name'], 'count': top_provider[0]['count']} if top_provider else None
+        )
 
         
         conn.close()
 
         # (修改) 准备图表数据时，移除 vehicles_per_department
         chart_data = {
-            'violation_trend': {
-                'labels': [row['month'] for row in violation_trend],
-                'data': [row['count'] for row in violation_trend]
-            },
-            'fuel_trend': {
-                'labels': [row['month'] for row in fuel_mileage_trend],
-                'data': [row['total_fuel'] for row in fuel_mileage_trend]
-            },
-            'mileage_trend': {
-                'labels': [row['month'] for row in fuel_mileage_trend],
-                'data': [row['total_distance'] for row in fuel_mileage_trend]
-            },
-            'maintenance_trend': {
-                'labels': [row['month'] for row in maintenance_trend],
-                'data': [row['total_cost'] for row in maintenance_trend]
-            },
+            'violation_trend': trend(violation_labels, violation_series['violation_count'],
+                                     violation_granularity, max_points),
+            'fuel_trend': trend(fuel_labels, fuel_series['total_fuel'], fuel_granularity, max_points),
+            'mileage_trend': trend(fuel_labels, fuel_series['total_distance'], fuel_granularity, max_points),
+            'maintenance_trend': trend(maint_labels, maint_series['total_maintenance_cost'],
+                                       maint_granularity, max_points),
             # (新增) 维保次数趋势
-            'maintenance_count_trend': {
-                'labels': [row['month'] for row in maintenance_trend],
-                'data': [row['total_count'] for row in maintenance_trend]
-            },
+            'maintenance_count_trend': trend(maint_labels, maint_series['maintenance_count'],
+                                             maint_granularity, max_points),
             # (新增) 部门车辆分布图数据
             'vehicles_per_department': {
                 'labels': [row['name'] for row in vehicles_per_department],
@@ -272,16 +628,31 @@ def get_overview_summary():
                 'total_vehicles': total_vehicles,
                 'total_departments': total_departments,
                 # (新增) 增加汇总数据
-                'total_distance': sum(r['total_distance'] for r in fuel_mileage_trend),
-                'total_fuel': sum(r['total_fuel'] for r in fuel_mileage_trend),
-                'total_fuel_cost': sum(r['total_fuel_cost'] for r in fuel_mileage_trend),
-                'total_violations': sum(r['count'] for r in violation_trend),
-                'total_maintenance_cost': sum(r['total_cost'] for r in maintenance_trend),
-                'total_maintenance_count': sum(r['total_count'] for r in maintenance_trend)
+                'total_distance': round(sum(fuel_series['total_distance']), 6),
+                'total_fuel': round(sum(fuel_series['total_fuel']), 6),
+                'total_fuel_cost': round(sum(fuel_series['total_fuel_cost']), 6),
+                'total_violations': sum(violation_series['violation_count']),
+                'total_maintenance_cost': round(sum(maint_series['total_maintenance_cost']), 6),
+                'total_maintenance_count': sum(maint_series['maintenance_count'])
             },
             'charts': chart_data,
             'insight_kpis': insight_kpis # (新增)
         }
+
+        # (新增) 近似模式: KPI 的 95% 置信区间 (记录数是精确的) 和样本信息
+        if sample is not None:
+            kpi_metrics = {
+                'total_distance': 'total_distance', 'total_fuel': 'total_fuel',
+                'total_fuel_cost': 'total_fuel_cost', 'total_violations': 'violation_count',
+                'total_maintenance_cost': 'total_maintenance_cost', 'total_maintenance_count': 'maintenance_count',
+            }
+            intervals = range_index.totals(list(kpi_metrics.values()), start_month, end_month)
+            summary_data['kpi'].update((key, intervals[metric]['estimate']) for key, metric in kpi_metrics.items())
+            summary_data['confidence_intervals'] = {key: intervals[metric] for key, metric in kpi_metrics.items()}
+            summary_data['approximate'] = True
+            summary_data['sample'] = range_index.describe()
+        elif approx:
+            summary_data['approximate'] = False
         
         return jsonify(summary_data)
         
@@ -294,13 +665,18 @@ def get_overview_summary():
 #       部门总览页面的 API 端点
 # =====================================================
 @app.route('/api/department/summary', methods=['GET'])
+@cached_response
 def get_department_summary():
     """
     API 端点，用于获取部门总览页所需的数据。
     - 按部门汇总各项指标（里程、油耗、违章、维保）
     - 支持时间范围筛选
     - (修改) 不再支持分页，返回所有部门
+    - (新增) approx=true 时各项合计来自分层样本的估计值 (见 sampling.py)，
+      部门和 KPI 另附 confidence_intervals，并返回 approximate 标记；
+      样本尚在构建时返回精确结果，approximate 为 false
     """
+    approx = approx_requested()
     try:
         # (移除) 移除分页参数
         # page = request.args.get('page', default=1, type=int)
@@ -310,20 +686,25 @@ def get_department_summary():
         start_month = request.args.get('start_month')
         end_month = request.args.get('end_month')
         
-        conn = get_db_connection()
+        conn = get_read_connection()
 
         # (移除) 移除部门总数查询
         # total_departments_count = conn.execute('SELECT COUNT(*) FROM departments').fetchone()[0]
 
         # (修改) 移除分页 LIMIT 和 OFFSET
-        depts_query = """
-            SELECT d.department_id, d.name, COUNT(v.vehicle_id) as vehicle_count
-            FROM departments d
-            LEFT JOIN vehicles v ON d.department_id = v.department_id
-            GROUP BY d.department_id, d.name
-            ORDER BY d.department_id
-        """
-        departments = {row['department_id']: dict(row) for row in conn.execute(depts_query).fetchall()}
+        # (修改) 部门列表来自字典表缓存，只需按 department_id 统计车辆数
+        vehicle_counts = {
+            row['department_id']: row['vehicle_count']
+            for row in conn.execute("""
+                SELECT department_id, COUNT(vehicle_id) as vehicle_count
+                FROM vehicles
+                GROUP BY department_id
+            """).fetchall()
+        }
+        departments = {
+            dept_id: {'department_id': dept_id, 'name': name, 'vehicle_count': vehicle_counts.get(dept_id, 0)}
+            for dept_id, name in sorted(get_dictionaries(conn)['departments'].items())
+        }
         
         # 如果没有部门，直接返回空结果
         if not departments:
@@ -335,91 +716,36 @@ def get_department_summary():
             })
 
 
-        # 初始化聚合数据
+        # (修改) 各部门和全局的区间合计都来自前缀和索引，每项指标只需两次查表和一次减法
+        summary_metrics = ('total_distance', 'total_fuel', 'violation_count', 'total_maintenance_cost')
+        sample = get_sample(conn) if approx else None
+        if sample is not None:
+            department_intervals = sample.department_totals(summary_metrics, start_month, end_month)
+            fleet_intervals = sample.totals(summary_metrics, start_month, end_month)
+            department_totals = {
+                dept_id: {metric: ci['estimate'] for metric, ci in intervals.items()}
+                for dept_id, intervals in department_intervals.items()
+            }
+            fleet_totals = {metric: ci['estimate'] for metric, ci in fleet_intervals.items()}
+        else:
+            range_index = get_range_index(conn)
+            department_totals = range_index.department_totals(start_month, end_month, summary_metrics)
+            fleet_totals = range_index.fleet_totals(start_month, end_month, summary_metrics)
         for dept_id in departments:
-            departments[dept_id].update({
-                'total_distance': 0, 'total_fuel': 0, 'violation_count': 0, 'total_maintenance_cost': 0
-            })
+            departments[dept_id].update(department_totals.get(dept_id) or dict.fromkeys(summary_metrics, 0))
+            if sample is not None:
+                departments[dept_id]['confidence_intervals'] = department_intervals.get(dept_id) or {
+                    metric: {'estimate': 0, 'low': 0, 'high': 0, 'margin': 0} for metric in summary_metrics
+                }
 
-        # --- 动态构建 WHERE 子句 ---
-        params = {}
-        where_clauses = {}
-        if start_month and end_month:
-            params = {'start': f'{start_month}-01', 'end': f'{end_month}-31'}
-            where_clauses['fuel'] = "WHERE date(s.year || '-' || printf('%02d', s.month) || '-01') BETWEEN date(:start) AND date(:end)"
-            where_clauses['violation'] = "WHERE date(i.violation_time) BETWEEN date(:start) AND date(:end)"
-            where_clauses['maint'] = "WHERE date(m.request_time) BETWEEN date(:start) AND date(:end)"
-
-        # 1. 聚合各部门的里程和油耗
-        fuel_mileage_query = f"""
-            SELECT v.department_id, SUM(s.distance_driven) as total_distance, SUM(s.total_fuel_amount) as total_fuel
-            FROM monthly_fuel_summary s
-            JOIN vehicles v ON s.plate_number = v.plate_number
-            {where_clauses.get('fuel', '')}
-            AND v.department_id IN ({','.join('?' for _ in departments.keys())})
-            GROUP BY v.department_id
-        """
-        for row in conn.execute(fuel_mileage_query, list(params.values()) + list(departments.keys())).fetchall():
-            if row['department_id'] in departments:
-                departments[row['department_id']].update(dict(row))
-
-        # 2. 聚合各部门的违章数
-        violations_query = f"""
-            SELECT v.department_id, COUNT(i.violation_id) as violation_count
-            FROM violations i
-            JOIN vehicles v ON i.plate_number = v.plate_number
-            {where_clauses.get('violation', '')}
-            AND v.department_id IN ({','.join('?' for _ in departments.keys())})
-            GROUP BY v.department_id
-        """
-        for row in conn.execute(violations_query, list(params.values()) + list(departments.keys())).fetchall():
-            if row['department_id'] in departments:
-                departments[row['department_id']].update(dict(row))
-
-        # 3. 聚合各部门的维保费用
-        maint_query = f"""
-            SELECT v.department_id, SUM(m.maintenance_cost) as total_maintenance_cost
-            FROM maintenance m
-            JOIN vehicles v ON m.plate_number = v.plate_number
-            {where_clauses.get('maint', '')}
-            AND v.department_id IN ({','.join('?' for _ in departments.keys())})
-            GROUP BY v.department_id
-        """
-        # (修改) 更新参数传递方式以匹配 IN 子句
-        maint_params = list(params.values()) + list(departments.keys())
-        for row in conn.execute(maint_query, maint_params).fetchall():
-            if row['department_id'] in departments:
-                departments[row['department_id']].update(dict(row))
-        
-        # (新增) 为了计算全局KPI，需要查询所有部门的数据，不受分页影响
-        # 1. 查询所有部门的车辆总数
         total_vehicles_count = conn.execute('SELECT COUNT(*) FROM vehicles').fetchone()[0]
-        # 2. 查询所有部门在时间范围内的总里程、油耗、违章、维保
-        all_depts_fuel_mileage = conn.execute(f"""
-            SELECT SUM(s.distance_driven) as total_distance, SUM(s.total_fuel_amount) as total_fuel
-            FROM monthly_fuel_summary s {where_clauses.get('fuel', '').replace('s.year', 'year').replace('s.month','month')}
-        """, params).fetchone()
-        
-        all_depts_violations = conn.execute(f"""
-            SELECT COUNT(i.violation_id) as violation_count
-            FROM violations i {where_clauses.get('violation', '').replace('i.violation_time','violation_time')}
-        """, params).fetchone()
-
-        all_depts_maint = conn.execute(f"""
-            SELECT SUM(m.maintenance_cost) as total_maintenance_cost
-            FROM maintenance m {where_clauses.get('maint', '').replace('m.request_time','request_time')}
-        """, params).fetchone()
-
         conn.close()
 
-        # (修改) 基于对所有部门的查询来计算全局 KPI
+        # 全局 KPI 包括未关联到车辆的记录
         kpis = {
             'total_vehicles': total_vehicles_count,
             'total_departments': len(departments), # (修改) 直接使用查询到的部门数量
-            'total_distance': all_depts_fuel_mileage['total_distance'] or 0,
-            'total_fuel': all_depts_fuel_mileage['total_fuel'] or 0,
-            'violation_count': all_depts_violations['violation_count'] or 0,
-            'total_maintenance_cost': all_depts_maint['total_maintenance_cost'] or 0,
+            **fleet_totals,
         }
 
         # 将字典转换为列表，方便前端 v-for 渲染
@@ -428,10 +754,15 @@ def get_department_summary():
         # (移除) 移除分页元数据
         
         # (修改) 包装响应数据，移除分页信息
-        return jsonify({
+        response = {
             'departments': department_list,
             'kpis': kpis
-        })
+        }
+        if sample is not None:
+            response.update(confidence_intervals=fleet_intervals, approximate=True, sample=sample.describe())
+        elif approx:
+            response['approximate'] = False
+        return jsonify(response)
 
     except sqlite3.Error as e:
         return jsonify({"error": f"数据库错误: {e}"}), 500
@@ -439,7 +770,15 @@ def get_department_summary():
         return jsonify({"error": f"发生意外错误: {e}"}), 500
 
 
+def _with_department_name(row, department_names):
+    """把查询结果行转换为字典，并用 department_id 替换为 department_name。"""
+    item = dict(row)
+    item['department_name'] = department_names.get(item.pop('department_id'))
+    return item
+
+
 @app.route('/api/vehicle/summary', methods=['GET'])
+@cached_response
 def get_vehicle_summary():
     """
     API 端点，用于获取车辆总览页所需的数据。
@@ -465,128 +804,48 @@ def get_vehicle_summary():
         sort_field = valid_sort_fields[sort_by]
         sort_direction = 'DESC' if sort_order.lower() == 'desc' else 'ASC'
         
-        conn = get_db_connection()
-        
-        # 构建时间筛选条件
-        params = {}
-        where_clauses = {}
-        if start_month and end_month:
-            params = {'start': f'{start_month}-01', 'end': f'{end_month}-31'}
-            where_clauses['fuel'] = "WHERE date(s.year || '-' || printf('%02d', s.month) || '-01') BETWEEN date(:start) AND date(:end)"
-            where_clauses['violation'] = "WHERE date(i.violation_time) BETWEEN date(:start) AND date(:end)"
-            where_clauses['maint'] = "WHERE date(m.request_time) BETWEEN date(:start) AND date(:end)"
-        
-        # 1. 获取车辆基本信息和部门名称
-        base_query = """
-            SELECT v.vehicle_id, v.plate_number, v.registration_date as purchase_date, 
-                   d.name as department_name
-            FROM vehicles v
-            LEFT JOIN departments d ON v.department_id = d.department_id
-        """
-        
-        # 2. 构建车辆总数查询
-        count_query = """
-            SELECT COUNT(*) as total_vehicles FROM vehicles
-        """
-        total_vehicles = conn.execute(count_query).fetchone()['total_vehicles']
-        
-        # 3. 获取里程和油耗数据
-        mileage_fuel_query = f"""
-            SELECT v.plate_number,
-                   SUM(s.distance_driven) as total_distance,
-                   SUM(s.total_fuel_amount) as total_fuel
+        conn = get_read_connection()
+
+        # 1. 获取车辆基本信息
+        # (修改) 不再 JOIN departments，部门名称在 Python 中根据 department_id 补齐
+        department_names = get_dictionaries(conn)['departments']
+        vehicles = [_with_department_name(row, department_names) for row in conn.execute("""
+            SELECT v.vehicle_id, v.plate_number, v.registration_date as purchase_date,
+                   v.department_id
             FROM vehicles v
-            LEFT JOIN monthly_fuel_summary s ON v.plate_number = s.plate_number
-            {where_clauses.get('fuel', '')}
-            GROUP BY v.plate_number
-        """
-        
-        # 4. 获取违章数据
-        violations_query = f"""
-            SELECT v.plate_number,
-                   COUNT(i.violation_id) as violation_count
-            FROM vehicles v
-            LEFT JOIN violations i ON v.plate_number = i.plate_number
-            {where_clauses.get('violation', '')}
-            GROUP BY v.plate_number
-        """
-        
-        # 5. 获取维保数据
-        maintenance_query = f"""
-            SELECT v.plate_number,
-                   SUM(m.maintenance_cost) as total_maintenance_cost
-            FROM vehicles v
-            LEFT JOIN maintenance m ON v.plate_number = m.plate_number
-            {where_clauses.get('maint', '')}
-            GROUP BY v.plate_number
-        """
-        
-        # 6. 构建完整汇总查询
-        full_query = f"""
-            SELECT b.*, 
-                   COALESCE(mf.total_distance, 0) as total_distance,
-                   COALESCE(mf.total_fuel, 0) as total_fuel,
-                   COALESCE(v.violation_count, 0) as violation_count,
-                   COALESCE(m.total_maintenance_cost, 0) as total_maintenance_cost
-            FROM ({base_query}) b
-            LEFT JOIN ({mileage_fuel_query}) mf ON b.plate_number = mf.plate_number
-            LEFT JOIN ({violations_query}) v ON b.plate_number = v.plate_number
-            LEFT JOIN ({maintenance_query}) m ON b.plate_number = m.plate_number
-            ORDER BY {sort_field} {sort_direction}
-            LIMIT :limit OFFSET :offset
-        """
-        
-        # 执行分页查询
-        offset = (page - 1) * per_page
-        params.update({'limit': per_page, 'offset': offset})
-        vehicles_paged = conn.execute(full_query, params).fetchall()
-        
-        # (修改) 获取所有车辆的汇总数据，用于图表排名计算
-        all_vehicles_summary_query = f"""
-            SELECT b.*, 
-                   COALESCE(mf.total_distance, 0) as total_distance,
-                   COALESCE(mf.total_fuel, 0) as total_fuel,
-                   COALESCE(v.violation_count, 0) as violation_count,
-                   COALESCE(m.total_maintenance_cost, 0) as total_maintenance_cost
-            FROM ({base_query}) b
-            LEFT JOIN ({mileage_fuel_query}) mf ON b.plate_number = mf.plate_number
-            LEFT JOIN ({violations_query}) v ON b.plate_number = v.plate_number
-            LEFT JOIN ({maintenance_query}) m ON b.plate_number = m.plate_number
-        """
-        all_vehicles_summary = conn.execute(all_vehicles_summary_query, {k: v for k, v in params.items() if k not in ['limit', 'offset']}).fetchall()
+            ORDER BY v.vehicle_id
+        """).fetchall()]
+        total_vehicles = len(vehicles)
+
+        # 2. (修改) 各车辆在时间范围内的合计来自前缀和索引，不再对事实表做 GROUP BY；
+        #    排序、分页和图表排名都在数组上向量化完成，值相同时保持 vehicle_id 顺序
+        from range_index import rank_order, to_json_numbers
+        summary_metrics = tuple(valid_sort_fields.values())
+        totals = get_range_index(conn).vehicle_totals(
+            [vehicle['vehicle_id'] for vehicle in vehicles], start_month, end_month, summary_metrics)
+        conn.close()
+        for vehicle, values in zip(vehicles, totals):
+            vehicle.update(zip(summary_metrics, to_json_numbers(values)))
 
-        # (新增) 基于所有车辆的汇总数据计算 KPI
-        kpis = {
-            'total_distance': 0,
-            'total_fuel': 0,
-            'violation_count': 0,
-            'total_maintenance_cost': 0,
-        }
-        if all_vehicles_summary:
-            kpis['total_distance'] = sum(row['total_distance'] for row in all_vehicles_summary)
-            kpis['total_fuel'] = sum(row['total_fuel'] for row in all_vehicles_summary)
-            kpis['violation_count'] = sum(row['violation_count'] for row in all_vehicles_summary)
-            kpis['total_maintenance_cost'] = sum(row['total_maintenance_cost'] for row in all_vehicles_summary)
+        # 3. 分页
+        order = rank_order(totals[:, summary_metrics.index(sort_field)], descending=sort_direction == 'DESC')
+        offset = max((page - 1) * per_page, 0)
+        page_order = order[offset:offset + per_page] if per_page >= 0 else order[offset:]
+        vehicles_paged = [vehicles[i] for i in page_order]
 
+        # (新增) 基于所有车辆的汇总数据计算 KPI
+        kpis = dict(zip(summary_metrics, to_json_numbers(totals.sum(axis=0))))
 
-        # 7. 获取排名前10的车辆数据（用于图表）
+        # 4. 所有车辆按各项指标的排名（用于图表）
         chart_data = {}
-        for metric in ['mileage', 'fuel', 'violations', 'maintenance']:
-            field_name = valid_sort_fields[metric] # 获取实际的数据库字段名
-            
-            # 在 Python 中对所有车辆汇总数据进行排序和筛选
-            sorted_data = sorted(all_vehicles_summary, key=lambda x: x[field_name], reverse=True)
-            # (修改) 不再截取 top_10，而是使用所有已排序的数据
-            
-            # 为图表准备数据
+        for metric, field_name in valid_sort_fields.items():
+            sorted_data = [vehicles[i] for i in rank_order(totals[:, summary_metrics.index(field_name)])]
             chart_data[metric] = {
                 'labels': [row['plate_number'] for row in sorted_data],
                 'data': [row[field_name] for row in sorted_data],
                 'departments': [row['department_name'] for row in sorted_data]
             }
-        
-        conn.close()
-        
+
         # 构造分页元数据
         pagination = {
             'total': total_vehicles,
@@ -596,7 +855,7 @@ def get_vehicle_summary():
         }
         
         return jsonify({
-            'vehicles': [dict(row) for row in vehicles_paged],
+            'vehicles': vehicles_paged,
             'pagination': pagination,
             'chart_data': chart_data,
             'kpis': kpis # (新增) 在响应中加入 KPI 数据
@@ -634,11 +893,12 @@ def get_table_data(table_name, columns):
     
     # 获取总数
     total = conn.execute(f"SELECT COUNT(*) FROM {table_name}").fetchone()[0]
+    scales = column_scales(conn)
     
     conn.close()
     
     return jsonify({
-        'data': [dict(row) for row in data],
+        'data': [from_storage(scales, table_name, dict(row)) for row in data],
         'pagination': {
             'total': total,
             'page': page,
@@ -660,22 +920,62 @@ def get_data(table):
         return get_table_data(table, table_columns[table])
     return jsonify({"error": "Invalid table"}), 404
 
+def with_normalized_plate(data):
+    """(新增) 写入数据中的车牌号按导入时的规则规范化 (见 plates.py)，与 vehicles 中的车牌号写法一致。"""
+    if 'plate_number' in data:
+        return {**data, 'plate_number': normalize_plate(data['plate_number'])}
+    return data
+
+
+def find_vehicle(conn, plate_number, columns='*'):
+    """
+    (新增) 按 URL 中的车牌号查找车辆: 原样匹配优先，其次按规范化后的写法匹配 (见 plates.py)，
+    车牌号规范化之前的旧链接 (如 '皖P·12345') 仍然有效。找不到时返回 None。
+    """
+    return conn.execute(
+        f"SELECT {columns} FROM vehicles WHERE plate_number IN (?, ?) ORDER BY plate_number = ? DESC LIMIT 1",
+        (plate_number, normalize_plate(plate_number), plate_number)
+    ).fetchone()
+
+
+def with_resolved_ids(conn, table, data):
+    """
+    (新增) 事实表写入前由车牌号解析出 vehicle_id、由违章地点解析出 location_id，
+    变更日志的 insert / update 记录直接带上最终值，不再由触发器回写后追加一条 update
+    (触发器只为其他写入方兜底，见 migrations.py 升级步骤 11)。
+    """
+    if table not in FACT_TABLES:
+        return data
+    data = dict(data)
+    if 'plate_number' in data:
+        row = conn.execute('SELECT vehicle_id FROM vehicles WHERE plate_number = ?', (data['plate_number'],)).fetchone()
+        data['vehicle_id'] = row[0] if row else None
+    if table == 'violations' and 'violation_location' in data:
+        location = data['violation_location']
+        data['location_id'] = intern_locations(conn, [location]).get(str(location).strip(' ')) if location else None
+    return data
+
+
 @app.route('/api/data/<table>', methods=['POST'])
 def add_record(table):
     """动态添加记录到指定表"""
     data = request.get_json()
     if not data:
         return jsonify({"error": "Invalid data"}), 400
+    data = with_normalized_plate(data)
 
     conn = get_db_connection()
     try:
+        data = with_resolved_ids(conn, table, data)
         columns = ', '.join(data.keys())
         placeholders = ', '.join(['?'] * len(data))
         query = f"INSERT INTO {table} ({columns}) VALUES ({placeholders})"
-        conn.execute(query, tuple(data.values()))
+        # (新增) 定点存储模式下金额、油量换算为整数 (见 fixed_point.py)
+        conn.execute(query, tuple(to_storage(column_scales(conn), table, data).values()))
         conn.commit()
         # 获取新插入记录的ID (假设主键是自增的)
         new_id = conn.execute('SELECT last_insert_rowid()').fetchone()[0]
+        publish_change(conn, table, 'insert', [data])
         return jsonify({"message": "Record added successfully", "id": new_id}), 201
     except sqlite3.Error as e:
         return jsonify({"error": str(e)}), 500
@@ -698,17 +998,23 @@ def update_record(table, id):
     data = request.get_json()
     if not data:
         return jsonify({"error": "Invalid data"}), 400
+    data = with_normalized_plate(data)
 
     conn = get_db_connection()
     try:
+        data = with_resolved_ids(conn, table, data)
         set_clause = ', '.join([f"{key} = ?" for key in data.keys()])
         query = f"UPDATE {table} SET {set_clause} WHERE {id_column} = ?"
         
-        values = list(data.values())
+        values = list(to_storage(column_scales(conn), table, data).values())
         values.append(id)
         
+        # (新增) 记录修改前的数据，变更事件需要同时包含修改前后涉及的车辆和月份
+        before = conn.execute(f"SELECT * FROM {table} WHERE {id_column} = ?", (id,)).fetchone()
         conn.execute(query, tuple(values))
         conn.commit()
+        after = conn.execute(f"SELECT * FROM {table} WHERE {id_column} = ?", (id,)).fetchone()
+        publish_change(conn, table, 'update', [before, after])
         return jsonify({"message": "Record updated successfully"}), 200
     except sqlite3.Error as e:
         return jsonify({"error": str(e)}), 500
@@ -732,19 +1038,62 @@ def delete_record(table, id):
     
     try:
         conn = get_db_connection()
+        before = conn.execute(f"SELECT * FROM {table} WHERE {id_column} = ?", (id,)).fetchone()
         conn.execute(f"DELETE FROM {table} WHERE {id_column} = ?", (id,))
         conn.commit()
+        publish_change(conn, table, 'delete', [before])
         conn.close()
         return jsonify({"message": "Record deleted successfully"}), 200
     except sqlite3.Error as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/data/batch', methods=['POST'])
+def batch_write():
+    """
+    (新增) 批量写入: 在一个事务中执行多条 insert / update / delete。
+    请求体: {"operations": [
+        {"op": "insert", "table": "violations", "data": {...}},
+        {"op": "update", "table": "violations", "id": 12, "data": {...}},
+        {"op": "delete", "table": "violations", "id": 13}
+    ]}
+    列名按模板列白名单校验，任何一条不合法或执行失败时整批回滚。
+    返回与输入顺序一致的逐条结果。
+    """
+    payload = request.get_json(silent=True) or {}
+    try:
+        operations = validate_operations(payload.get('operations'), WRITABLE_COLUMNS, ID_COLUMNS)
+    except BatchValidationError as e:
+        return jsonify({"error": "批量操作校验失败，未写入任何数据", "errors": e.errors}), 400
+
+    conn = get_db_connection()
+    try:
+        # (新增) 定点存储模式下金额、油量换算为整数 (见 fixed_point.py)
+        scales = column_scales(conn)
+        # (新增) 车牌号与导入时一样先规范化 (见 plates.py)；
+        #        在批量写入的事务中解析 vehicle_id、登记违章地点 (见 with_resolved_ids)
+        def prepare(operation):
+            table = operation['table']
+            return to_storage(scales, table, with_resolved_ids(conn, table, with_normalized_plate(operation['data'])))
+
+        results, changed = execute_batch(conn, operations, ID_COLUMNS, prepare)
+        for table, rows in changed.items():
+            publish_change(conn, table, 'batch', rows)
+        return jsonify({"message": f"成功执行 {len(results)} 条操作", "results": results}), 200
+    except BatchExecutionError as e:
+        return jsonify({"error": f"数据库错误: {e.error}，已回滚全部操作", "failed_operations": e.indexes}), 500
+    except sqlite3.Error as e:
+        return jsonify({"error": f"数据库错误: {e}"}), 500
+    finally:
+        conn.close()
+
 @app.route('/api/download-template/<table>', methods=['GET'])
 def download_template(table):
     """为指定表生成并提供Excel模板文件下载（中文表头）"""
     if table not in COLUMN_MAPPING:
         return jsonify({"error": "Invalid table for template generation"}), 404
 
+    import pandas as pd  # 按需导入，见文件头部说明
+
     # 获取中文表头
     chinese_headers = list(COLUMN_MAPPING[table].values())
     
@@ -766,7 +1115,12 @@ def download_template(table):
 
 @app.route('/api/upload/<table>', methods=['POST'])
 def upload_file(table):
-    """处理文件上传并将数据导入数据库（支持中文表头）"""
+    """
+    处理文件上传并将数据导入数据库（支持中文表头）
+    (新增) 导入前按列校验和规范化 (车牌号、日期、数值、外键，见 ingest.py)，
+    未通过校验的行不导入，原因在返回的 report 中列出。
+    (新增) 部门、违章类型、维保服务商可以填写 ID 或名称，新名称会自动加入字典表。
+    """
     if 'file' not in request.files:
         return jsonify({"error": "No file part"}), 400
     
@@ -779,6 +1133,8 @@ def upload_file(table):
             if table not in COLUMN_MAPPING:
                 return jsonify({"error": "Invalid table for data import"}), 404
 
+            import pandas as pd  # 按需导入，见文件头部说明
+
             df = pd.read_excel(file, engine='openpyxl')
             
             # (新增) 数据清洗和预处理
@@ -786,23 +1142,57 @@ def upload_file(table):
             df.columns = df.columns.str.strip()
 
             # (新增) 将中文表头映射回英文数据库列名
-            reverse_mapping = {v: k for k, v in COLUMN_MAPPING[table].items()}
+            # (修改) 也接受字典表的名称列
+            column_mapping = {**COLUMN_MAPPING[table], **NAME_COLUMN_MAPPING.get(table, {})}
+            reverse_mapping = {v: k for k, v in column_mapping.items()}
             df.rename(columns=reverse_mapping, inplace=True)
             
             # 检查是否有未匹配的列
-            expected_columns = COLUMN_MAPPING[table].keys()
+            expected_columns = column_mapping.keys()
             unmatched_columns = [col for col in df.columns if col not in expected_columns]
             if unmatched_columns:
                  return jsonify({"error": f"上传的文件中包含无法识别的列: {', '.join(unmatched_columns)}"}), 400
 
             conn = get_db_connection()
-            # to_sql 会自动处理列映射和数据插入
-            # if_exists='append' 表示如果表已存在，则追加数据
-            # index=False 表示不将DataFrame的索引写入数据库
-            df.to_sql(table, conn, if_exists='append', index=False)
+            imported = False
+            try:
+                # (修改) 统一校验: 车牌号和字典表 ID 与内存中的已知集合比对，
+                #        事实表同时把车牌号解析为整数外键 vehicle_id
+                # (修改) 已有车牌号按同样的规则规范化后再比对 (见 plates.plate_map)
+                # (修改) 新名称先不提交，与导入的数据在同一个事务中提交 (见 staging.append_frame)
+                from ingest import known_ids, validate_frame
+                plate_to_id = plate_map(conn)
+                df, report = validate_frame(
+                    df, table, plate_to_id, known_ids(get_dictionaries(conn)),
+                    resolve=lambda table_name, names: dictionary_cache().get_or_create(conn, table_name, names,
+                                                                                       commit=False)
+                )
+                if table == 'violations' and 'violation_location' in df.columns and not df.empty:
+                    # (新增) 违章地点在写入前登记为 location_id，与数据在同一个事务中提交 (见 top_counts.intern_locations)
+                    locations = df['violation_location'].astype('string').str.strip(' ')
+                    df['location_id'] = locations.map(intern_locations(conn, locations.dropna().unique())).astype('Int64')
+                if not df.empty:
+                    # (修改) 先写入临时表，再用一条 INSERT ... SELECT 追加，缩短持有写锁的时间 (见 staging.py)
+                    append_frame(conn, frame_to_storage(column_scales(conn), table, df), table)
+                    imported = True
+            finally:
+                if not imported:
+                    # (新增) 没有导入任何行或导入失败: 新建的字典表名称随事务回滚，缓存中的对应 id 作废
+                    conn.rollback()
+                    dictionary_cache().invalidate()
+            if df.empty:
+                conn.close()
+                return jsonify({"error": "没有可导入的数据行", "report": report.to_dict()}), 400
+            # (新增) 只用去重后的车牌号、时间列生成变更事件，避免逐行构造字典
+            event_columns = [col for col in ('plate_number', 'department_id', 'year', 'month', EVENT_TIME_COLUMNS.get(table))
+                             if col in df.columns]
+            publish_change(conn, table, 'insert', df[event_columns].drop_duplicates().to_dict('records'))
             conn.close()
             
-            return jsonify({"message": f"成功上传并导入数据到 '{table}' 表."}), 200
+            return jsonify({
+                "message": f"成功上传并导入 {len(df)} 行数据到 '{table}' 表，{report.rejected_rows} 行未通过校验.",
+                "report": report.to_dict()
+            }), 200
         except Exception as e:
             return jsonify({"error": f"发生错误: {str(e)}"}), 500
             
@@ -882,38 +1272,56 @@ def get_vehicle_detail(plate_number):
     """
     API 端点，获取单个车辆的详细信息，用于车辆详情页。
     (新增) 支持 start_month 和 end_month URL参数进行时间范围过滤。
+    (新增) 支持 granularity (week/month/quarter/year) 和 max_points 参数，见 granularity.py。
+    (新增) 支持 include 参数只返回所需的分段；违章、维保明细按 limit 分页，
+    用 violations_cursor / maintenance_cursor 翻页，见 detail_sections.py。
+    (修改) 不带 include、limit 和游标时明细不分页，与原来的响应相同。
     """
+    try:
+        granularity, max_points = trend_params()
+        include = parse_include(request.args.get('include'))
+        cursors = {section: decode_cursor(request.args.get(f'{section}_cursor'))
+                   for section in ('violations', 'maintenance')}
+        # (修改) 带游标的请求只查询对应的分段；原有的调用方 (不带 include、limit 和游标) 仍返回全部明细
+        include = narrow_to_cursors(include, cursors)
+        paged = 'include' in request.args or any(cursors.values())
+        limit = parse_limit(request.args.get('limit'), default=DEFAULT_PAGE_SIZE if paged else None)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     try:
         # (新增) 从 URL 查询参数中获取月份
         start_month = request.args.get('start_month') # 格式: YYYY-MM
         end_month = request.args.get('end_month')     # 格式: YYYY-MM
 
-        conn = get_db_connection()
+        conn = get_read_connection()
+        dictionaries = get_dictionaries(conn)
         
         # 1. 查询车辆基本信息 (不受时间筛选影响)
-        basic_info_query = """
-            SELECT v.*, d.name as department_name
-            FROM vehicles v
-            LEFT JOIN departments d ON v.department_id = d.department_id
-            WHERE v.plate_number = ?
-        """
-        basic_info = conn.execute(basic_info_query, (plate_number,)).fetchone()
+        # (修改) 车牌号按规范化后的写法也能匹配，之后统一使用数据库中的车牌号
+        basic_info = find_vehicle(conn, plate_number)
 
         if not basic_info:
             return jsonify({"error": "Vehicle not found"}), 404
+        plate_number = basic_info['plate_number']
         
-        basic_info_dict = dict(basic_info)
+        # (新增) 定点存储的金额、油量换算回原单位 (见 fixed_point.py)
+        scales = column_scales(conn)
+        basic_info_dict = from_storage(scales, 'vehicles', dict(basic_info))
+        basic_info_dict['department_name'] = dictionaries['departments'].get(basic_info_dict['department_id'])
         # (修改) 根据数据库中的 image_url 构建完整的图片访问 URL
         if basic_info_dict.get('image_url'):
             # url_for('uploaded_file', filename=...) 会生成 /uploads/vehicle_images/xxx.png 这样的URL
-            basic_info_dict['vehicle_image_url'] = url_for('uploaded_file', filename=basic_info_dict['image_url'], _external=True)
+            basic_info_dict.update(image_urls(basic_info_dict['image_url']))
         else:
             basic_info_dict['vehicle_image_url'] = f'https://via.placeholder.com/800x500.png?text={plate_number}'
+            basic_info_dict['vehicle_image_thumb_url'] = f'https://via.placeholder.com/320x200.png?text={plate_number}'
+            basic_info_dict['vehicle_image_medium_url'] = basic_info_dict['vehicle_image_url']
 
         department_id = basic_info_dict['department_id']
         
         # (新增) --- 动态构建 WHERE 子句 ---
-        params = {'plate_number': plate_number}
+        # (修改) 按整数 vehicle_id 查询事实表，车牌号仅作为对外标识
+        params = {'vehicle_id': basic_info_dict['vehicle_id']}
         time_filter_clauses = {
             'fuel_mileage': '',
             'violations': '',
@@ -926,124 +1334,148 @@ def get_vehicle_detail(plate_number):
             time_filter_clauses['maintenance'] = "AND date(m.request_time) BETWEEN date(:start) AND date(:end)"
 
 
-        # 2. 查询里程和油耗信息 (月度汇总表)
-        fuel_mileage_details = conn.execute(f"""
-            SELECT year || '-' || printf('%02d', month) as month, distance_driven, total_fuel_amount, total_fuel_cost, avg_consumption_per_100km
-            FROM monthly_fuel_summary
-            WHERE plate_number = :plate_number {time_filter_clauses['fuel_mileage']}
-            ORDER BY month
-        """, params).fetchall()
-        
-        # 3. 查询违章详情
-        violation_details = conn.execute(f"""
-            SELECT v.violation_time, v.violation_location, t.description as violation_reason
-            FROM violations v
-            LEFT JOIN violation_types t ON v.violation_type_id = t.violation_type_id
-            WHERE v.plate_number = :plate_number {time_filter_clauses['violations']}
-            ORDER BY v.violation_time DESC
-        """, params).fetchall()
-        
-        # 4. 查询维保详情
-        maintenance_details = conn.execute(f"""
-            SELECT m.request_time, m.service_details, m.maintenance_cost, p.name as provider_name
-            FROM maintenance m
-            LEFT JOIN service_providers p ON m.provider_id = p.provider_id
-            WHERE m.plate_number = :plate_number {time_filter_clauses['maintenance']}
-            ORDER BY m.request_time DESC
-        """, params).fetchall()
+        # (新增) 已冻结的历史年份存放在归档文件中，按时间范围选择需要读取的分区 (见 partitions.py)
+        def source(table):
+            return partition_source(conn, table, start_month, end_month)
+
+        response_data = {'basic_info': basic_info_dict}
+
+        # 2. 查询里程和油耗信息 (月度汇总表，每月一行，不分页；明细只在 mileage 中返回一次)
+        if include & {'mileage', 'fuel'}:
+            fuel_mileage_details = [from_storage(scales, 'monthly_fuel_summary', dict(row)) for row in conn.execute(f"""
+                SELECT year || '-' || printf('%02d', month) as month, distance_driven, total_fuel_amount, total_fuel_cost, avg_consumption_per_100km
+                FROM {source('monthly_fuel_summary')}
+                WHERE vehicle_id = :vehicle_id {time_filter_clauses['fuel_mileage']}
+                ORDER BY month
+            """, params)]
+
+            # (修改) 趋势按 granularity 分桶；油耗汇总表按月记录，按周请求时仍按月返回
+            total_distance = sum(r['distance_driven'] for r in fuel_mileage_details)
+            fuel_granularity = series_granularity(granularity, monthly=True)
+            if 'mileage' in include:
+                response_data['mileage'] = {
+                    'total_distance': total_distance,
+                    'trend': trend(*bucket_totals(((r['month'], r['distance_driven']) for r in fuel_mileage_details),
+                                                  fuel_granularity), fuel_granularity, max_points),
+                    'details': fuel_mileage_details
+                }
+            if 'fuel' in include:
+                # (修改) 合计与维保费用相同，在 SQL 中对存储值求和后只换算一次 (定点模式下为整数精确求和)
+                total_fuel, total_fuel_cost = conn.execute(f"""
+                    SELECT {sum_sql(scales, 'monthly_fuel_summary', 'total_fuel_amount')},
+                           {sum_sql(scales, 'monthly_fuel_summary', 'total_fuel_cost')}
+                    FROM {source('monthly_fuel_summary')}
+                    WHERE vehicle_id = :vehicle_id {time_filter_clauses['fuel_mileage']}
+                """, params).fetchone()
+                total_fuel = total_fuel or 0
+                response_data['fuel'] = {
+                    'total_fuel': total_fuel,
+                    'total_fuel_cost': total_fuel_cost or 0,
+                    'avg_consumption': (total_fuel / total_distance * 100) if total_distance > 0 else 0,
+                    'trend': trend(*bucket_totals(((r['month'], r['total_fuel_amount']) for r in fuel_mileage_details),
+                                                  fuel_granularity), fuel_granularity, max_points)
+                }
+
+        # 3. 查询违章详情 (按时间倒序分页，见 detail_sections.py)
+        # (修改) 违章原因、维保单位名称从字典表缓存中获取，不再 JOIN
+        if 'violations' in include:
+            cursor = cursors['violations']
+            keyset, keyset_params = keyset_filter('v.violation_time', 'v.violation_id', cursor)
+            violation_rows, next_cursor = page(conn.execute(f"""
+                SELECT v.violation_id, v.violation_time, v.violation_location, v.violation_type_id
+                FROM {source('violations')} v
+                WHERE v.vehicle_id = :vehicle_id {time_filter_clauses['violations']} {keyset}
+                ORDER BY v.violation_time DESC, v.violation_id DESC
+                LIMIT :limit
+            """, {**params, **keyset_params, 'limit': query_limit(limit)}).fetchall(), limit, 'violation_time', 'violation_id')
+            violation_types = dictionaries['violation_types']
+            violations = {
+                'details': [
+                    {'violation_time': row['violation_time'], 'violation_location': row['violation_location'],
+                     'violation_reason': violation_types.get(row['violation_type_id'])}
+                    for row in violation_rows
+                ],
+                'next_cursor': next_cursor
+            }
+            if cursor is None:
+                # 次数和趋势按天聚合计算，不读取全部明细
+                daily_counts = conn.execute(f"""
+                    SELECT substr(v.violation_time, 1, 10) AS day, COUNT(*) AS count
+                    FROM {source('violations')} v
+                    WHERE v.vehicle_id = :vehicle_id {time_filter_clauses['violations']}
+                    GROUP BY day
+                """, params).fetchall()
+                violations['total_count'] = sum(row['count'] for row in daily_counts)
+                violations['trend'] = trend(*bucket_totals(((row['day'], row['count']) for row in daily_counts),
+                                                           granularity), granularity, max_points)
+            response_data['violations'] = violations
+
+        # 4. 查询维保详情 (按时间倒序分页)
+        if 'maintenance' in include:
+            cursor = cursors['maintenance']
+            keyset, keyset_params = keyset_filter('m.request_time', 'm.maintenance_id', cursor)
+            maintenance_rows, next_cursor = page([from_storage(scales, 'maintenance', dict(row)) for row in conn.execute(f"""
+                SELECT m.maintenance_id, m.request_time, m.service_details, m.maintenance_cost, m.provider_id
+                FROM {source('maintenance')} m
+                WHERE m.vehicle_id = :vehicle_id {time_filter_clauses['maintenance']} {keyset}
+                ORDER BY m.request_time DESC, m.maintenance_id DESC
+                LIMIT :limit
+            """, {**params, **keyset_params, 'limit': query_limit(limit)})], limit, 'request_time', 'maintenance_id')
+            providers = dictionaries['service_providers']
+            maintenance = {
+                'details': [
+                    {'request_time': row['request_time'], 'service_details': row['service_details'],
+                     'maintenance_cost': row['maintenance_cost'], 'provider_name': providers.get(row['provider_id'])}
+                    for row in maintenance_rows
+                ],
+                'next_cursor': next_cursor
+            }
+            if cursor is None:
+                total_count, total_cost, first_day, last_day = conn.execute(f"""
+                    SELECT COUNT(*), {sum_sql(scales, 'maintenance', 'maintenance_cost')},
+                           MIN(substr(m.request_time, 1, 10)), MAX(substr(m.request_time, 1, 10))
+                    FROM {source('maintenance')} m
+                    WHERE m.vehicle_id = :vehicle_id {time_filter_clauses['maintenance']}
+                """, params).fetchone()
+                # (修改) 使用标准库计算日期跨度，不再依赖 pandas
+                total_maintenance_months = ((date.fromisoformat(last_day) - date.fromisoformat(first_day)).days / 30.44
+                                            if first_day else 1)
+                total_maintenance_months = max(total_maintenance_months, 1)
+                maintenance.update({
+                    'total_count': total_count,
+                    'total_cost': total_cost or 0,
+                    'avg_monthly_cost': (total_cost or 0) / total_maintenance_months
+                })
+            response_data['maintenance'] = maintenance
 
         # 5. (新增) 计算违章在部门内的排名 (此项统计通常基于全部历史数据，不受时间筛选影响)
-        violation_rank_query = """
-            WITH DepartmentViolations AS (
-                SELECT 
-                    v.plate_number,
-                    COUNT(i.violation_id) as violation_count
-                FROM vehicles v
-                LEFT JOIN violations i ON v.plate_number = i.plate_number
-                WHERE v.department_id = ?
-                GROUP BY v.plate_number
-            )
-            SELECT plate_number, violation_count, RANK() OVER (ORDER BY violation_count DESC) as rank
-            FROM DepartmentViolations
-        """
-        dept_violations = conn.execute(violation_rank_query, (department_id,)).fetchall()
-        
-        violation_rank_info = {
-            'rank': 0,
-            'total_vehicles': len(dept_violations)
-        }
-        for row in dept_violations:
-            if row['plate_number'] == plate_number:
-                violation_rank_info['rank'] = row['rank']
-                break
-        
-        conn.close()
-        
-        # --- 数据聚合与格式化 ---
-        
-        # 里程聚合
-        total_distance = sum(r['distance_driven'] for r in fuel_mileage_details)
-        mileage_trend = {
-            'labels': [r['month'] for r in fuel_mileage_details],
-            'data': [r['distance_driven'] for r in fuel_mileage_details]
-        }
-        
-        # 油耗聚合
-        total_fuel = sum(r['total_fuel_amount'] for r in fuel_mileage_details)
-        total_fuel_cost = sum(r['total_fuel_cost'] for r in fuel_mileage_details)
-        avg_consumption = (total_fuel / total_distance * 100) if total_distance > 0 else 0
-        fuel_trend = {
-            'labels': [r['month'] for r in fuel_mileage_details],
-            'data': [r['total_fuel_amount'] for r in fuel_mileage_details]
-        }
-
-        # 违章聚合
-        violation_trend_data = {}
-        for row in violation_details:
-            month = row['violation_time'][:7] # YYYY-MM
-            violation_trend_data[month] = violation_trend_data.get(month, 0) + 1
-        sorted_v_trend = sorted(violation_trend_data.items())
-        violation_trend = {
-            'labels': [item[0] for item in sorted_v_trend],
-            'data': [item[1] for item in sorted_v_trend]
-        }
-
-        # 维保聚合
-        maintenance_months = [r['request_time'][:10] for r in maintenance_details]
-        total_maintenance_months = (pd.to_datetime(max(maintenance_months)) - pd.to_datetime(min(maintenance_months))).days / 30.44 if maintenance_months else 1
-        total_maintenance_months = max(total_maintenance_months, 1)
-
-        total_maintenance_cost = sum(r['maintenance_cost'] for r in maintenance_details)
-        avg_monthly_cost = total_maintenance_cost / total_maintenance_months if total_maintenance_months > 0 else 0
-
-        # --- 构造最终响应 ---
-        response_data = {
-            'basic_info': basic_info_dict,
-            'mileage': {
-                'total_distance': total_distance,
-                'trend': mileage_trend,
-                'details': [dict(r) for r in fuel_mileage_details]
-            },
-            'fuel': {
-                'total_fuel': total_fuel,
-                'total_fuel_cost': total_fuel_cost,
-                'avg_consumption': avg_consumption,
-                'trend': fuel_trend,
-                'details': [dict(r) for r in fuel_mileage_details]
-            },
-            'violations': {
-                'total_count': len(violation_details),
-                'rank_info': violation_rank_info,
-                'trend': violation_trend,
-                'details': [dict(r) for r in violation_details]
-            },
-            'maintenance': {
-                'total_count': len(maintenance_details),
-                'total_cost': total_maintenance_cost,
-                'avg_monthly_cost': avg_monthly_cost,
-                'details': [dict(r) for r in maintenance_details]
+        if 'violation_rank' in include:
+            violation_rank_query = f"""
+                WITH DepartmentViolations AS (
+                    SELECT 
+                        v.plate_number,
+                        COUNT(i.violation_id) as violation_count
+                    FROM vehicles v
+                    LEFT JOIN {partition_source(conn, 'violations')} i ON v.vehicle_id = i.vehicle_id
+                    WHERE v.department_id = ?
+                    GROUP BY v.vehicle_id
+                )
+                SELECT plate_number, violation_count, RANK() OVER (ORDER BY violation_count DESC) as rank
+                FROM DepartmentViolations
+            """
+            dept_violations = conn.execute(violation_rank_query, (department_id,)).fetchall()
+
+            violation_rank_info = {
+                'rank': 0,
+                'total_vehicles': len(dept_violations)
             }
-        }
+            for row in dept_violations:
+                if row['plate_number'] == plate_number:
+                    violation_rank_info['rank'] = row['rank']
+                    break
+            response_data.setdefault('violations', {})['rank_info'] = violation_rank_info
+
+        conn.close()
 
         return jsonify(response_data)
 
@@ -1062,10 +1494,31 @@ def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def image_urls(filename):
+    """返回原图、中图和缩略图的完整访问 URL"""
+    return {
+        'vehicle_image_url': url_for('uploaded_file', filename=filename, _external=True),
+        'vehicle_image_medium_url': url_for('uploaded_file', filename=filename, size='medium', _external=True),
+        'vehicle_image_thumb_url': url_for('uploaded_file', filename=filename, size='thumb', _external=True),
+    }
+
+
 @app.route('/uploads/vehicle_images/<filename>')
 def uploaded_file(filename):
-    """为上传的文件提供访问服务"""
-    return send_from_directory(UPLOAD_FOLDER, filename)
+    """
+    为上传的文件提供访问服务。
+    (新增) 支持 size=thumb|medium 参数返回缩略图 (按需生成)，
+    并返回长期不可变缓存头、ETag，支持 Range 请求。
+    """
+    size = request.args.get('size')
+    folder, name = UPLOAD_FOLDER, filename
+    if size in IMAGE_VARIANTS and os.path.isfile(os.path.join(UPLOAD_FOLDER, secure_filename(filename))):
+        folder, name = ensure_variant(UPLOAD_FOLDER, secure_filename(filename), size)
+    # 文件名由内容决定，直接用文件名作为 ETag；conditional=True 处理 If-None-Match 和 Range
+    response = send_from_directory(folder, name, conditional=True, etag=name, max_age=IMAGE_CACHE_MAX_AGE)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
 
 @app.route('/api/vehicle/upload_image/<plate_number>', methods=['POST'])
 def upload_vehicle_image(plate_number):
@@ -1076,22 +1529,33 @@ def upload_vehicle_image(plate_number):
     if file.filename == '':
         return jsonify(error='No selected file'), 400
     if file and allowed_file(file.filename):
+        # (新增) 先确认车辆存在 (车牌号按规范化后的写法也能匹配)，不为不存在的车辆保存图片
+        conn = get_db_connection()
+        vehicle = find_vehicle(conn, plate_number, 'vehicle_id, plate_number')
+        if vehicle is None:
+            conn.close()
+            return jsonify(error='Vehicle not found'), 404
+        vehicle_id, plate_number = vehicle
+
         # (修改) 使用更安全的文件名生成方式
         ext = file.filename.rsplit('.', 1)[1].lower()
-        # 使用 plate_number 和一个唯一的 uuid 来确保文件名不重复
-        filename = secure_filename(f"{plate_number}_{uuid.uuid4().hex}.{ext}")
-        filepath = os.path.join(UPLOAD_FOLDER, filename)
-        file.save(filepath)
+        # (修改) 按文件内容哈希命名，并同时生成缩略图和中图
+        filename = save_original(UPLOAD_FOLDER, file.read(), ext)
 
         # (修改) 更新数据库中 vehicles 表的 image_url 字段
-        conn = get_db_connection()
-        conn.execute('UPDATE vehicles SET image_url = ? WHERE plate_number = ?', (filename, plate_number))
+        conn.execute('UPDATE vehicles SET image_url = ? WHERE vehicle_id = ?', (filename, vehicle_id))
         conn.commit()
+        publish_change(conn, 'vehicles', 'update', [{'plate_number': plate_number}])
+        # (新增) 回收重新上传后不再被引用的旧图片
+        referenced = {row[0] for row in conn.execute('SELECT image_url FROM vehicles WHERE image_url IS NOT NULL')}
         conn.close()
+        collect_orphan_images(UPLOAD_FOLDER, referenced)
 
         # 返回新上传文件的完整 URL
-        image_url = url_for('uploaded_file', filename=filename, _external=True)
-        return jsonify(imageUrl=image_url)
+        urls = image_urls(filename)
+        return jsonify(imageUrl=urls['vehicle_image_url'],
+                       mediumUrl=urls['vehicle_image_medium_url'],
+                       thumbUrl=urls['vehicle_image_thumb_url'])
 
     return jsonify(error='File type not allowed'), 400
 
@@ -1100,104 +1564,86 @@ def upload_vehicle_image(plate_number):
 #       部门详情页面的 API 端点
 # =====================================================
 @app.route('/api/department/detail/<int:department_id>', methods=['GET'])
+@cached_response
 def get_department_detail(department_id):
     """
     API 端点，获取单个部门的详细信息，用于部门详情页。
     支持 start_month 和 end_month URL参数进行时间范围过滤。
+    (新增) 支持 granularity (week/month/quarter/year) 和 max_points 参数，见 granularity.py。
     """
+    try:
+        granularity, max_points = trend_params()
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
     try:
         start_month = request.args.get('start_month')
         end_month = request.args.get('end_month')
 
-        conn = get_db_connection()
+        conn = get_read_connection()
 
-        # 1. 查询部门基本信息
-        department_info = conn.execute('SELECT * FROM departments WHERE department_id = ?', (department_id,)).fetchone()
-        if not department_info:
+        # 1. 查询部门基本信息 (来自字典表缓存)
+        department_name = get_dictionaries(conn)['departments'].get(department_id)
+        if department_name is None:
             return jsonify(error="Department not found"), 404
+        department_info = {'department_id': department_id, 'name': department_name}
 
-        # 2. 准备时间筛选条件
-        params = {'department_id': department_id}
-        where_clauses = {}
-        if start_month and end_month:
-            params.update({'start': f'{start_month}-01', 'end': f'{end_month}-31'})
-            where_clauses['fuel'] = "AND date(s.year || '-' || printf('%02d', s.month) || '-01') BETWEEN date(:start) AND date(:end)"
-            where_clauses['violation'] = "AND date(i.violation_time) BETWEEN date(:start) AND date(:end)"
-            where_clauses['maint'] = "AND date(m.request_time) BETWEEN date(:start) AND date(:end)"
-
-        # 3. 查询部门内的车辆列表
+        # 2. 查询部门内的车辆列表
         vehicles_in_dept = conn.execute("""
             SELECT vehicle_id, plate_number, brand_model, manager 
             FROM vehicles WHERE department_id = ?
         """, (department_id,)).fetchall()
         
-        # 4. 聚合部门KPI和月度趋势
+        # 3. 聚合部门KPI和趋势
+        # (修改) 趋势来自前缀和索引中按部门预先累计的桶，KPI 为各桶之和
+        range_index = get_range_index(conn)
         kpis = {'vehicle_count': len(vehicles_in_dept)}
         trends = {}
         
         # 里程和油耗
-        fuel_mileage_q = conn.execute(f"""
-            SELECT 
-                SUM(s.distance_driven) as total_distance, SUM(s.total_fuel_amount) as total_fuel,
-                s.year || '-' || printf('%02d', s.month) as month
-            FROM monthly_fuel_summary s JOIN vehicles v ON s.plate_number = v.plate_number
-            WHERE v.department_id = :department_id {where_clauses.get('fuel', '')}
-            GROUP BY month ORDER BY month
-        """, params).fetchall()
-        kpis['total_distance'] = sum(r['total_distance'] for r in fuel_mileage_q)
-        kpis['total_fuel'] = sum(r['total_fuel'] for r in fuel_mileage_q)
-        trends['mileage'] = {'labels': [r['month'] for r in fuel_mileage_q], 'data': [r['total_distance'] for r in fuel_mileage_q]}
-        trends['fuel'] = {'labels': [r['month'] for r in fuel_mileage_q], 'data': [r['total_fuel'] for r in fuel_mileage_q]}
+        fuel_granularity, fuel_labels, fuel_series = range_index.series(
+            'monthly_fuel_summary', granularity, start_month, end_month, department_id)
+        kpis['total_distance'] = round(sum(fuel_series['total_distance']), 6)
+        kpis['total_fuel'] = round(sum(fuel_series['total_fuel']), 6)
+        trends['mileage'] = trend(fuel_labels, fuel_series['total_distance'], fuel_granularity, max_points)
+        trends['fuel'] = trend(fuel_labels, fuel_series['total_fuel'], fuel_granularity, max_points)
 
         # 违章
-        violations_q = conn.execute(f"""
-            SELECT COUNT(i.violation_id) as count, strftime('%Y-%m', i.violation_time) as month
-            FROM violations i JOIN vehicles v ON i.plate_number = v.plate_number
-            WHERE v.department_id = :department_id {where_clauses.get('violation', '')}
-            GROUP BY month ORDER BY month
-        """, params).fetchall()
-        kpis['violation_count'] = sum(r['count'] for r in violations_q)
-        trends['violations'] = {'labels': [r['month'] for r in violations_q], 'data': [r['count'] for r in violations_q]}
+        violation_granularity, violation_labels, violation_series = range_index.series(
+            'violations', granularity, start_month, end_month, department_id)
+        kpis['violation_count'] = sum(violation_series['violation_count'])
+        trends['violations'] = trend(violation_labels, violation_series['violation_count'],
+                                     violation_granularity, max_points)
         
         # 维保
-        maint_q = conn.execute(f"""
-            SELECT SUM(m.maintenance_cost) as total_cost, strftime('%Y-%m', m.request_time) as month
-            FROM maintenance m JOIN vehicles v ON m.plate_number = v.plate_number
-            WHERE v.department_id = :department_id {where_clauses.get('maint', '')}
-            GROUP BY month ORDER BY month
-        """, params).fetchall()
-        kpis['maintenance_cost'] = sum(r['total_cost'] for r in maint_q)
-        trends['maintenance'] = {'labels': [r['month'] for r in maint_q], 'data': [r['total_cost'] for r in maint_q]}
-
-        # 5. 查询部门内车辆排名
+        maint_granularity, maint_labels, maint_series = range_index.series(
+            'maintenance', granularity, start_month, end_month, department_id)
+        kpis['maintenance_cost'] = round(sum(maint_series['total_maintenance_cost']), 6)
+        trends['maintenance'] = trend(maint_labels, maint_series['total_maintenance_cost'],
+                                      maint_granularity, max_points)
+
+        # 4. 查询部门内车辆排名
+        # (修改) 区间合计来自前缀和索引，按 (值降序, 车牌号) 向量化排序；
+        #        只列出时间范围内有对应记录的车辆
         rankings = {}
-        vehicle_plate_numbers = [v['plate_number'] for v in vehicles_in_dept]
-        if vehicle_plate_numbers:
-            # 排名查询 (构建 IN 子句)
-            in_clause = ','.join('?' for _ in vehicle_plate_numbers)
-            
-            # 里程排名
-            mileage_rank = conn.execute(f"""
-                SELECT s.plate_number, SUM(s.distance_driven) as value
-                FROM monthly_fuel_summary s
-                WHERE s.plate_number IN ({in_clause}) {where_clauses.get('fuel', '').replace('s.','')}
-                GROUP BY s.plate_number ORDER BY value DESC
-            """, vehicle_plate_numbers + (list(params.values())[1:] if 'start' in params else []) ).fetchall()
-            rankings['mileage'] = [dict(r) for r in mileage_rank]
-            
-            # 违章排名
-            violation_rank = conn.execute(f"""
-                SELECT i.plate_number, COUNT(i.violation_id) as value
-                FROM violations i
-                WHERE i.plate_number IN ({in_clause}) {where_clauses.get('violation', '').replace('i.','')}
-                GROUP BY i.plate_number ORDER BY value DESC
-            """, vehicle_plate_numbers + (list(params.values())[1:] if 'start' in params else [])).fetchall()
-            rankings['violations'] = [dict(r) for r in violation_rank]
+        if vehicles_in_dept:
+            from range_index import rank_order, to_json_numbers
+            totals = range_index.vehicle_totals(
+                [v['vehicle_id'] for v in vehicles_in_dept], start_month, end_month,
+                ('total_distance', 'fuel_records', 'violation_count'))
+            plates = [v['plate_number'] for v in vehicles_in_dept]
+            # 排名名称 -> (取值列, 判断是否有记录的列)
+            for name, value_column, count_column in (('mileage', 0, 1), ('violations', 2, 2)):
+                values = to_json_numbers(totals[:, value_column])
+                rankings[name] = [
+                    {'plate_number': plates[i], 'value': values[i]}
+                    for i in rank_order(totals[:, value_column], tie_breaker=plates)
+                    if totals[i, count_column] > 0
+                ]
 
         conn.close()
 
         return jsonify({
-            'department_info': dict(department_info),
+            'department_info': department_info,
             'kpis': kpis,
             'trends': trends,
             'rankings': rankings,
@@ -1208,6 +1654,306 @@ def get_department_detail(department_id):
         return jsonify(error=f"An unexpected error occurred: {e}"), 500
 
 
+# (新增) ===============================================
+#       Top-N 洞察
+# =====================================================
+@app.route('/api/insights/top', methods=['GET'])
+@cached_response
+def get_top_insights():
+    """
+    返回时间范围内记录数最多的违章地点、违章类型和维保单位。
+    - kind: location / violation_type / provider，可用逗号分隔多个，默认全部
+    - n: 每个维度返回的条数，默认 10，最多 100
+    - start_month / end_month: 时间范围 (YYYY-MM)，同时提供时生效
+    """
+    kinds = [k for k in (request.args.get('kind') or ','.join(TOP_KINDS)).split(',') if k]
+    unknown = [k for k in kinds if k not in TOP_KINDS]
+    if unknown:
+        return jsonify({"error": f"不支持的 kind: {', '.join(unknown)}"}), 400
+    try:
+        n = parse_top_n(request.args.get('n'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    start_month = request.args.get('start_month')
+    end_month = request.args.get('end_month')
+
+    conn = get_read_connection()
+    try:
+        dictionaries = get_dictionaries(conn)
+        names = {'violation_type': dictionaries['violation_types'], 'provider': dictionaries['service_providers']}
+        return jsonify({
+            'n': n,
+            'items': {kind: top_items(conn, kind, n, start_month, end_month, names.get(kind)) for kind in kinds},
+        })
+    except sqlite3.Error as e:
+        return jsonify({"error": f"数据库错误: {e}"}), 500
+    finally:
+        conn.close()
+
+
+# (新增) ===============================================
+#       跨车队汇总 (scatter-gather，见 fleets.py)
+# =====================================================
+
+def scatter_fleets(path, **overrides):
+    """
+    并发请求每个车队的 path 接口，查询参数与当前请求相同 (overrides 中的值为 None 表示去掉该参数)。
+    默认车队不带 fleet 参数，与单车队请求共用响应缓存和预热结果。返回 fleets.scatter() 的结果。
+    """
+    params = {name: value for name, value in request.args.items() if name not in ('fleet', 'approx')}
+    params.update(overrides)
+    params = {name: value for name, value in params.items() if value is not None}
+
+    def fetch(fleet):
+        query = params if fleet.is_default else {**params, 'fleet': fleet.fleet_id}
+        response = app.test_client().get(path, query_string=query)
+        return response.status_code, response.get_json(silent=True)
+    return scatter(FLEETS.fleets(DB_FILE), fetch)
+
+
+def _fleet_info(fleet):
+    return {'fleet_id': fleet.fleet_id, 'fleet_name': fleet.name}
+
+
+@app.route('/api/fleets', methods=['GET'])
+def list_fleets():
+    """已注册的车队，默认车队在最前面。"""
+    return jsonify({'fleets': [{**_fleet_info(fleet), 'is_default': fleet.is_default} for fleet in FLEETS.fleets(DB_FILE)]})
+
+
+@app.route('/api/fleets/overview/summary', methods=['GET'])
+def get_fleets_overview_summary():
+    """
+    所有车队合计的概览数据，参数与 /api/overview/summary 相同 (不支持 approx)。
+    KPI 和趋势按车队相加，每个部门的车辆数带车队前缀，违章地点等 Top 1 由各车队的 Top-N 合并得出。
+    fleets 中给出每个车队各自的 KPI。
+    """
+    try:
+        _, max_points = trend_params()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    results, errors = scatter_fleets('/api/overview/summary', max_points=None)
+    top_results, top_errors = scatter_fleets('/api/insights/top', kind=None, n=str(MAX_TOP_N))
+    if not results:
+        return jsonify({"error": "所有车队的查询都失败了", "errors": errors}), 502
+
+    charts = {}
+    for name, series in results[0][1]['charts'].items():
+        if name == 'vehicles_per_department':
+            parts = [(fleet, body['charts'][name]) for fleet, body in results]
+            charts[name] = {
+                'labels': [f"{fleet.name} {label}" for fleet, part in parts for label in part['labels']],
+                'data': [value for _, part in parts for value in part['data']],
+                'department_ids': [i for _, part in parts for i in part['department_ids']],
+                'fleet_ids': [fleet.fleet_id for fleet, part in parts for _ in part['labels']],
+            }
+        else:
+            charts[name] = merge_series([body['charts'][name] for _, body in results], max_points)
+
+    insight_kpis = {}
+    for kind, key, field in (('location', 'top_violation_location', 'violation_location'),
+                             ('violation_type', 'top_violation_reason', 'description'),
+                             ('provider', 'top_maintenance_provider', 'name')):
+        top = merge_top([body['items'][kind] for _, body in top_results], 1)
+        insight_kpis[key] = {field: top[0]['name'], 'count': top[0]['count']} if top else None
+
+    return jsonify({
+        'kpi': add_totals([body['kpi'] for _, body in results]),
+        'charts': charts,
+        'insight_kpis': insight_kpis,
+        'fleets': [{**_fleet_info(fleet), 'kpi': body['kpi']} for fleet, body in results],
+        'errors': errors + top_errors,
+    })
+
+
+@app.route('/api/fleets/department/summary', methods=['GET'])
+def get_fleets_department_summary():
+    """所有车队的部门汇总，参数与 /api/department/summary 相同；每个部门带车队 ID 和名称，KPI 按车队相加。"""
+    results, errors = scatter_fleets('/api/department/summary')
+    if not results:
+        return jsonify({"error": "所有车队的查询都失败了", "errors": errors}), 502
+    return jsonify({
+        'departments': [{**department, **_fleet_info(fleet)} for fleet, body in results for department in body['departments']],
+        'kpis': add_totals([body['kpis'] for _, body in results]),
+        'fleets': [{**_fleet_info(fleet), 'kpis': body['kpis']} for fleet, body in results],
+        'errors': errors,
+    })
+
+
+@app.route('/api/fleets/vehicle/summary', methods=['GET'])
+def get_fleets_vehicle_summary():
+    """
+    所有车队的车辆排名，参数与 /api/vehicle/summary 相同，另有 n (图表中每项指标的前 n 名，默认 10)。
+    每个车队只返回自己的前 page * per_page 名，归并后取第 page 页。
+    """
+    page = request.args.get('page', default=1, type=int)
+    per_page = request.args.get('per_page', default=10, type=int)
+    sort_by = request.args.get('sort_by', default='mileage', type=str)
+    descending = request.args.get('sort_order', default='desc', type=str).lower() == 'desc'
+    try:
+        n = parse_top_n(request.args.get('n'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    valid_sort_fields = {'mileage': 'total_distance', 'fuel': 'total_fuel',
+                         'violations': 'violation_count', 'maintenance': 'total_maintenance_cost'}
+    if sort_by not in valid_sort_fields:
+        sort_by = 'mileage'
+
+    offset = max((page - 1) * per_page, 0)
+    limit = offset + per_page if per_page >= 0 else None
+    results, errors = scatter_fleets('/api/vehicle/summary', page='1', n=None,
+                                     per_page=str(limit if limit is not None else -1))
+    if not results:
+        return jsonify({"error": "所有车队的查询都失败了", "errors": errors}), 502
+
+    rankings = [[{**vehicle, **_fleet_info(fleet)} for vehicle in body['vehicles']] for fleet, body in results]
+    vehicles = merge_ranked(rankings, valid_sort_fields[sort_by], descending, limit)[offset:]
+
+    chart_data = {}
+    for metric, field_name in valid_sort_fields.items():
+        rankings = [[{'label': label, 'value': value, 'department': department, 'fleet_id': fleet.fleet_id}
+                     for label, value, department in zip(chart['labels'], chart['data'], chart['departments'])]
+                    for fleet, chart in ((fleet, body['chart_data'][metric]) for fleet, body in results)]
+        top = merge_ranked(rankings, 'value', limit=n)
+        chart_data[metric] = {
+            'labels': [item['label'] for item in top],
+            'data': [item['value'] for item in top],
+            'departments': [item['department'] for item in top],
+            'fleet_ids': [item['fleet_id'] for item in top],
+        }
+
+    total_vehicles = sum(body['pagination']['total'] for _, body in results)
+    return jsonify({
+        'vehicles': vehicles,
+        'pagination': {
+            'total': total_vehicles,
+            'per_page': per_page,
+            'current_page': page,
+            'total_pages': (total_vehicles + per_page - 1) // per_page if per_page else 0,
+        },
+        'chart_data': chart_data,
+        'kpis': add_totals([body['kpis'] for _, body in results]),
+        'errors': errors,
+    })
+
+
+# (新增) ===============================================
+#       变更日志增量同步
+# =====================================================
+
+@app.route('/api/changes', methods=['GET'])
+def get_changes():
+    """
+    API 端点，按 seq 增量读取变更日志 (change_journal)。
+    - since: 上次处理到的 seq，默认 0
+    - limit: 每批条数，默认 1000，最大 10000
+    - tables: 可选，逗号分隔的表名
+    - stream=1: 以 NDJSON 流式返回 since 之后的全部变更 (每行一条)，适合外部系统全量追赶
+    - consumer: 可选，下游名称。登记该下游已处理到 since，日志清理时保留之后的记录 (见 journal.py)
+    其余情况返回一批数据，has_more 为 true 时用 next_since 继续请求。
+    (新增) reset 为 true 表示 since 之后的部分记录已被清理，下游需要全量重新同步。
+    (新增) op 为 insert / update / delete / reload；车辆调整部门时为 move。
+    """
+    since = request.args.get('since', default=0, type=int)
+    limit = request.args.get('limit', default=DEFAULT_BATCH_SIZE, type=int)
+    tables = [t for t in request.args.get('tables', '').split(',') if t] or None
+    consumer = request.args.get('consumer')
+    if consumer:
+        try:
+            conn = get_db_connection()
+            ack_consumer(conn, consumer, since)
+            conn.commit()
+            conn.close()
+        except sqlite3.Error as e:
+            return jsonify({"error": f"数据库错误: {e}"}), 500
+
+    if request.args.get('stream') == '1':
+        def generate():
+            conn = get_db_connection()
+            try:
+                for batch in iter_changes(conn, since, limit, tables):
+                    yield ''.join(json.dumps(change, ensure_ascii=False) + '\n' for change in batch)
+            finally:
+                conn.close()
+        return Response(generate(), mimetype='application/x-ndjson')
+
+    try:
+        conn = get_db_connection()
+        changes = read_changes(conn, since, limit, tables)
+        latest = latest_seq(conn)
+        oldest = oldest_seq(conn)
+        reset = bool(since) and has_gap(conn, since)
+        conn.close()
+        next_since = changes[-1]['seq'] if changes else since
+        return jsonify({
+            'changes': changes,
+            'next_since': next_since,
+            'latest_seq': latest,
+            'oldest_seq': oldest,
+            'reset': reset,
+            # (修改) 按批次是否取满判断: 指定 tables 时，其他表之后的写入不会让 has_more 一直为 true
+            'has_more': len(changes) >= batch_size(limit) and next_since < latest,
+        })
+    except sqlite3.Error as e:
+        return jsonify({"error": f"数据库错误: {e}"}), 500
+
+
+# (新增) ===============================================
+#       数据库维护状态
+# =====================================================
+@app.route('/api/maintenance/status', methods=['GET'])
+def get_maintenance_status():
+    """
+    API 端点，返回当前车队数据库的维护状态 (见 maintenance.py):
+    文件大小、页数、空闲页、WAL 大小，各表自上次 ANALYZE 以来的写入行数，
+    到期的任务和本进程后台线程最近一次执行的结果。
+    """
+    db_file = current_fleet().db_file
+    try:
+        conn = get_db_connection()
+        status = maintenance_status(conn, db_file)
+        conn.close()
+    except sqlite3.Error as e:
+        return jsonify({"error": f"数据库错误: {e}"}), 500
+    status['scheduler'] = MAINTENANCE.status(db_file)
+    return jsonify(status)
+
+
+# (新增) ===============================================
+#       数据变更推送 (Server-Sent Events)
+# =====================================================
+@app.route('/api/events', methods=['GET'])
+def stream_events():
+    """
+    SSE 端点: 写接口提交后推送数据变更事件 (event: change)，
+    数据格式见 publish_change()。前端根据事件内容只刷新受影响的数据。
+    连接空闲时只发送心跳，不查询数据库。
+    (新增) 本进程的连接数达到 SSE_MAX_STREAMS 时返回 503，连接在 SSE_MAX_SECONDS 秒后关闭，
+    浏览器重连时可能分配到其他 worker，长连接不会一直占满同一个进程的线程。
+    """
+    q = EVENT_BROKER.subscribe(SSE_MAX_STREAMS)
+    if q is None:
+        return jsonify({"error": "事件推送连接数已满，请稍后重试"}), 503, {'Retry-After': '10'}
+
+    def generate():
+        deadline = time.monotonic() + SSE_MAX_SECONDS
+        try:
+            # 通知浏览器断线后 3 秒重连
+            yield "retry: 3000\n\n"
+            while time.monotonic() < deadline:
+                try:
+                    event = q.get(timeout=SSE_HEARTBEAT_SECONDS)
+                except queue.Empty:
+                    yield ": heartbeat\n\n"
+                    continue
+                yield format_sse(event)
+        finally:
+            EVENT_BROKER.unsubscribe(q)
+
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
 @app.route('/api/search', methods=['GET'])
 def search():
     """
@@ -1270,5 +2016,7 @@ if __name__ == '__main__':
     # 启动 Flask 开发服务器
     # debug=True: 开启调试模式，当代码有改动时服务器会自动重启，并提供详细的错误页面
     # port=5000: 指定服务器运行的端口
-    # 在生产环境中，应使用更专业的 WSGI 服务器，如 Gunicorn 或 Waitress
+    # 在生产环境中，请使用 serve.py (基于 Gunicorn 的多进程启动器)
+    preload_shared_state()
+    MAINTENANCE.start()
     app.run(debug=True, port=5000)
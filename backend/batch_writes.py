@@ -0,0 +1,157 @@
+"""
+数据管理页的批量写入: 在一个事务中执行多条 insert / update / delete。
+
+- 每条操作先按列白名单校验，任何一条不合法则整批拒绝，不写入任何数据。
+- 相邻且 (操作, 表, 列集合) 相同的操作合并为一次 executemany。
+- 整批只提交一次 (一次 fsync)，任何一组执行失败都会回滚整个事务。
+"""
+import sqlite3
+
+MAX_BATCH_OPERATIONS = 5000
+OPERATIONS = ('insert', 'update', 'delete')
+
+
+class BatchValidationError(Exception):
+    """批量操作校验失败，errors 为 [{'index': 序号, 'error': 说明}, ...]。"""
+
+    def __init__(self, errors):
+        super().__init__(f"{len(errors)} invalid operation(s)")
+        self.errors = errors
+
+
+class BatchExecutionError(Exception):
+    """执行某一组操作时数据库报错，整个事务已回滚。"""
+
+    def __init__(self, indexes, error):
+        super().__init__(str(error))
+        self.indexes = indexes
+        self.error = error
+
+
+def validate_operations(operations, writable_columns, id_columns):
+    """
+    校验并规范化操作列表。
+    writable_columns: {表名: 允许写入的列集合}；id_columns: {表名: 主键列}。
+    返回规范化后的操作列表 [{'index', 'op', 'table', 'id', 'data'}]。
+    """
+    if not isinstance(operations, list) or not operations:
+        raise BatchValidationError([{'index': None, 'error': 'operations 必须是非空列表'}])
+    if len(operations) > MAX_BATCH_OPERATIONS:
+        raise BatchValidationError([{'index': None, 'error': f'单批最多 {MAX_BATCH_OPERATIONS} 条操作'}])
+
+    normalized, errors = [], []
+    for index, item in enumerate(operations):
+        if not isinstance(item, dict):
+            errors.append({'index': index, 'error': '操作必须是对象'})
+            continue
+        op, table = item.get('op'), item.get('table')
+        data = item.get('data') or {}
+        if op not in OPERATIONS:
+            errors.append({'index': index, 'error': f'未知操作: {op}'})
+            continue
+        if table not in id_columns:
+            errors.append({'index': index, 'error': f'不支持的表: {table}'})
+            continue
+        if not isinstance(data, dict):
+            errors.append({'index': index, 'error': 'data 必须是对象'})
+            continue
+        unknown = sorted(set(data) - writable_columns[table])
+        if unknown:
+            errors.append({'index': index, 'error': f"不允许写入的列: {', '.join(unknown)}"})
+            continue
+        if op in ('update', 'delete') and item.get('id') is None:
+            errors.append({'index': index, 'error': f'{op} 操作缺少 id'})
+            continue
+        if op in ('insert', 'update') and not data:
+            errors.append({'index': index, 'error': f'{op} 操作缺少 data'})
+            continue
+        normalized.append({'index': index, 'op': op, 'table': table, 'id': item.get('id'), 'data': data})
+
+    if errors:
+        raise BatchValidationError(errors)
+    return normalized
+
+
+def group_operations(operations):
+    """把相邻且 (操作, 表, 列集合) 相同的操作分为一组，组内可以用 executemany 执行。"""
+    groups = []
+    for operation in operations:
+        key = (operation['op'], operation['table'], tuple(sorted(operation['data'])))
+        if groups and groups[-1][0] == key:
+            groups[-1][1].append(operation)
+        else:
+            groups.append((key, [operation]))
+    return groups
+
+
+def _existing_rows(conn, table, id_column, ids):
+    """一次查询取出 ids 中存在的记录，返回 {主键(字符串): 行字典}。"""
+    placeholders = ','.join('?' for _ in ids)
+    rows = conn.execute(f"SELECT * FROM {table} WHERE {id_column} IN ({placeholders})", ids).fetchall()
+    return {str(row[id_column]): dict(row) for row in rows}
+
+
+def execute_batch(conn, operations, id_columns, prepare=None):
+    """
+    在一个事务中执行已校验的操作，返回 (results, changed)。
+    (新增) prepare(operation) 返回实际写入的 data，在事务开始之后、执行任何操作之前对每条操作调用，
+    其中的写入 (例如登记违章地点) 与整批操作一起提交或回滚。
+    results: 与输入顺序一致的 [{'index', 'op', 'table', 'status', 'id'}]，
+             status 为 ok 或 not_found (update/delete 的目标不存在)。
+    changed: {表名: [受影响的行字典]}，包含修改前后的数据，用于发布变更事件。
+    """
+    results = [None] * len(operations)
+    changed = {}
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        if prepare is not None:
+            operations = [{**operation, 'data': prepare(operation)} for operation in operations]
+        for (op, table, columns), group in group_operations(operations):
+            id_column = id_columns[table]
+            indexes = [operation['index'] for operation in group]
+            touched = changed.setdefault(table, [])
+            try:
+                if op == 'insert':
+                    ids = _insert_group(conn, table, id_column, columns, group)
+                    touched.extend(operation['data'] for operation in group)
+                    statuses = [('ok', new_id) for new_id in ids]
+                else:
+                    target_ids = [operation['id'] for operation in group]
+                    before = _existing_rows(conn, table, id_column, target_ids)
+                    touched.extend(before.values())
+                    if op == 'update':
+                        assignments = ', '.join(f"{column} = ?" for column in columns)
+                        conn.executemany(
+                            f"UPDATE {table} SET {assignments} WHERE {id_column} = ?",
+                            [[operation['data'][column] for column in columns] + [operation['id']] for operation in group]
+                        )
+                        touched.extend(_existing_rows(conn, table, id_column, target_ids).values())
+                    else:
+                        conn.executemany(f"DELETE FROM {table} WHERE {id_column} = ?",
+                                         [(operation['id'],) for operation in group])
+                    statuses = [('ok' if str(operation['id']) in before else 'not_found', operation['id'])
+                                for operation in group]
+            except sqlite3.Error as e:
+                raise BatchExecutionError(indexes, e)
+            for (index, (status, row_id)) in zip(indexes, statuses):
+                results[index] = {'index': index, 'op': op, 'table': table, 'status': status, 'id': row_id}
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return results, changed
+
+
+def _insert_group(conn, table, id_column, columns, group):
+    """执行一组插入，返回每行的主键。"""
+    placeholders = ', '.join('?' for _ in columns)
+    conn.executemany(
+        f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders})",
+        [[operation['data'][column] for column in columns] for operation in group]
+    )
+    if id_column in columns:
+        return [operation['data'][id_column] for operation in group]
+    # 同一事务内持有写锁，未指定主键的连续插入按顺序分配 rowid，
+    # 因此可以由最后一个 rowid 反推出本组每一行的主键
+    last_id = conn.execute('SELECT last_insert_rowid()').fetchone()[0]
+    return list(range(last_id - len(group) + 1, last_id + 1))
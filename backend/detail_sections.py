@@ -0,0 +1,102 @@
+"""
+车辆详情接口的分段加载和历史记录的游标分页。
+
+include 参数 (逗号分隔) 选择要返回的分段，只执行所选分段需要的查询:
+    mileage         月度里程合计、趋势和按月明细
+    fuel            油耗合计、趋势 (按月明细在 mileage 中，不再重复返回)
+    violations      违章次数、趋势和第一页明细
+    violation_rank  部门内的违章排名 (violations.rank_info)，需要扫描整个部门的违章记录
+    maintenance     维保次数、费用和第一页明细
+basic_info 始终返回。不提供 include 时返回全部分段，与原来的响应结构相同。
+
+违章、维保明细按时间倒序分页，每页 limit 条 (默认 DEFAULT_PAGE_SIZE)。
+(修改) 既不提供 include、也不提供 limit 和游标的请求 (原有的调用方) 不分页，明细全部返回，next_cursor 为空。
+分段中的 next_cursor 不为空时，用 violations_cursor / maintenance_cursor 参数请求下一页；
+带游标的请求只返回该分段的 details 和 next_cursor，合计和趋势在第一页中已经返回，
+(修改) 其他分段 (包括 violation_rank) 不再查询。
+游标记录上一页最后一条的 (时间, ID)，翻页期间插入或删除记录不会造成重复或遗漏。
+"""
+import base64
+import json
+
+SECTIONS = ('mileage', 'fuel', 'violations', 'violation_rank', 'maintenance')
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+
+def query_limit(limit):
+    """SQL 中 LIMIT 的取值: 多取一行用于判断是否还有下一页；不分页时为 -1 (SQLite 表示不限制)。"""
+    return -1 if limit is None else limit + 1
+
+
+def narrow_to_cursors(include, cursors):
+    """带游标的请求只查询有游标的分段 (cursors: 分段 -> 游标或 None)。"""
+    paged = {section for section, cursor in cursors.items() if cursor is not None}
+    return paged if paged else include
+
+
+def parse_include(value):
+    """校验 include 参数，返回所选分段的集合；未提供时为全部分段。"""
+    if value is None:
+        return set(SECTIONS)
+    sections = {name.strip() for name in value.split(',') if name.strip()} - {'basic_info'}
+    unknown = sections - set(SECTIONS)
+    if unknown:
+        raise ValueError(f"include 只能包含 basic_info, {', '.join(SECTIONS)}")
+    return sections
+
+
+def parse_limit(value, default=DEFAULT_PAGE_SIZE):
+    """校验 limit 参数 (1 ~ MAX_PAGE_SIZE)，未提供时为 default (None 表示不分页)。"""
+    if value in (None, ''):
+        return default
+    try:
+        limit = int(value)
+    except ValueError:
+        raise ValueError('limit 必须是整数')
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        raise ValueError(f'limit 必须在 1 到 {MAX_PAGE_SIZE} 之间')
+    return limit
+
+
+def encode_cursor(time_value, row_id):
+    """(时间, ID) -> 不透明的游标字符串。"""
+    raw = json.dumps([time_value, row_id], ensure_ascii=False, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(value):
+    """游标字符串 -> (时间, ID)；未提供时返回 None，格式不正确时抛出 ValueError。"""
+    if not value:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(value + '=' * (-len(value) % 4))
+        time_value, row_id = json.loads(raw.decode('utf-8'))
+    except (ValueError, TypeError):
+        raise ValueError('游标无效')
+    if not isinstance(row_id, int) or not (time_value is None or isinstance(time_value, str)):
+        raise ValueError('游标无效')
+    return time_value, row_id
+
+
+def keyset_filter(time_column, id_column, cursor):
+    """
+    返回 (WHERE 片段, 参数)，选出排在游标之后的记录。
+    排序为 time_column DESC, id_column DESC；时间为空的记录排在最后 (SQLite 中 NULL 最小)。
+    """
+    if cursor is None:
+        return '', {}
+    time_value, row_id = cursor
+    params = {'cursor_time': time_value, 'cursor_id': row_id}
+    if time_value is None:
+        return f"AND {time_column} IS NULL AND {id_column} < :cursor_id", params
+    return (f"AND ({time_column} < :cursor_time OR {time_column} IS NULL"
+            f" OR ({time_column} = :cursor_time AND {id_column} < :cursor_id))"), params
+
+
+def page(rows, limit, time_key, id_key):
+    """取 limit + 1 行查询结果的前 limit 行，返回 (本页的行, next_cursor)；limit 为 None 时不分页。"""
+    if limit is None or len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(rows[-1][time_key], rows[-1][id_key])
@@ -0,0 +1,114 @@
+"""
+字典表 (部门、违章类型、维保单位) 的进程内缓存。
+
+这几张表很小且极少变化，但几乎每个统计接口都要把 id 翻译成名称。
+缓存保存 id -> 名称 的映射，并记录加载时 cache_versions 表中的版本号；
+字典表的任何写入都会通过触发器递增该版本号 (见 migrations.py)，
+因此其他进程 (例如 be/import_data.py) 的修改也能被及时发现。
+
+这样统计查询只需按整数 id 做 GROUP BY，名称在 Python 中补齐。
+
+(新增) 导入数据时 get_or_create() 把名称解析为 id: 缓存中没有的名称一次性
+INSERT OR IGNORE，然后只查询这些新名称的 id 并合并进缓存，不逐行查询，也不重新读取整张表。
+"""
+import sqlite3
+import threading
+
+# SQLite 单条语句的参数个数有上限，IN (...) 查询分批进行
+LOOKUP_CHUNK_SIZE = 500
+
+# 表名 -> (主键列, 名称列)
+DICTIONARY_COLUMNS = {
+    'departments': ('department_id', 'name'),
+    'violation_types': ('violation_type_id', 'description'),
+    'service_providers': ('provider_id', 'name'),
+}
+
+
+class DictionaryCache:
+    """带版本号的字典表缓存，线程安全。"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._maps = {table_name: {} for table_name in DICTIONARY_COLUMNS}
+
+    @staticmethod
+    def _read_version(conn):
+        try:
+            row = conn.execute("SELECT version FROM cache_versions WHERE name = 'dictionary'").fetchone()
+        except sqlite3.OperationalError:
+            # 尚未执行 migrations，无法判断版本，只能每次重新加载
+            return None
+        return row[0] if row else None
+
+    def refresh(self, conn):
+        """无条件地从数据库重新加载所有字典表。"""
+        with self._lock:
+            version = self._read_version(conn)
+            maps = {}
+            for table_name, (id_column, name_column) in DICTIONARY_COLUMNS.items():
+                rows = conn.execute(f"SELECT {id_column}, {name_column} FROM {table_name}").fetchall()
+                maps[table_name] = {row[0]: row[1] for row in rows}
+            self._maps = maps
+            self._version = version
+        return self._maps
+
+    def get(self, conn):
+        """返回 {表名: {id: 名称}}，版本号变化时自动重新加载。"""
+        version = self._read_version(conn)
+        if version is None or version != self._version:
+            return self.refresh(conn)
+        return self._maps
+
+    def get_or_create(self, conn, table_name, names, commit=True):
+        """
+        返回 {名称: id}，names 中不存在的名称会先写入字典表 (并提交)。
+        名称会去掉首尾空白，空名称被忽略。
+        (新增) commit=False 时新名称留在调用方的事务中；调用方回滚后需调用 invalidate()，
+        丢弃缓存中这些名称的 id。
+        """
+        # 保持首次出现的顺序，新名称的 id 按该顺序分配
+        names = list(dict.fromkeys(str(name).strip() for name in names if name is not None and str(name).strip()))
+        id_column, name_column = DICTIONARY_COLUMNS[table_name]
+        known = {name: dict_id for dict_id, name in self.get(conn)[table_name].items()}
+        missing = [name for name in names if name not in known]
+        if missing:
+            cached_version = self._version
+            inserted = conn.executemany(
+                f"INSERT OR IGNORE INTO {table_name} ({name_column}) VALUES (?)", [(name,) for name in missing]
+            ).rowcount
+            if commit:
+                conn.commit()
+            created = {}
+            for start in range(0, len(missing), LOOKUP_CHUNK_SIZE):
+                chunk = missing[start:start + LOOKUP_CHUNK_SIZE]
+                created.update((row[1], row[0]) for row in conn.execute(
+                    f"SELECT {id_column}, {name_column} FROM {table_name} "
+                    f"WHERE {name_column} IN ({','.join('?' for _ in chunk)})", chunk))
+            version = self._read_version(conn)
+            with self._lock:
+                maps = dict(self._maps)
+                maps[table_name] = {**maps[table_name], **{dict_id: name for name, dict_id in created.items()}}
+                self._maps = maps
+                # 版本号只因本次写入而变化时，缓存仍然完整；否则其他进程也写过字典表，下次 get() 时全量重新加载
+                if cached_version is not None and self._version == cached_version and version == cached_version + inserted:
+                    self._version = version
+                else:
+                    self._version = None
+            known.update(created)
+        return {name: known[name] for name in names if name in known}
+
+    def invalidate(self):
+        """本进程写入字典表后调用，下次 get() 时强制重新加载。"""
+        with self._lock:
+            self._version = None
+
+    @property
+    def version(self):
+        return self._version
+
+    @property
+    def maps(self):
+        """最近一次加载的映射 (不检查版本)，用于日志等非关键场景。"""
+        return self._maps
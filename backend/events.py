@@ -0,0 +1,142 @@
+"""
+数据变更事件的发布/订阅，供 Server-Sent Events 推送使用 (见 app.py 中的 /api/events)。
+
+写接口提交事务后调用 publish()，事件包含受影响的表、车牌号、部门和月份，
+前端据此只重新获取受影响的数据，不再轮询整页汇总。
+
+生产环境有多个 worker 进程 (见 gunicorn.conf.py)，订阅者可能连接在其他进程上，
+因此事件在本进程内直接分发的同时会追加写入一个共享的事件文件；
+每个进程有一个后台线程监视该文件，把其他进程发布的事件转发给本进程的订阅者。
+整个过程只涉及文件的 stat/read，空闲的看板不会对数据库产生任何查询。
+
+每个打开的 SSE 连接在 gthread worker 中一直占用一个线程，subscribe(limit) 限制每个进程的连接数，
+超出时由 app.py 返回 503，前端稍后重试 (见 gunicorn.conf.py 中的说明)。
+"""
+import json
+import os
+import queue
+import threading
+import time
+
+# 订阅者队列的最大长度，消费过慢的连接会丢弃最旧的事件 (前端收到任意事件都会刷新)
+SUBSCRIBER_QUEUE_SIZE = 100
+# 事件文件超过该大小时截断，其他进程检测到文件变小后从头读取
+EVENTS_FILE_MAX_BYTES = 1024 * 1024
+RELAY_POLL_INTERVAL = 0.5
+
+
+class EventBroker:
+    """进程内的事件分发器，可选地通过共享文件在多个进程间转发事件。"""
+
+    def __init__(self, events_file=None):
+        self.events_file = events_file
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._relay_thread = None
+
+    # --- 订阅 ---
+
+    def subscribe(self, limit=None):
+        """
+        注册一个订阅者，返回其事件队列；已有 limit 个订阅者时返回 None。
+        使用完毕后必须调用 unsubscribe()。
+        """
+        q = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        with self._lock:
+            if limit is not None and len(self._subscribers) >= limit:
+                return None
+            self._subscribers.add(q)
+            self._start_relay()
+        return q
+
+    def unsubscribe(self, q):
+        with self._lock:
+            self._subscribers.discard(q)
+
+    @property
+    def subscriber_count(self):
+        return len(self._subscribers)
+
+    # --- 发布 ---
+
+    def publish(self, event):
+        """发布一个事件 (可 JSON 序列化的字典)。"""
+        event = dict(event, ts=time.time())
+        self._dispatch(event)
+        if self.events_file:
+            self._append(dict(event, pid=os.getpid()))
+
+    def _dispatch(self, event):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for q in subscribers:
+            try:
+                q.put_nowait(event)
+            except queue.Full:
+                # 丢弃最旧的事件，保证最新的变更一定能送达
+                try:
+                    q.get_nowait()
+                    q.put_nowait(event)
+                except (queue.Empty, queue.Full):
+                    pass
+
+    def _append(self, event):
+        line = (json.dumps(event, ensure_ascii=False) + '\n').encode('utf-8')
+        try:
+            # O_APPEND 保证多个进程同时写入时各自的整行不会相互覆盖
+            fd = os.open(self.events_file, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                if os.fstat(fd).st_size > EVENTS_FILE_MAX_BYTES:
+                    os.ftruncate(fd, 0)
+                os.write(fd, line)
+            finally:
+                os.close(fd)
+        except OSError:
+            pass
+
+    # --- 跨进程转发 ---
+
+    def _start_relay(self):
+        if not self.events_file or (self._relay_thread and self._relay_thread.is_alive()):
+            return
+        self._relay_thread = threading.Thread(target=self._relay, name='event-relay', daemon=True)
+        self._relay_thread.start()
+
+    def _relay(self):
+        pid = os.getpid()
+        try:
+            offset = os.path.getsize(self.events_file)
+        except OSError:
+            offset = 0
+        while True:
+            time.sleep(RELAY_POLL_INTERVAL)
+            try:
+                size = os.path.getsize(self.events_file)
+            except OSError:
+                continue
+            if not self._subscribers:
+                # 没有订阅者时跳过期间的事件，之后的订阅者只收到订阅之后发布的事件
+                offset = size
+                continue
+            if size < offset:  # 文件被截断
+                offset = 0
+            if size == offset:
+                continue
+            with open(self.events_file, 'rb') as f:
+                f.seek(offset)
+                chunk = f.read(size - offset)
+            # 只处理完整的行，未写完的部分留到下一轮
+            complete = chunk.rfind(b'\n') + 1
+            offset += complete
+            for line in chunk[:complete].splitlines():
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    continue
+                if event.pop('pid', None) != pid:
+                    self._dispatch(event)
+
+
+def format_sse(event, event_type='change'):
+    """把事件编码为 SSE 消息。"""
+    return f"event: {event_type}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
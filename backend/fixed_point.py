@@ -0,0 +1,219 @@
+"""
+金额和油量的定点整数存储模式 (可选)。
+
+NUMERIC / DECIMAL 列在 SQLite 中实际以 REAL 保存，大量记录求和会积累浮点误差。启用定点模式后:
+    金额 (采购价格、维保费用、油费) 以 "分" 保存为整数 (x100)
+    油量 (total_fuel_amount) 以 "毫升" 保存为整数 (x1000)
+SUM 在整数上精确计算，最后只做一次除法；小整数也比 REAL 占用更少的存储空间
+(1 ~ 4 字节对 8 字节)。NUMERIC 亲和性的列存入整数后就是 INTEGER 存储类，不需要修改表结构。
+
+换算比例保存在数据库的 column_scales 表中 (见 migrations.py)，表为空即原来的浮点模式，
+同一份代码可以读写两种模式的数据库:
+- 汇总: range_index.py、sampling.py 的 SQL 用 sum_sql() / value_sql() 换算回原单位。
+- 接口: app.py 返回记录前用 from_storage() 换算，写入前 (增删改、批量写入、Excel 上传)
+  用 to_storage() / frame_to_storage() 换算，接口的输入输出与浮点模式完全相同。
+- 全量导入: be/import_data.py 在 FLEET_FIXED_POINT=1 时把新库切换为定点模式。
+无法解析为数值的值 (例如历史数据中的文本) 保持原样。
+
+切换模式 (set_fixed_point) 在一个事务中换算主库和已冻结的归档年份 (见 partitions.py)，
+换算不经过变更日志的更新触发器，改为每张表记一条 reload，各进程的缓存和索引随之重建。
+
+用法 (在 backend 目录下):
+    python fixed_point.py status
+    python fixed_point.py enable
+    python fixed_point.py disable
+"""
+import argparse
+import math
+import os
+import sqlite3
+import sys
+
+from migrations import create_journal_triggers, migrate, table_exists
+from partitions import ARCHIVE_SCHEMA, archive_table, attach_archive, registered_partitions, set_writable
+
+FIXED_POINT = os.environ.get('FLEET_FIXED_POINT', '') not in ('', '0')
+
+# 表 -> {列: 比例}
+SCALED_COLUMNS = {
+    'vehicles': {'purchase_price': 100},
+    'maintenance': {'maintenance_cost': 100},
+    'monthly_fuel_summary': {'total_fuel_cost': 100, 'total_fuel_amount': 1000},
+}
+
+
+def column_scales(conn):
+    """当前数据库的换算比例 {表: {列: 比例}}；浮点模式 (或尚未执行 migrations) 时为空。"""
+    try:
+        rows = conn.execute('SELECT table_name, column_name, scale FROM column_scales').fetchall()
+    except sqlite3.OperationalError:
+        return {}
+    scales = {}
+    for table_name, column, scale in rows:
+        scales.setdefault(table_name, {})[column] = scale
+    return scales
+
+
+def value_sql(scales, table_name, column, alias=None):
+    """读取 column 的原单位数值的 SQL 表达式。"""
+    ref = f"{alias}.{column}" if alias else column
+    scale = scales.get(table_name, {}).get(column)
+    return f"({ref} / {scale}.0)" if scale else ref
+
+
+def sum_sql(scales, table_name, column):
+    """column 合计 (原单位) 的 SQL 表达式: 先对整数求和，再换算。"""
+    scale = scales.get(table_name, {}).get(column)
+    return f"(SUM({column}) / {scale}.0)" if scale else f"SUM({column})"
+
+
+def scale_aggregate(scales, table_name, expression):
+    """把 'SUM(列)' 形式的聚合表达式换算为原单位，其他表达式保持不变。"""
+    for column in scales.get(table_name, {}):
+        if expression == f"SUM({column})":
+            return sum_sql(scales, table_name, column)
+    return expression
+
+
+def _from_storage_value(value, scale):
+    if isinstance(value, int) and not isinstance(value, bool):
+        # 与浮点模式一致: NUMERIC 列中的整数值原样返回整数
+        return value // scale if value % scale == 0 else value / scale
+    return value
+
+
+def _round_scaled(value, scale):
+    """
+    (新增) value x scale 四舍五入为整数，.5 远离零 (与 set_fixed_point 使用的 SQLite round() 相同，
+    Python 的 round() 是银行家舍入)。先舍去乘法带来的浮点误差，1.005 元换算为 101 分。
+    """
+    scaled = round(value * scale, 6)
+    return int(math.copysign(math.floor(abs(scaled) + 0.5), scaled))
+
+
+def _to_storage_value(value, scale):
+    if value is None or value == '':
+        return value
+    try:
+        return _round_scaled(float(value), scale)
+    except (TypeError, ValueError, OverflowError):
+        return value
+
+
+def from_storage(scales, table_name, record):
+    """数据库中读出的一条记录 (字典) -> 原单位，返回新的字典。"""
+    columns = scales.get(table_name)
+    if not columns:
+        return record
+    return {key: _from_storage_value(value, columns[key]) if key in columns else value
+            for key, value in record.items()}
+
+
+def to_storage(scales, table_name, record):
+    """要写入的一条记录 (字典) -> 存储单位，返回新的字典。"""
+    columns = scales.get(table_name)
+    if not columns:
+        return record
+    return {key: _to_storage_value(value, columns[key]) if key in columns else value
+            for key, value in record.items()}
+
+
+def frame_to_storage(scales, table_name, df):
+    """要写入的 DataFrame -> 存储单位 (空值保持为空)。"""
+    columns = [column for column in scales.get(table_name, {}) if column in df.columns]
+    if not columns:
+        return df
+    df = df.copy()
+    for column in columns:
+        # (修改) 舍入规则与 _round_scaled 相同
+        scaled = (df[column].astype('float64') * scales[table_name][column]).round(6)
+        magnitude = (scaled.abs() + 0.5) // 1
+        df[column] = magnitude.where(scaled >= 0, -magnitude).astype('Int64')
+    return df
+
+
+def _convert_sql(table_ref, column, scale, enable):
+    """换算一列的 UPDATE 语句；只处理数值，文本等其他值保持不变。"""
+    target = f"CAST(round({column} * {scale}) AS INTEGER)" if enable else f"{column} / {scale}.0"
+    return f"UPDATE {table_ref} SET {column} = {target} WHERE typeof({column}) IN ('integer', 'real')"
+
+
+def set_fixed_point(conn, enable):
+    """
+    切换数据库的存储模式，返回换算过的表名列表 (模式未变化时为空)。
+    conn 需要处于自动提交模式 (isolation_level=None)，或调用前没有未提交的事务。
+    """
+    migrate(conn)
+    target = SCALED_COLUMNS if enable else {}
+    if column_scales(conn) == {t: c for t, c in target.items() if table_exists(conn, t)}:
+        return []
+
+    partitions = registered_partitions(conn)
+    archive_file = partitions[0][2] if partitions and os.path.exists(partitions[0][2]) else None
+    if archive_file:
+        set_writable(archive_file, True)
+        attach_archive(conn, archive_file)
+    converted = []
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        for table_name, columns in SCALED_COLUMNS.items():
+            if not table_exists(conn, table_name):
+                continue
+            journaled = table_exists(conn, 'change_journal')
+            # 与 migrations 中的回填相同: 暂时移除更新触发器，记一次全量重建标记代替逐行日志
+            conn.execute(f"DROP TRIGGER IF EXISTS trg_{table_name}_journal_update")
+            for column, scale in columns.items():
+                conn.execute(_convert_sql(f"main.{table_name}", column, scale, enable))
+                for archived_table, year, _, archived_columns in partitions:
+                    if archive_file and archived_table == table_name and column in archived_columns:
+                        conn.execute(_convert_sql(f"{ARCHIVE_SCHEMA}.{archive_table(table_name, year)}",
+                                                  column, scale, enable))
+            if journaled:
+                create_journal_triggers(conn, table_name)
+                conn.execute("INSERT INTO change_journal (table_name, op) VALUES (?, 'reload')", (table_name,))
+            converted.append(table_name)
+        conn.execute("DELETE FROM column_scales")
+        conn.executemany(
+            "INSERT INTO column_scales (table_name, column_name, scale) VALUES (?, ?, ?)",
+            [(table_name, column, scale) for table_name in converted
+             for column, scale in target.get(table_name, {}).items()]
+        )
+        conn.execute('COMMIT')
+    except sqlite3.Error:
+        conn.execute('ROLLBACK')
+        raise
+    finally:
+        if archive_file:
+            conn.execute(f'DETACH DATABASE {ARCHIVE_SCHEMA}')
+            set_writable(archive_file, False)
+    return converted
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='金额、油量的定点整数存储模式')
+    parser.add_argument('--db', default=os.environ.get('FLEET_DB_FILE', os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), 'data', 'vehicle_data_optimized.db')), help='数据库文件')
+    parser.add_argument('command', choices=('status', 'enable', 'disable'))
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if not os.path.exists(args.db):
+        sys.exit(f"数据库不存在: {args.db}")
+    conn = sqlite3.connect(args.db, isolation_level=None)
+    try:
+        if args.command != 'status':
+            converted = set_fixed_point(conn, args.command == 'enable')
+            print(f"已换算: {', '.join(converted)}" if converted else "存储模式没有变化")
+        scales = column_scales(conn)
+        print("存储模式:", "定点整数" if scales else "浮点")
+        for table_name, columns in scales.items():
+            for column, scale in columns.items():
+                print(f"  {table_name}.{column} x{scale}")
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+"""
+多车队分片: 每个车队 (单位、区县) 使用独立的 SQLite 数据库文件，跨车队汇总时分散到各分片计算后合并。
+
+注册表 (环境变量 FLEET_SHARDS 指向的 JSON 文件):
+    {
+        "langxi": {"name": "郎溪县", "db_file": "data/langxi.db"},
+        "guangde": {"name": "广德市", "db_file": "/srv/fleet/guangde.db"}
+    }
+db_file 的相对路径相对于注册表文件所在的目录。FLEET_DB_FILE 始终是默认车队:
+注册表中指向同一文件的条目就是默认车队，否则默认车队的 ID 为 DEFAULT_FLEET_ID。
+没有配置注册表时只有默认车队，所有接口与原来完全相同。
+
+按车队路由 (app.py): 各接口的 fleet 参数选择分片，不提供时为默认车队。
+
+跨车队汇总 (/api/fleets/...): scatter() 在线程池中并发请求各车队的同名接口，
+每个车队的结果就是一份部分汇总，再由下面的 merge_* 合并:
+- 合计按字段相加；趋势按标签对齐后相加，再统一降采样。
+- 车辆排名: 每个车队返回自己的前 page * per_page 名，按排序字段归并后取所需的一页，
+  结果与把所有车队的车辆放在一起排序相同。
+- Top-N (违章地点等): 每个车队返回前 MAX_TOP_N 名，按名称合并计数后重新排名。
+  某个车队的名称多于 MAX_TOP_N 个时，排名靠后的计数可能偏小。
+某个车队失败时其余车队照常合并，失败的车队列在 errors 中。
+"""
+import heapq
+import json
+import os
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+from granularity import trend
+
+DEFAULT_FLEET_ID = os.environ.get('FLEET_DEFAULT_ID', 'default')
+DEFAULT_FLEET_NAME = '默认车队'
+SCATTER_THREADS = int(os.environ.get('FLEET_SCATTER_THREADS', 4))
+
+Fleet = namedtuple('Fleet', 'fleet_id name db_file is_default')
+
+
+class FleetRegistry:
+    """车队 ID -> 数据库文件。默认车队的数据库文件在调用时传入 (app.DB_FILE 可能在导入后被修改)。"""
+
+    def __init__(self, shards=None):
+        # {车队 ID: (名称, 数据库文件)}
+        self.shards = dict(shards or {})
+
+    @classmethod
+    def load(cls, path):
+        """读取注册表文件；path 为空时返回只有默认车队的注册表。"""
+        if not path:
+            return cls()
+        with open(path, encoding='utf-8') as f:
+            entries = json.load(f)
+        base_dir = os.path.dirname(os.path.abspath(path))
+        shards = {}
+        for fleet_id, entry in entries.items():
+            if isinstance(entry, str):
+                entry = {'db_file': entry}
+            db_file = os.path.join(base_dir, entry['db_file'])
+            shards[str(fleet_id)] = (entry.get('name') or str(fleet_id), db_file)
+        return cls(shards)
+
+    def _default_id(self, default_db_file):
+        default_path = os.path.abspath(default_db_file)
+        for fleet_id, (_, db_file) in self.shards.items():
+            if os.path.abspath(db_file) == default_path:
+                return fleet_id
+        return DEFAULT_FLEET_ID
+
+    def fleets(self, default_db_file):
+        """所有车队 [Fleet]，默认车队在最前面，其余按注册表中的顺序。"""
+        default_id = self._default_id(default_db_file)
+        name = self.shards[default_id][0] if default_id in self.shards else DEFAULT_FLEET_NAME
+        fleets = [Fleet(default_id, name, default_db_file, True)]
+        fleets.extend(Fleet(fleet_id, name, db_file, False)
+                      for fleet_id, (name, db_file) in self.shards.items() if fleet_id != default_id)
+        return fleets
+
+    def resolve(self, fleet_id, default_db_file):
+        """fleet 参数 -> Fleet；未提供时为默认车队，未知的 ID 抛出 KeyError。"""
+        fleets = self.fleets(default_db_file)
+        if not fleet_id:
+            return fleets[0]
+        for fleet in fleets:
+            if fleet.fleet_id == fleet_id:
+                return fleet
+        raise KeyError(fleet_id)
+
+
+def scatter(fleets, fetch, threads=SCATTER_THREADS):
+    """
+    在线程池中对每个车队调用 fetch(fleet) -> (HTTP 状态码, JSON)。
+    返回 ([(Fleet, JSON)], errors)，结果保持 fleets 的顺序。
+    """
+    results, errors = [], []
+    with ThreadPoolExecutor(max_workers=max(1, min(threads, len(fleets))), thread_name_prefix='scatter') as executor:
+        futures = [executor.submit(fetch, fleet) for fleet in fleets]
+        for fleet, future in zip(fleets, futures):
+            try:
+                status, body = future.result()
+            except Exception as e:
+                errors.append({'fleet': fleet.fleet_id, 'error': str(e)})
+                continue
+            if status == 200 and isinstance(body, dict):
+                results.append((fleet, body))
+            else:
+                error = body.get('error') if isinstance(body, dict) else None
+                errors.append({'fleet': fleet.fleet_id, 'status': status, 'error': error})
+    return results, errors
+
+
+def _add(values):
+    total = sum(value or 0 for value in values)
+    return round(total, 6) if isinstance(total, float) else total
+
+
+def add_totals(parts):
+    """按字段相加多个 {字段: 数值}，字段顺序以第一次出现为准。"""
+    keys = list(dict.fromkeys(key for part in parts for key in part))
+    return {key: _add(part.get(key) for part in parts) for key in keys}
+
+
+def merge_series(series, max_points=None):
+    """合并多条趋势序列 ({'labels', 'data', 'granularity'})：同一标签的值相加，再按 max_points 降采样。"""
+    totals = {}
+    for item in series:
+        for label, value in zip(item['labels'], item['data']):
+            totals.setdefault(label, []).append(value)
+    labels = sorted(totals)
+    granularity = series[0]['granularity'] if series else None
+    return trend(labels, [_add(totals[label]) for label in labels], granularity, max_points)
+
+
+def merge_ranked(rankings, key, descending=True, limit=None):
+    """
+    归并多个已按 key 排好序的列表，取前 limit 项 (None 为全部)。
+    值相同时按 rankings 的顺序 (即车队顺序)，同一车队内保持原有顺序。
+    """
+    merged = heapq.merge(*rankings, key=lambda item: item[key] or 0, reverse=descending)
+    return list(islice(merged, limit))
+
+
+def merge_top(rankings, n):
+    """合并多个 Top-N 列表 ([{'name', 'count'}])：按名称累加计数，返回计数最多的 n 项 (计数相同按名称)。"""
+    counts = {}
+    for items in rankings:
+        for item in items:
+            counts[item['name']] = counts.get(item['name'], 0) + item['count']
+    ranked = sorted(counts.items(), key=lambda entry: (-entry[1], entry[0]))
+    return [{'name': name, 'count': count} for name, count in ranked[:n]]
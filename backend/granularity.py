@@ -0,0 +1,137 @@
+"""
+趋势图的时间粒度 (周 / 月 / 季 / 年) 和服务端降采样。
+
+桶的标签可以直接按字符串排序:
+    week    -> '2025-W09' (ISO 周)
+    month   -> '2025-03'
+    quarter -> '2025-Q1'
+    year    -> '2025'
+油耗、里程来自月度汇总表，没有周数据，请求按周时这些序列仍按月返回，
+返回值中的 granularity 字段给出每条序列实际使用的粒度。
+
+降采样把相邻的桶合并 (数值相加，标签为 '首个桶~最后一个桶')，
+各项合计在降采样前后保持不变，图表的数据点数不超过 max_points。
+"""
+import calendar
+import re
+from datetime import date
+
+GRANULARITIES = ('week', 'month', 'quarter', 'year')
+DEFAULT_GRANULARITY = 'month'
+# 每个桶包含的月数 (按周以外的粒度)
+MONTHS_PER_BUCKET = {'month': 1, 'quarter': 3, 'year': 12}
+MIN_POINTS = 2
+
+_MONTH_RE = re.compile(r'(\d{4})-(0[1-9]|1[0-2])')
+
+
+def parse_granularity(value):
+    """校验 granularity 参数，未提供时为按月。"""
+    if not value:
+        return DEFAULT_GRANULARITY
+    value = value.lower()
+    if value not in GRANULARITIES:
+        raise ValueError(f"granularity 必须是 {', '.join(GRANULARITIES)} 之一")
+    return value
+
+
+def parse_max_points(value):
+    """校验 max_points 参数，未提供时不降采样。"""
+    if value in (None, ''):
+        return None
+    try:
+        points = int(value)
+    except ValueError:
+        raise ValueError('max_points 必须是整数')
+    if points < MIN_POINTS:
+        raise ValueError(f'max_points 不能小于 {MIN_POINTS}')
+    return points
+
+
+def series_granularity(granularity, monthly):
+    """按月记录的数据 (油耗、里程) 没有周粒度，回退为按月。"""
+    return 'month' if monthly and granularity == 'week' else granularity
+
+
+def month_number(month):
+    """'YYYY-MM' -> 连续的月份序号 (year * 12 + month - 1)，格式不正确时返回 None。"""
+    match = _MONTH_RE.fullmatch(month or '')
+    if not match or match.group(1) == '0000':
+        return None
+    return int(match.group(1)) * 12 + int(match.group(2)) - 1
+
+
+def month_label(number):
+    return f"{number // 12:04d}-{number % 12 + 1:02d}"
+
+
+def days_in_month(number):
+    return calendar.monthrange(number // 12, number % 12 + 1)[1]
+
+
+def parse_day(value):
+    """时间字符串 -> date；日期超出当月天数时取当月最后一天，月份无法识别时返回 None。"""
+    number = month_number(str(value)[:7]) if value else None
+    if number is None:
+        return None
+    day = str(value)[8:10]
+    day = int(day) if day.isdigit() else 1
+    return date(number // 12, number % 12 + 1, min(max(day, 1), days_in_month(number)))
+
+
+def month_bucket(number, granularity):
+    """月份序号 -> 所属桶的标签 (month / quarter / year)。"""
+    year, month = divmod(number, 12)
+    if granularity == 'year':
+        return f"{year:04d}"
+    if granularity == 'quarter':
+        return f"{year:04d}-Q{month // 3 + 1}"
+    return month_label(number)
+
+
+def day_bucket(day, granularity):
+    """date -> 所属桶的标签。"""
+    if granularity == 'week':
+        iso_year, week, _ = day.isocalendar()
+        return f"{iso_year:04d}-W{week:02d}"
+    return month_bucket(day.year * 12 + day.month - 1, granularity)
+
+
+def bucket_totals(items, granularity):
+    """
+    [(时间字符串, 值), ...] -> 按粒度合计后的 (labels, data)，按时间先后排序。
+    时间无法识别的记录被忽略。
+    """
+    totals = {}
+    for value, amount in items:
+        day = parse_day(value)
+        if day is None:
+            continue
+        label = day_bucket(day, granularity)
+        totals[label] = totals.get(label, 0) + (amount or 0)
+    labels = sorted(totals)
+    return labels, [totals[label] for label in labels]
+
+
+def _merge(values):
+    total = sum(value or 0 for value in values)
+    return round(total, 6) if isinstance(total, float) else total
+
+
+def downsample(labels, data, max_points):
+    """相邻的桶合并为一组，使数据点数不超过 max_points。"""
+    if not max_points or len(labels) <= max_points:
+        return labels, data
+    size = -(-len(labels) // max_points)
+    merged_labels, merged_data = [], []
+    for start in range(0, len(labels), size):
+        chunk = labels[start:start + size]
+        merged_labels.append(chunk[0] if len(chunk) == 1 else f"{chunk[0]}~{chunk[-1]}")
+        merged_data.append(_merge(data[start:start + size]))
+    return merged_labels, merged_data
+
+
+def trend(labels, data, granularity, max_points=None):
+    """组装一条趋势序列: {'labels', 'data', 'granularity'}。"""
+    labels, data = downsample(list(labels), list(data), max_points)
+    return {'labels': labels, 'data': data, 'granularity': granularity}
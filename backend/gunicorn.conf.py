@@ -0,0 +1,97 @@
+"""
+Gunicorn 生产环境配置。
+
+用法 (在 backend 目录下):
+    gunicorn -c gunicorn.conf.py app:app
+或使用封装好的启动器:
+    python serve.py --workers 8 --threads 4
+
+所有参数都可以通过环境变量覆盖，便于在不同机器上调优。
+
+--- 调优参考 (4–16 核服务器) ---
+本应用以 SQLite 读查询为主，单个请求的耗时主要花在 CPU 上的聚合计算，
+同时数据库文件读取会释放 GIL，因此采用 "多进程 + 少量线程" 的 gthread 模式:
+
+    CPU 核数 | FLEET_WORKERS | FLEET_THREADS | 说明
+    ---------|---------------|---------------|-------------------------------
+       4     |       4       |       4       | 16 个并发请求槽位
+       8     |       8       |       4       | 32 个并发请求槽位
+      16     |      12       |       4       | SQLite 单写者，进程再多收益递减
+
+- worker 数一般取 CPU 核数，超过 12 之后对 SQLite 读写锁的竞争会抵消收益。
+- 线程数 2–4 即可，更多的线程只会在 GIL 上排队。
+- 上传 Excel 等长请求较多时适当调大 FLEET_TIMEOUT。
+- FLEET_MAX_REQUESTS 让 worker 定期重启，防止长期运行的内存碎片积累。
+- FLEET_WARMUP_THREADS (默认 2) 是预热汇总接口的并发上限 (见 warmup.py)；master 在 fork 之前预热一次。
+  之后数据版本变化并在 FLEET_WARMUP_DEBOUNCE 秒 (默认 5) 内不再变化时重新预热，由一个 worker 执行，
+  结果经 FLEET_SINGLEFLIGHT_DIR 共享目录给所有 worker 使用。
+- 每个打开的看板通过 /api/events (SSE) 保持一个长连接，在 gthread worker 中一直占用一个线程。
+  每个 worker 最多 FLEET_SSE_MAX_STREAMS 个连接 (默认 FLEET_THREADS 的一半，其余线程留给普通请求)，
+  超出时返回 503，前端 10 秒后重试；连接在 FLEET_SSE_MAX_SECONDS 秒 (默认 300) 后关闭并由浏览器重连，
+  使连接分散到各个 worker。同时在线的看板数上限约为 FLEET_WORKERS * FLEET_SSE_MAX_STREAMS。
+  看板较多时单独启动一个只处理事件推送的进程 (事件经共享的事件文件在进程间转发)，
+  由反向代理把 /api/events 转发过去，例如:
+      FLEET_WORKERS=1 FLEET_THREADS=200 FLEET_SSE_MAX_STREAMS=190 gunicorn -c gunicorn.conf.py -b 127.0.0.1:5001 app:app
+- FLEET_SINGLEFLIGHT_DIR 是一个本机目录，缓存未命中的相同请求在多个 worker 之间通过文件锁只计算一次
+  (见 singleflight.py)。多 worker 时默认为数据库旁的 <数据库>.flight 目录；单个 worker 时默认不使用，
+  只在同一 worker 的线程之间合并。
+- FLEET_READ_SNAPSHOT=1 时汇总类接口从主库的只读快照 (<数据库>.snapshot) 读取，不与写入争用主库；
+  写入后由后台线程合并刷新 (两次复制至少间隔 FLEET_SNAPSHOT_MIN_INTERVAL 秒，默认 1，同一时间只有一个进程复制)，
+  快照超过 FLEET_SNAPSHOT_MAX_AGE 秒 (默认 60) 时也会检查并刷新 (见 snapshot.py)。
+- 每个 worker 有一个数据库维护线程 (见 maintenance.py)，每 FLEET_MAINTENANCE_INTERVAL 秒 (默认 60) 检查一次:
+  写入量达到 FLEET_ANALYZE_ROWS 时 ANALYZE，WAL 达到 FLEET_CHECKPOINT_MB 时检查点，
+  空闲页达到 FLEET_VACUUM_FREE_PAGES 时增量回收，空闲 FLEET_MAINTENANCE_IDLE 秒后做完剩余的少量工作；
+  同一时间只有一个 worker 执行，状态见 /api/maintenance/status。
+- FLEET_SHARDS 指向车队注册表后，fleet 参数选择车队数据库，/api/fleets/... 跨车队汇总在
+  每个请求内用 FLEET_SCATTER_THREADS (默认 4) 个线程并发查询各车队 (见 fleets.py)。
+"""
+import multiprocessing
+import os
+
+bind = os.environ.get('FLEET_BIND', '0.0.0.0:5000')
+
+# 默认与 CPU 核数一致，最多 12 个 (见上方调优说明)
+workers = int(os.environ.get('FLEET_WORKERS', min(multiprocessing.cpu_count(), 12)))
+threads = int(os.environ.get('FLEET_THREADS', 4))
+worker_class = 'gthread'
+
+timeout = int(os.environ.get('FLEET_TIMEOUT', 120))
+graceful_timeout = int(os.environ.get('FLEET_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.environ.get('FLEET_KEEPALIVE', 5))
+max_requests = int(os.environ.get('FLEET_MAX_REQUESTS', 2000))
+max_requests_jitter = int(os.environ.get('FLEET_MAX_REQUESTS_JITTER', 200))
+
+# (新增) 多 worker 时默认在数据库旁使用共享目录，缓存未命中的合并和数据变化后的预热在整个服务内只做一次
+#        (路径与 app.py 中 DB_FILE 的默认值一致；本文件在 master 导入 app 之前执行)
+if workers > 1:
+    default_db_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'vehicle_data_optimized.db')
+    os.environ.setdefault('FLEET_SINGLEFLIGHT_DIR', os.environ.get('FLEET_DB_FILE', default_db_file) + '.flight')
+
+# 在 master 进程中预先导入 app，fork 出的 worker 共享已加载的代码和只读数据
+preload_app = True
+
+accesslog = os.environ.get('FLEET_ACCESS_LOG', '-')
+errorlog = os.environ.get('FLEET_ERROR_LOG', '-')
+loglevel = os.environ.get('FLEET_LOG_LEVEL', 'info')
+
+
+def on_starting(server):
+    """master 进程启动时 (app 已预加载) 升级数据库结构并加载字典表等只读共享状态。"""
+    import app
+    app.preload_shared_state()
+    server.log.info("Preloaded dictionary tables: %s",
+                    {name: len(rows) for name, rows in app.DICTIONARY_CACHE.maps.items()})
+    server.log.info("Warmed response cache: %s", app.RESPONSE_CACHE.stats())
+
+
+def on_reload(server):
+    """收到 SIGHUP 时在 master 中刷新共享状态，随后新 worker 会继承最新数据。"""
+    import app
+    app.preload_shared_state()
+    server.log.info("Reloaded shared state on SIGHUP")
+
+
+def post_fork(server, worker):
+    """线程不会随 fork 复制，在每个 worker 中启动数据库后台维护线程。"""
+    import app
+    app.MAINTENANCE.start()
@@ -0,0 +1,129 @@
+"""
+车辆图片的存储、缩略图生成和垃圾回收。
+
+- 上传的原图按内容哈希命名 (sha256 前 32 位)，相同内容只保存一份。
+- 缩略图 (thumb) 和中图 (medium) 保存在 variants/ 子目录，文件名由原图文件名
+  和尺寸名组成；上传时生成，旧图片在第一次被请求时按需生成。
+- 文件名与内容一一对应，因此可以放心地设置长期不可变缓存 (见 app.py 中的 uploaded_file)。
+- 重新上传后不再被 vehicles.image_url 引用的旧图片由 collect_orphan_images() 回收。
+
+缩略图依赖 Pillow；未安装时所有尺寸都回退为原图。
+"""
+import hashlib
+import os
+import time
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow 是可选依赖
+    Image = None
+
+# 尺寸名 -> 最长边像素
+IMAGE_VARIANTS = {
+    'thumb': 320,
+    'medium': 1024,
+}
+VARIANT_DIR_NAME = 'variants'
+VARIANT_JPEG_QUALITY = 85
+
+# 新保存的文件在宽限期内不参与回收，避免与正在进行的上传 (文件已写入、数据库尚未提交) 冲突
+ORPHAN_GRACE_SECONDS = 3600
+
+
+def content_filename(data, ext):
+    """根据文件内容生成文件名，例如 3f1c...9a.jpg。"""
+    return f"{hashlib.sha256(data).hexdigest()[:32]}.{ext}"
+
+
+def variant_filename(filename, variant):
+    """原图文件名 -> 缩略图文件名，统一保存为 JPEG。"""
+    stem = filename.rsplit('.', 1)[0]
+    return f"{stem}_{variant}.jpg"
+
+
+def _touch(path):
+    """更新文件的修改时间，文件不存在时返回 False。"""
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        return False
+    return True
+
+
+def save_original(upload_folder, data, ext):
+    """
+    保存原图并生成各尺寸缩略图，返回原图文件名。内容相同的文件不会重复写入。
+    (修改) 文件已存在时更新其修改时间 (缩略图也一样)，使之重新进入回收宽限期:
+    此前已成为孤儿的旧文件不会在本次上传提交之前被并发的回收删除。
+    """
+    filename = content_filename(data, ext)
+    path = os.path.join(upload_folder, filename)
+    if not _touch(path):
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    for variant in IMAGE_VARIANTS:
+        folder, name = ensure_variant(upload_folder, filename, variant)
+        if name != filename and not _touch(os.path.join(folder, name)):
+            # 刚好被回收，重新生成
+            ensure_variant(upload_folder, filename, variant)
+    return filename
+
+
+def ensure_variant(upload_folder, filename, variant):
+    """
+    返回指定尺寸图片的 (目录, 文件名)，不存在时按需生成。
+    Pillow 不可用或原图无法解码时返回原图。
+    """
+    if variant not in IMAGE_VARIANTS or Image is None:
+        return upload_folder, filename
+
+    variant_folder = os.path.join(upload_folder, VARIANT_DIR_NAME)
+    name = variant_filename(filename, variant)
+    path = os.path.join(variant_folder, name)
+    if os.path.exists(path):
+        return variant_folder, name
+
+    source = os.path.join(upload_folder, filename)
+    try:
+        with Image.open(source) as img:
+            img = ImageOps.exif_transpose(img)
+            img.thumbnail((IMAGE_VARIANTS[variant], IMAGE_VARIANTS[variant]))
+            if img.mode not in ('RGB', 'L'):
+                img = img.convert('RGB')
+            os.makedirs(variant_folder, exist_ok=True)
+            # 先写临时文件再原子替换，并发请求同一张缩略图时不会读到半个文件
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            img.save(tmp_path, 'JPEG', quality=VARIANT_JPEG_QUALITY, optimize=True)
+            os.replace(tmp_path, path)
+    except (OSError, ValueError):
+        return upload_folder, filename
+    return variant_folder, name
+
+
+def collect_orphan_images(upload_folder, referenced, grace_seconds=ORPHAN_GRACE_SECONDS):
+    """
+    删除不再被任何车辆引用的原图及其缩略图。
+    referenced 为 vehicles.image_url 中仍在使用的文件名集合，返回被删除的文件名列表。
+    """
+    now = time.time()
+    referenced_variants = {
+        variant_filename(filename, variant) for filename in referenced for variant in IMAGE_VARIANTS
+    }
+    removed = []
+    variant_folder = os.path.join(upload_folder, VARIANT_DIR_NAME)
+    for folder, keep in ((upload_folder, referenced), (variant_folder, referenced_variants)):
+        if not os.path.isdir(folder):
+            continue
+        for entry in os.scandir(folder):
+            if not entry.is_file() or entry.name in keep:
+                continue
+            if now - entry.stat().st_mtime < grace_seconds:
+                continue
+            try:
+                os.remove(entry.path)
+                removed.append(entry.name)
+            except OSError:
+                pass
+    return removed
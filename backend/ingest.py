@@ -0,0 +1,368 @@
+"""
+导入数据的解析和校验，供 be/import_data.py 和上传接口 (/api/upload/<table>) 共用。
+
+所有步骤都按列向量化完成 (pandas 的字符串方法和 isin / map)，不逐行调用 Python 函数:
+- 车牌号: 全角转半角、去掉空白和分隔符 ('·'、'-')、字母转大写
+- 日期: 支持 '2020年3月5日'、'2020-03-05'、'2020/3/5'、'2020.3.5'，可带 '10:30[:00]' 或 '10时30分'，
+  统一为 'YYYY-MM-DD' (datetime 列带时间时为 'YYYY-MM-DD HH:MM:SS')
+- 数值: 去掉千分位、货币符号和 '元' 后转换；整数列不接受小数
+- 外键: 车牌号、部门 / 违章类型 / 维保单位 ID 与内存中的已知集合比对
+- (新增) 字典表既可以给 ID 也可以给名称 (名称列，或 ID 列中不是整数的值)，
+  名称通过 resolve 回调 (DictionaryCache.get_or_create) 批量解析，不存在的名称会被创建
+
+有问题的行不写入数据库，原因记录在 IngestReport 中 (行号与源文件一致，表头为第 1 行)。
+"""
+import re
+
+import pandas as pd
+
+from plates import FULL_WIDTH, PLATE_NOISE, plate_map
+
+# 表 -> {列: 类型}；未列出的列原样保留
+COLUMN_TYPES = {
+    'vehicles': {
+        'vehicle_id': 'int',
+        'plate_number': 'plate',
+        'department_id': 'int',
+        'manager': 'text',
+        'brand_model': 'text',
+        'displacement': 'real',
+        'capacity': 'int',
+        'registration_date': 'date',
+        'purchase_price': 'real',
+        'notes': 'text',
+    },
+    'violations': {
+        'violation_id': 'int',
+        'plate_number': 'plate',
+        'violation_time': 'datetime',
+        'violation_location': 'text',
+        'violation_type_id': 'int',
+    },
+    'maintenance': {
+        'plate_number': 'plate',
+        'order_number': 'text',
+        'provider_id': 'int',
+        'request_time': 'datetime',
+        'delivery_time': 'datetime',
+        'current_mileage': 'int',
+        'last_maintenance_mileage': 'int',
+        'service_details': 'text',
+        'maintenance_cost': 'real',
+    },
+    'monthly_fuel_summary': {
+        'plate_number': 'plate',
+        'year': 'int',
+        'month': 'int',
+        'total_fuel_cost': 'real',
+        'total_fuel_amount': 'real',
+        'start_month_mileage': 'int',
+        'end_month_mileage': 'int',
+        'distance_driven': 'int',
+        'avg_consumption_per_100km': 'real',
+        'card_number': 'text',
+        'notes': 'text',
+    },
+}
+# 不能为空的列
+REQUIRED_COLUMNS = {
+    'vehicles': ('plate_number',),
+    'violations': ('plate_number',),
+    'maintenance': ('plate_number',),
+    'monthly_fuel_summary': ('plate_number', 'year', 'month'),
+}
+# (表, 列) -> 取值范围 (含两端)
+VALUE_RANGES = {
+    ('monthly_fuel_summary', 'year'): (1900, 9999),
+    ('monthly_fuel_summary', 'month'): (1, 12),
+}
+# 外键列 -> 字典表 (见 dict_cache.py)
+FOREIGN_KEYS = {
+    'department_id': 'departments',
+    'violation_type_id': 'violation_types',
+    'provider_id': 'service_providers',
+}
+# 外键列 -> 可以代替它的名称列
+DIMENSION_NAME_COLUMNS = {
+    'department_id': 'department_name',
+    'violation_type_id': 'violation_type',
+    'provider_id': 'provider_name',
+}
+# 通过车牌号关联 vehicles 的事实表
+FACT_TABLES = ('violations', 'maintenance', 'monthly_fuel_summary')
+MAX_REPORTED_ERRORS = 1000
+
+# (修改) 全角转半角和车牌号的分隔符定义在 plates.py，与增删改接口共用
+_FULL_WIDTH = FULL_WIDTH
+_PLATE_NOISE = PLATE_NOISE
+_NUMBER_NOISE = r'[\s,，¥￥元]'
+# (修改) 整个值都必须是日期 (可带时间)，末尾多出其他内容时视为无法识别
+_DATE_PATTERN = re.compile(
+    r'^\s*(?P<year>\d{4})\s*[年/.\-]\s*(?P<month>\d{1,2})\s*[月/.\-]\s*(?P<day>\d{1,2})\s*日?'
+    r'(?:[\sT]*(?P<hour>\d{1,2})\s*[:时]\s*(?P<minute>\d{1,2})\s*(?:[:分]\s*(?P<second>\d{1,2}))?)?'
+    r'\s*[分秒]?\s*$'
+)
+
+
+class IngestReport:
+    """一次导入的校验结果: 被拒绝的行及原因，以及不影响导入的警告。"""
+
+    def __init__(self, table, index):
+        self.table = table
+        self.total_rows = len(index)
+        self.rejected = pd.Series(False, index=index)
+        self.errors = []
+        self.warnings = []
+        self.error_counts = {}
+
+    def _record(self, entries, mask, column, values, message):
+        mask = mask.fillna(False).astype(bool)
+        count = int(mask.sum())
+        if not count:
+            return
+        key = f"{column}: {message}"
+        self.error_counts[key] = self.error_counts.get(key, 0) + count
+        room = MAX_REPORTED_ERRORS - len(entries)
+        for index in mask[mask].index[:max(room, 0)]:
+            value = values.get(index) if values is not None else None
+            entries.append({
+                'row': int(index) + 2,
+                'column': column,
+                'value': None if pd.isna(value) else str(value),
+                'error': message,
+            })
+
+    def reject(self, mask, column, values, message):
+        """mask 为 True 的行被拒绝。"""
+        self.rejected |= mask.fillna(False).astype(bool)
+        self._record(self.errors, mask, column, values, message)
+
+    def warn(self, mask, column, values, message):
+        """mask 为 True 的行仍会导入，只在报告中提示。"""
+        self._record(self.warnings, mask, column, values, f"{message} (已导入)")
+
+    @property
+    def rejected_rows(self):
+        return int(self.rejected.sum())
+
+    def to_dict(self):
+        return {
+            'table': self.table,
+            'total_rows': self.total_rows,
+            'accepted_rows': self.total_rows - self.rejected_rows,
+            'rejected_rows': self.rejected_rows,
+            'error_counts': self.error_counts,
+            'errors': self.errors,
+            'warnings': self.warnings,
+            'truncated': len(self.errors) >= MAX_REPORTED_ERRORS or len(self.warnings) >= MAX_REPORTED_ERRORS,
+        }
+
+    def summary_lines(self, limit=10):
+        """命令行输出用的简要说明。"""
+        lines = [f"{self.table}: {self.total_rows - self.rejected_rows} accepted, {self.rejected_rows} rejected"]
+        lines.extend(f"   {key}: {count} row(s)" for key, count in sorted(self.error_counts.items()))
+        lines.extend(f"   row {e['row']} {e['column']}={e['value']!r}: {e['error']}" for e in self.errors[:limit])
+        return lines
+
+
+def _on_distinct(series, func):
+    """
+    只对去重后的取值调用 func (返回与输入等长的 Series 或其元组)，再按编码展开到每一行。
+    导入数据中车牌号、类型、日期等重复很多，去重后字符串处理的量通常小一到两个数量级。
+    """
+    codes, uniques = pd.factorize(series, use_na_sentinel=False)
+    results = func(pd.Series(uniques, dtype=object))
+    expand = lambda result: result.take(codes).set_axis(series.index)
+    return tuple(map(expand, results)) if isinstance(results, tuple) else expand(results)
+
+
+def _blank(series):
+    """空值或只有空白的字符串。"""
+    return series.isna() | series.astype('string').str.strip().eq('').fillna(True)
+
+
+def _normalize_plates(values):
+    plates = values.astype('string').str.translate(_FULL_WIDTH).str.replace(_PLATE_NOISE, '', regex=True).str.upper()
+    return plates.mask(plates.eq('').fillna(False))
+
+
+def normalize_plates(series):
+    """批量规范化车牌号，空值为 <NA>。"""
+    return _on_distinct(series, _normalize_plates)
+
+
+def _parse_dates(values, with_time):
+    text = values.astype('string').str.strip()
+    # 先按规范格式整列转换 (最常见，也最快)，剩下的再用正则识别中文和其他分隔符
+    moments = pd.to_datetime(text, format='%Y-%m-%d %H:%M:%S', errors='coerce')
+    timed = moments.notna()
+    rest = moments.isna()
+    moments[rest] = pd.to_datetime(text[rest], format='%Y-%m-%d', errors='coerce')
+    rest &= moments.isna()
+    if rest.any():
+        parts = text[rest].str.translate(_FULL_WIDTH).str.extract(_DATE_PATTERN)
+        # 拼成固定格式后统一转换，不存在的日期 (如 2 月 30 日) 和时间得到 NaT
+        iso = (parts['year'] + '-' + parts['month'].str.zfill(2) + '-' + parts['day'].str.zfill(2) + ' '
+               + parts['hour'].fillna('0').str.zfill(2) + ':' + parts['minute'].fillna('0').str.zfill(2) + ':'
+               + parts['second'].fillna('0').str.zfill(2))
+        moments[rest] = pd.to_datetime(iso, format='%Y-%m-%d %H:%M:%S', errors='coerce')
+        timed[rest] = parts['hour'].notna() & moments[rest].notna()
+    result = moments.dt.strftime('%Y-%m-%d')
+    if with_time:
+        result = result.mask(timed, moments.dt.strftime('%Y-%m-%d %H:%M:%S'))
+    invalid = moments.isna() & ~_blank(values)
+    return result.astype(object).where(moments.notna(), None), invalid
+
+
+def parse_dates(series, with_time=False):
+    """
+    批量解析日期，返回 (结果, 无法解析的行)。
+    结果为 'YYYY-MM-DD'；with_time 且原值带时间时为 'YYYY-MM-DD HH:MM:SS'。
+    """
+    if pd.api.types.is_datetime64_any_dtype(series):
+        fmt = '%Y-%m-%d %H:%M:%S' if with_time else '%Y-%m-%d'
+        return series.dt.strftime(fmt).astype(object).where(series.notna(), None), pd.Series(False, index=series.index)
+    return _on_distinct(series, lambda values: _parse_dates(values, with_time))
+
+
+def _coerce_numbers(values):
+    cleaned = values.astype('string').str.translate(_FULL_WIDTH).str.replace(_NUMBER_NOISE, '', regex=True)
+    numbers = pd.to_numeric(cleaned.mask(cleaned.eq('').fillna(False)), errors='coerce').astype('float64')
+    return numbers, numbers.isna() & ~_blank(values)
+
+
+def coerce_numbers(series, integer=False):
+    """批量转换为数值，返回 (结果, 无法转换的行)；空值为 NaN (整数列为 <NA>)。"""
+    if pd.api.types.is_numeric_dtype(series):
+        numbers = pd.to_numeric(series, errors='coerce').astype('float64')
+        invalid = pd.Series(False, index=series.index)
+    else:
+        numbers, invalid = _on_distinct(series, _coerce_numbers)
+    if integer:
+        fractional = numbers.notna() & (numbers % 1 != 0)
+        invalid |= fractional
+        numbers = numbers.mask(fractional).round().astype('Int64')
+    return numbers, invalid
+
+
+def _clean_text(values):
+    text = values.astype('string').str.strip()
+    return text.mask(text.eq('').fillna(False)).astype(object).where(text.notna(), None)
+
+
+def clean_text(series):
+    """去掉首尾空白，空字符串视为空值。"""
+    return _on_distinct(series, _clean_text)
+
+
+def known_ids(dictionaries):
+    """字典表缓存 ({'departments': {id: 名称}, ...}) -> {外键列: 已知 ID 集合}。"""
+    return {column: set(dictionaries.get(table, {})) for column, table in FOREIGN_KEYS.items()}
+
+
+def load_known_keys(conn):
+    """
+    直接从数据库读取 (车牌号 -> vehicle_id, {外键列: 已知 ID 集合})，供没有字典缓存的导入脚本使用。
+    (修改) 车牌号为规范化之后的值 (见 plates.plate_map)。
+    """
+    plates = plate_map(conn)
+    ids = {
+        'department_id': {row[0] for row in conn.execute('SELECT department_id FROM departments')},
+        'violation_type_id': {row[0] for row in conn.execute('SELECT violation_type_id FROM violation_types')},
+        'provider_id': {row[0] for row in conn.execute('SELECT provider_id FROM service_providers')},
+    }
+    return plates, ids
+
+
+def _split_dimension_names(df, id_column, name_column):
+    """
+    取出按名称给出的字典值: 名称列，以及 ID 列中不是整数的值 (两者都有时以 ID 为准)。
+    返回每行的名称 (没有时为 None)；ID 列中只保留整数部分，名称列从 df 中移除。
+    """
+    names = clean_text(df.pop(name_column)) if name_column in df.columns else pd.Series(None, index=df.index, dtype=object)
+    if id_column in df.columns:
+        raw_ids = df[id_column]
+        numbers, _ = coerce_numbers(raw_ids)
+        textual = numbers.isna() & ~_blank(raw_ids)
+        names = names.where(numbers.isna(), None).where(~textual, clean_text(raw_ids))
+        df[id_column] = raw_ids.where(~textual)
+    return names
+
+
+def _resolve_dimension_names(df, report, dimension_names, resolve):
+    """把通过校验的行中按名称给出的字典值批量解析为 ID (不存在的名称由 resolve 创建)。"""
+    for id_column, names in dimension_names.items():
+        wanted = names.notna() & ~report.rejected
+        if not wanted.any():
+            continue
+        mapping = resolve(FOREIGN_KEYS[id_column], names[wanted].unique())
+        resolved = names[wanted].map(mapping).astype('Int64')
+        if id_column in df.columns:
+            df[id_column] = df[id_column].astype('Int64')
+            df.loc[wanted, id_column] = resolved
+        else:
+            df[id_column] = resolved.reindex(df.index).astype('Int64')
+
+
+def validate_frame(df, table, plate_map, ids, unknown_plates='reject', resolve=None):
+    """
+    校验并规范化一张表的数据，返回 (可导入的 DataFrame, IngestReport)。
+    plate_map: {车牌号: vehicle_id}；ids: {外键列: 已知 ID 集合} (见 known_ids)。
+    事实表会补上 vehicle_id 列。unknown_plates 为 'reject' 时车牌号不在 vehicles 中的
+    事实记录被拒绝，为 'warn' 时照常导入 (vehicle_id 为空) 并在报告中提示。
+    (新增) resolve(字典表, 名称列表) -> {名称: ID}: 给出时字典表可以按名称填写，
+    只有通过校验的行才会解析 (并创建) 名称，没有 resolve 时只接受 ID。
+    """
+    df = df.copy()
+    raw = {column: df[column] for column in df.columns}
+    dimension_names = {}
+    if resolve is not None:
+        for id_column, name_column in DIMENSION_NAME_COLUMNS.items():
+            if id_column in COLUMN_TYPES[table] and (id_column in df.columns or name_column in df.columns):
+                dimension_names[id_column] = _split_dimension_names(df, id_column, name_column)
+    report = IngestReport(table, df.index)
+
+    for column, kind in COLUMN_TYPES[table].items():
+        if column not in df.columns:
+            continue
+        if kind == 'plate':
+            df[column] = normalize_plates(df[column])
+        elif kind in ('date', 'datetime'):
+            df[column], invalid = parse_dates(df[column], with_time=kind == 'datetime')
+            report.reject(invalid, column, raw[column], '无法识别的日期')
+        elif kind in ('int', 'real'):
+            df[column], invalid = coerce_numbers(df[column], integer=kind == 'int')
+            report.reject(invalid, column, raw[column], '整数格式不正确' if kind == 'int' else '数值格式不正确')
+        else:
+            df[column] = clean_text(df[column])
+
+    for column in REQUIRED_COLUMNS.get(table, ()):
+        missing = df[column].isna() if column in df.columns else pd.Series(True, index=df.index)
+        report.reject(missing & ~report.rejected, column, raw.get(column), '不能为空')
+
+    for (range_table, column), (low, high) in VALUE_RANGES.items():
+        if range_table == table and column in df.columns:
+            values = df[column]
+            report.reject(values.notna() & ((values < low) | (values > high)), column, raw[column],
+                          f'取值必须在 {low} 到 {high} 之间')
+
+    for column, known in ids.items():
+        if column in df.columns:
+            values = df[column]
+            report.reject(values.notna() & ~values.isin(known), column, raw[column], '引用的 ID 不存在')
+
+    plates = df['plate_number'] if 'plate_number' in df.columns else None
+    if table == 'vehicles' and plates is not None:
+        report.reject(plates.notna() & plates.isin(plate_map.keys()), 'plate_number', raw['plate_number'], '车牌号已存在')
+        report.reject(plates.notna() & plates.duplicated(keep='first'), 'plate_number', raw['plate_number'],
+                      '车牌号在文件中重复')
+    elif table in FACT_TABLES and plates is not None:
+        df['vehicle_id'] = plates.map(plate_map).astype('Int64')
+        unknown = plates.notna() & df['vehicle_id'].isna()
+        if unknown_plates == 'reject':
+            report.reject(unknown, 'plate_number', raw['plate_number'], '车牌号不存在')
+        else:
+            report.warn(unknown, 'plate_number', raw['plate_number'], '车牌号不存在')
+
+    _resolve_dimension_names(df, report, dimension_names, resolve)
+    return df[~report.rejected], report
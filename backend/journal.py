@@ -0,0 +1,128 @@
+"""
+变更日志 (change_journal) 的读取辅助函数。
+
+日志由触发器写入 (见 migrations.py 中的 add_change_journal)，
+下游 (缓存、汇总索引、外部 BI 同步) 记住自己处理到的 seq，
+之后每次只读取 seq 更大的记录即可得到增量。
+
+保留策略: 早于 FLEET_JOURNAL_RETENTION_DAYS 天 (默认 30) 的记录由后台维护清理 (见 maintenance.py)。
+持久的下游用 ack_consumer() 登记处理到的 seq，清理时保留它们尚未处理的记录；
+超过 FLEET_JOURNAL_CONSUMER_TIMEOUT_DAYS 天 (默认 90) 没有更新的下游不再阻止清理。
+最新的一条始终保留，MAX(seq) (数据版本号) 不会因为清理而变小。
+下游发现 has_gap() 为真 (需要的记录已被清理) 时改为全量重建。
+"""
+import os
+import sqlite3
+
+JOURNAL_COLUMNS = (
+    'seq', 'table_name', 'op', 'pk',
+    'old_vehicle_id', 'old_period', 'new_vehicle_id', 'new_period', 'changed_at',
+)
+DEFAULT_BATCH_SIZE = 1000
+MAX_BATCH_SIZE = 10000
+RETENTION_DAYS = int(os.environ.get('FLEET_JOURNAL_RETENTION_DAYS', 30))
+CONSUMER_TIMEOUT_DAYS = int(os.environ.get('FLEET_JOURNAL_CONSUMER_TIMEOUT_DAYS', 90))
+PRUNE_BATCH_SIZE = 10000
+
+
+def latest_seq(conn):
+    """当前最大的 seq；日志为空或尚未建立时返回 0。可作为数据版本号使用。"""
+    try:
+        row = conn.execute('SELECT MAX(seq) FROM change_journal').fetchone()
+    except sqlite3.OperationalError:
+        return 0
+    return row[0] or 0
+
+
+def batch_size(limit):
+    """每批条数限制在 1 ~ MAX_BATCH_SIZE 之间。"""
+    return max(1, min(int(limit), MAX_BATCH_SIZE))
+
+
+def read_changes(conn, since, limit=DEFAULT_BATCH_SIZE, tables=None):
+    """读取 seq > since 的一批变更，按 seq 升序返回字典列表。"""
+    limit = batch_size(limit)
+    params = [since]
+    table_filter = ''
+    if tables:
+        table_filter = f"AND table_name IN ({','.join('?' for _ in tables)})"
+        params.extend(tables)
+    params.append(limit)
+    rows = conn.execute(f"""
+        SELECT {', '.join(JOURNAL_COLUMNS)}
+        FROM change_journal
+        WHERE seq > ? {table_filter}
+        ORDER BY seq
+        LIMIT ?
+    """, params).fetchall()
+    return [dict(zip(JOURNAL_COLUMNS, row)) for row in rows]
+
+
+def iter_changes(conn, since, batch_size=DEFAULT_BATCH_SIZE, tables=None):
+    """按批次遍历 seq > since 的所有变更，每次产出一批 (列表)。"""
+    while True:
+        batch = read_changes(conn, since, batch_size, tables)
+        if not batch:
+            return
+        yield batch
+        since = batch[-1]['seq']
+
+
+def oldest_seq(conn):
+    """日志中最小的 seq；日志为空或尚未建立时返回 0。"""
+    try:
+        row = conn.execute('SELECT MIN(seq) FROM change_journal').fetchone()
+    except sqlite3.OperationalError:
+        return 0
+    return row[0] or 0
+
+
+def has_gap(conn, since):
+    """seq > since 的记录是否有一部分已被清理 (无法从 since 增量同步)。"""
+    return oldest_seq(conn) > since + 1
+
+
+def ack_consumer(conn, name, seq):
+    """登记持久下游 name 已处理到 seq (不提交事务)。"""
+    conn.execute("""
+        INSERT INTO journal_consumers (name, seq) VALUES (?, ?)
+        ON CONFLICT (name) DO UPDATE SET seq = excluded.seq, updated_at = excluded.updated_at
+    """, (name, seq))
+
+
+def prunable_seq(conn, retention_days=RETENTION_DAYS, consumer_timeout_days=CONSUMER_TIMEOUT_DAYS):
+    """可以清理到的 seq (含)：早于保留期、活跃的下游都已处理，并保留最新的一条。没有可清理的记录时返回 0。"""
+    latest = latest_seq(conn)
+    if not latest:
+        return 0
+    # seq 与 changed_at 同序，从头扫描到第一条保留期内的记录为止
+    row = conn.execute("""
+        SELECT seq FROM change_journal
+        WHERE changed_at >= strftime('%Y-%m-%d %H:%M:%f', 'now', ?)
+        ORDER BY seq LIMIT 1
+    """, (f'-{int(retention_days)} days',)).fetchone()
+    limit = (row[0] if row else latest) - 1
+    try:
+        consumer = conn.execute("""
+            SELECT MIN(seq) FROM journal_consumers WHERE updated_at >= datetime('now', ?)
+        """, (f'-{int(consumer_timeout_days)} days',)).fetchone()[0]
+    except sqlite3.OperationalError:
+        consumer = None
+    if consumer is not None:
+        limit = min(limit, consumer)
+    return max(limit, 0)
+
+
+def prune_changes(conn, before_seq, batch_size=PRUNE_BATCH_SIZE):
+    """
+    删除 seq <= before_seq 的日志 (所有下游都已处理过的部分)，返回删除的行数。
+    每批 batch_size 行一个事务，不长时间占用写锁。
+    """
+    deleted = 0
+    start = oldest_seq(conn)
+    while start and start <= before_seq:
+        end = min(before_seq, start + batch_size - 1)
+        deleted += conn.execute('DELETE FROM change_journal WHERE seq <= ?', (end,)).rowcount
+        conn.commit()
+        start = end + 1
+    return deleted
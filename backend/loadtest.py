@@ -0,0 +1,377 @@
+"""
+本地并发读写压测工具: 衡量 SQLite 单写者模型下读写混合负载的锁竞争。
+
+同时运行三类并发任务，直到 --duration 秒结束:
+- 读者 (--readers): 轮流请求概览、部门、车辆总览、部门详情和车辆详情等汇总接口
+- 写者 (--writers): 逐条 POST /api/data/violations 新增违章记录
+- 上传者 (--uploaders): 反复上传一个包含 --upload-rows 行违章记录的 Excel 文件
+
+请求因 "database is locked" 失败 (SQLITE_BUSY) 时按指数退避重试至多 --retries 次。
+结束后按操作类型报告吞吐量、延迟百分位 (含重试耗时)、BUSY 次数和重试率。
+
+用法 (在 backend 目录下):
+    python loadtest.py --readers 8 --writers 2 --uploaders 1 --duration 30
+    python loadtest.py --journal-mode WAL --busy-timeout 200    # 对比日志模式和等待时间
+    python loadtest.py --url http://127.0.0.1:5000 --readers 32  # 压测已启动的 serve.py
+
+默认在进程内通过 Flask test_client 调用 app，并使用数据库的临时副本，不修改原数据库；
+--journal-mode、--busy-timeout 通过 FLEET_JOURNAL_MODE、FLEET_BUSY_TIMEOUT 传给 app.py。
+使用 --url 时请求发往已运行的服务 (可对比不同的 worker/线程数)，连接参数需在启动服务时设置，
+--db 只用于读取车牌号等测试数据。
+--bypass-cache 给读请求加上唯一参数，使其绕过响应缓存，直接衡量数据库上的查询。
+"""
+import argparse
+import io
+import itertools
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_DB = os.path.join(SCRIPT_DIR, 'data', 'vehicle_data_optimized.db')
+BUSY_MARKERS = (b'database is locked', b'database is busy', b'database table is locked')
+RETRY_BACKOFF = 0.05
+MAX_BACKOFF = 1.0
+PERCENTILES = (50, 90, 99)
+# 上传文件的中文表头，与 app.COLUMN_MAPPING['violations'] 一致 (--url 模式下不导入 app)
+UPLOAD_HEADERS = {
+    'plate_number': '车牌号',
+    'violation_time': '违章时间',
+    'violation_location': '违章地点',
+    'violation_type_id': '违章类型ID',
+}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='宣城车e管后端并发读写压测')
+    parser.add_argument('--db', default=DEFAULT_DB, help='数据库文件，默认 data/vehicle_data_optimized.db')
+    parser.add_argument('--url', help='压测已运行的服务 (例如 http://127.0.0.1:5000)，不指定时在进程内调用 app')
+    parser.add_argument('--in-place', action='store_true', help='进程内模式下直接写入 --db，而不是临时副本')
+    parser.add_argument('--readers', type=int, default=8, help='并发读者数，默认 8')
+    parser.add_argument('--writers', type=int, default=2, help='并发写者数，默认 2')
+    parser.add_argument('--uploaders', type=int, default=0, help='并发上传者数，默认 0')
+    parser.add_argument('--upload-rows', type=int, default=500, help='每次上传的行数，默认 500')
+    parser.add_argument('--write-interval', type=float, default=0.1,
+                        help='每个写者/上传者两次请求之间的间隔秒数，默认 0.1')
+    parser.add_argument('--duration', type=float, default=20, help='压测时长 (秒)，默认 20')
+    parser.add_argument('--retries', type=int, default=3, help='遇到 SQLITE_BUSY 时的最大重试次数，默认 3')
+    parser.add_argument('--journal-mode', help='进程内模式的 journal_mode，例如 WAL、DELETE')
+    parser.add_argument('--busy-timeout', type=int, help='进程内模式的 busy_timeout 毫秒数 (app 默认 5000)')
+    parser.add_argument('--bypass-cache', action='store_true', help='读请求绕过响应缓存')
+    parser.add_argument('--seed', type=int, help='随机数种子')
+    parser.add_argument('--json', help='同时把结果写入该 JSON 文件')
+    return parser.parse_args(argv)
+
+
+# --- 测试数据 ---
+
+def load_fixtures(db_path):
+    """从数据库读取压测用的车牌号、部门、月份和违章类型。"""
+    conn = sqlite3.connect(f'file:{db_path}?mode=ro', uri=True)
+    try:
+        vehicles = conn.execute('SELECT plate_number, vehicle_id FROM vehicles ORDER BY vehicle_id LIMIT 500').fetchall()
+        departments = [row[0] for row in conn.execute('SELECT department_id FROM departments ORDER BY department_id')]
+        violation_types = [row[0] for row in conn.execute('SELECT violation_type_id FROM violation_types')]
+        months = [row[0] for row in conn.execute("""
+            SELECT DISTINCT printf('%04d-%02d', year, month) FROM monthly_fuel_summary ORDER BY 1
+        """)]
+    finally:
+        conn.close()
+    if not vehicles:
+        sys.exit(f"数据库中没有车辆数据: {db_path}")
+    return {'vehicles': vehicles, 'departments': departments,
+            'violation_types': violation_types or [None], 'months': months}
+
+
+def read_urls(fixtures):
+    """读者轮流请求的 URL: 预热覆盖的汇总接口 (见 warmup.py) 加上部分车辆详情。"""
+    from warmup import request_shapes
+    urls = request_shapes(fixtures['months'], fixtures['departments'])
+    urls += [f"/api/vehicle/detail/{plate}" for plate, _ in fixtures['vehicles'][:50]]
+    return urls
+
+
+def violation_record(fixtures, rng):
+    plate, vehicle_id = rng.choice(fixtures['vehicles'])
+    return {
+        'plate_number': plate,
+        'vehicle_id': vehicle_id,
+        'violation_time': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'violation_location': f"压测地点{rng.randint(1, 50)}",
+        'violation_type_id': rng.choice(fixtures['violation_types']),
+    }
+
+
+def upload_workbook(fixtures, rows, rng):
+    """生成上传用的违章记录 Excel (中文表头，与下载的模板一致)。"""
+    import pandas as pd
+
+    records = [violation_record(fixtures, rng) for _ in range(rows)]
+    df = pd.DataFrame([{UPLOAD_HEADERS[k]: v for k, v in r.items() if k in UPLOAD_HEADERS} for r in records])
+    buffer = io.BytesIO()
+    df.to_excel(buffer, index=False, engine='openpyxl')
+    return buffer.getvalue()
+
+
+# --- 请求方式 ---
+
+class InProcessClient:
+    """通过 Flask test_client 在进程内调用 app。"""
+
+    def __init__(self, module):
+        self._module = module
+        self._app = module.app
+
+    def get(self, url):
+        with self._app.test_client() as client:
+            response = client.get(url)
+            return response.status_code, response.get_data()
+
+    def post_json(self, url, payload):
+        with self._app.test_client() as client:
+            response = client.post(url, json=payload)
+            return response.status_code, response.get_data()
+
+    def upload(self, url, filename, content):
+        with self._app.test_client() as client:
+            response = client.post(url, data={'file': (io.BytesIO(content), filename)},
+                                   content_type='multipart/form-data')
+            return response.status_code, response.get_data()
+
+    def close(self):
+        # 等待后台预热结束，之后才能删除临时数据库
+        self._module.WARMER.shutdown()
+
+
+class HttpClient:
+    """向已运行的服务发送 HTTP 请求。"""
+
+    def __init__(self, base_url):
+        self._base_url = base_url.rstrip('/')
+
+    def _send(self, request):
+        try:
+            with urllib.request.urlopen(request, timeout=300) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+    def get(self, url):
+        return self._send(urllib.request.Request(self._base_url + url))
+
+    def post_json(self, url, payload):
+        return self._send(urllib.request.Request(
+            self._base_url + url, data=json.dumps(payload).encode('utf-8'),
+            headers={'Content-Type': 'application/json'}, method='POST'))
+
+    def upload(self, url, filename, content):
+        boundary = uuid.uuid4().hex
+        body = (f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+                f'Content-Type: application/octet-stream\r\n\r\n').encode('utf-8') + content + \
+            f'\r\n--{boundary}--\r\n'.encode('utf-8')
+        return self._send(urllib.request.Request(
+            self._base_url + url, data=body,
+            headers={'Content-Type': f'multipart/form-data; boundary={boundary}'}, method='POST'))
+
+    def close(self):
+        pass
+
+
+# --- 统计 ---
+
+class OperationStats:
+    """一类操作的统计，线程安全。"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = []
+        self.errors = 0
+        self.busy = 0
+        self.retried = 0
+        self.gave_up = 0
+
+    def record(self, seconds, ok, busy_responses, gave_up):
+        with self._lock:
+            self.latencies.append(seconds)
+            if not ok:
+                self.errors += 1
+            self.busy += busy_responses
+            if busy_responses:
+                self.retried += 1
+            if gave_up:
+                self.gave_up += 1
+
+    def summary(self, elapsed):
+        with self._lock:
+            latencies = sorted(self.latencies)
+            requests = len(latencies)
+            result = {
+                'requests': requests,
+                'ok': requests - self.errors,
+                'errors': self.errors,
+                'throughput': round(requests / elapsed, 2) if elapsed else 0,
+                'busy': self.busy,
+                'retry_rate': round(self.retried / requests, 4) if requests else 0,
+                'gave_up': self.gave_up,
+            }
+        for p in PERCENTILES:
+            result[f'p{p}_ms'] = round(percentile(latencies, p) * 1000, 1)
+        result['max_ms'] = round(latencies[-1] * 1000, 1) if latencies else 0
+        return result
+
+
+def percentile(values, p):
+    """已排序列表的最近秩百分位。"""
+    if not values:
+        return 0.0
+    rank = max(1, -(-len(values) * p // 100))
+    return values[int(rank) - 1]
+
+
+def is_busy(status, body):
+    return status >= 500 and any(marker in body for marker in BUSY_MARKERS)
+
+
+def run_with_retries(send, stats, retries):
+    """发送请求，遇到 SQLITE_BUSY 时退避重试；延迟包含所有重试的耗时。"""
+    started = time.perf_counter()
+    busy_responses = 0
+    while True:
+        status, body = send()
+        if not is_busy(status, body):
+            break
+        busy_responses += 1
+        if busy_responses > retries:
+            break
+        time.sleep(min(RETRY_BACKOFF * 2 ** (busy_responses - 1), MAX_BACKOFF))
+    ok = 200 <= status < 300
+    stats.record(time.perf_counter() - started, ok, busy_responses, gave_up=busy_responses > retries)
+    return status
+
+
+# --- 任务 ---
+
+def reader(client, urls, stats, deadline, args, rng):
+    counter = itertools.count()
+    while time.perf_counter() < deadline:
+        url = rng.choice(urls)
+        if args.bypass_cache:
+            url += ('&' if '?' in url else '?') + f"_loadtest={threading.get_ident()}-{next(counter)}"
+        run_with_retries(lambda: client.get(url), stats, args.retries)
+
+
+def writer(client, fixtures, stats, deadline, args, rng):
+    while time.perf_counter() < deadline:
+        record = violation_record(fixtures, rng)
+        run_with_retries(lambda: client.post_json('/api/data/violations', record), stats, args.retries)
+        time.sleep(args.write_interval)
+
+
+def uploader(client, workbook, stats, deadline, args):
+    while time.perf_counter() < deadline:
+        run_with_retries(lambda: client.upload('/api/upload/violations', 'loadtest.xlsx', workbook),
+                         stats, args.retries)
+        time.sleep(args.write_interval)
+
+
+def copy_database(source, target):
+    """用 SQLite 备份 API 复制数据库 (包含尚未检查点的 WAL 内容)。"""
+    src = sqlite3.connect(f'file:{source}?mode=ro', uri=True)
+    dst = sqlite3.connect(target)
+    try:
+        src.backup(dst)
+    finally:
+        src.close()
+        dst.close()
+
+
+def make_client(args, workdir):
+    if args.url:
+        return HttpClient(args.url), args.url
+    db_path = args.db
+    if not args.in_place:
+        db_path = os.path.join(workdir, 'loadtest.db')
+        copy_database(args.db, db_path)
+    # app.py 在导入时读取这些环境变量
+    os.environ['FLEET_DB_FILE'] = db_path
+    if args.journal_mode:
+        os.environ['FLEET_JOURNAL_MODE'] = args.journal_mode
+    if args.busy_timeout is not None:
+        os.environ['FLEET_BUSY_TIMEOUT'] = str(args.busy_timeout)
+    import app
+    app.preload_shared_state()
+    return InProcessClient(app), db_path
+
+
+def run(args):
+    sys.path.insert(0, SCRIPT_DIR)
+    rng = random.Random(args.seed)
+    fixtures = load_fixtures(args.db)
+    with tempfile.TemporaryDirectory(prefix='fleet-loadtest-') as workdir:
+        client, target = make_client(args, workdir)
+        urls = read_urls(fixtures)
+        workbook = upload_workbook(fixtures, args.upload_rows, rng) if args.uploaders else None
+
+        stats = {'read': OperationStats(), 'write': OperationStats(), 'upload': OperationStats()}
+        deadline = time.perf_counter() + args.duration
+        threads = []
+        for _ in range(args.readers):
+            threads.append(threading.Thread(target=reader, args=(
+                client, urls, stats['read'], deadline, args, random.Random(rng.random()))))
+        for _ in range(args.writers):
+            threads.append(threading.Thread(target=writer, args=(
+                client, fixtures, stats['write'], deadline, args, random.Random(rng.random()))))
+        for _ in range(args.uploaders):
+            threads.append(threading.Thread(target=uploader, args=(
+                client, workbook, stats['upload'], deadline, args)))
+
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        client.close()
+
+    return {
+        'target': target,
+        'settings': {
+            'readers': args.readers, 'writers': args.writers, 'uploaders': args.uploaders,
+            'upload_rows': args.upload_rows, 'duration': args.duration, 'retries': args.retries,
+            'journal_mode': args.journal_mode, 'busy_timeout': args.busy_timeout,
+            'bypass_cache': args.bypass_cache,
+        },
+        'elapsed': round(elapsed, 2),
+        'operations': {name: s.summary(elapsed) for name, s in stats.items() if s.latencies},
+    }
+
+
+def print_report(result):
+    print(f"目标: {result['target']}  用时: {result['elapsed']} 秒")
+    print(f"设置: {json.dumps(result['settings'], ensure_ascii=False)}")
+    columns = ['requests', 'ok', 'errors', 'throughput'] + [f'p{p}_ms' for p in PERCENTILES] + \
+        ['max_ms', 'busy', 'retry_rate', 'gave_up']
+    print(f"{'operation':<10}" + ''.join(f"{c:>12}" for c in columns))
+    for name, summary in result['operations'].items():
+        print(f"{name:<10}" + ''.join(f"{summary[c]:>12}" for c in columns))
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    result = run(args)
+    print_report(result)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
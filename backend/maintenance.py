@@ -0,0 +1,384 @@
+"""
+数据库后台维护: 统计信息 (ANALYZE / PRAGMA optimize)、WAL 检查点和空闲页回收 (incremental_vacuum)。
+
+大批量导入、删除之后查询规划器还在使用过时 (或从未收集) 的统计信息，WAL 文件和空闲页也会让
+数据库文件越来越大。维护任务在达到阈值时执行，或在服务空闲时把积累的少量工作一次做完:
+
+    prune       变更日志中可以清理的记录 (早于保留期且持久下游都已处理，见 journal.py) 达到
+                FLEET_JOURNAL_PRUNE_ROWS (默认 10000) 行时分批删除。
+    analyze     某张表自上次分析以来的写入行数达到 FLEET_ANALYZE_ROWS (默认 1000)，
+                或有全量重建 (reload)，或数据库从未收集过统计信息。
+                对这些表执行 ANALYZE (PRAGMA analysis_limit 限制每个索引的采样行数)，再执行 PRAGMA optimize。
+    checkpoint  WAL 模式下 -wal 文件达到 FLEET_CHECKPOINT_MB (默认 64) MB 时执行 wal_checkpoint(TRUNCATE)。
+    vacuum      auto_vacuum = INCREMENTAL 且空闲页达到 FLEET_VACUUM_FREE_PAGES (默认 2048) 页时，
+                每次回收 VACUUM_STEP_PAGES 页，分多个短事务执行，不长时间占用写锁。
+空闲 (FLEET_MAINTENANCE_IDLE 秒内本进程没有请求、数据库没有新的写入) 时，未达到阈值的任务也会执行。
+
+写入量来自变更日志 (change_journal)，导入脚本等其他程序的写入同样计入；每张表上次分析时的 seq
+保存在 analyze_state 表中 (见 migrations.py)，所有进程共用。
+
+auto_vacuum 只能在建表之前或 VACUUM 时修改: 全量导入 (be/import_data.py) 新建的数据库直接使用 INCREMENTAL，
+已有数据库用 "python maintenance.py enable-incremental" 转换一次 (完整 VACUUM，期间独占数据库)。
+
+后台调度 (MaintenanceScheduler): 每个进程一个线程，每 FLEET_MAINTENANCE_INTERVAL 秒 (默认 60，0 为关闭)
+检查一次各车队的数据库；多个 worker 通过文件锁 <数据库>.maintenance.lock 保证同一时间只有一个在执行。
+
+用法 (在 backend 目录下):
+    python maintenance.py status
+    python maintenance.py run                       # 执行到期的任务
+    python maintenance.py run --force prune,analyze,vacuum
+    python maintenance.py enable-incremental
+"""
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from datetime import datetime
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+from journal import RETENTION_DAYS, latest_seq, oldest_seq, prunable_seq, prune_changes
+from migrations import JOURNAL_TABLES, migrate, table_exists
+
+TASKS = ('prune', 'analyze', 'checkpoint', 'vacuum')
+PRUNE_ROWS = int(os.environ.get('FLEET_JOURNAL_PRUNE_ROWS', 10000))
+ANALYZE_ROWS = int(os.environ.get('FLEET_ANALYZE_ROWS', 1000))
+CHECKPOINT_BYTES = int(float(os.environ.get('FLEET_CHECKPOINT_MB', 64)) * 1024 * 1024)
+VACUUM_FREE_PAGES = int(os.environ.get('FLEET_VACUUM_FREE_PAGES', 2048))
+MAINTENANCE_INTERVAL = int(os.environ.get('FLEET_MAINTENANCE_INTERVAL', 60))
+MAINTENANCE_IDLE = int(os.environ.get('FLEET_MAINTENANCE_IDLE', 300))
+ANALYSIS_LIMIT = 1000
+VACUUM_STEP_PAGES = 1000
+LOCK_SUFFIX = '.maintenance.lock'
+
+AUTO_VACUUM_MODES = {0: 'none', 1: 'full', 2: 'incremental'}
+
+
+def _pragma(conn, name):
+    return conn.execute(f'PRAGMA {name}').fetchone()[0]
+
+
+def database_stats(conn, db_file):
+    """数据库文件的大小、页数、空闲页、WAL 大小等 (字典)。"""
+    page_size = _pragma(conn, 'page_size')
+    freelist_pages = _pragma(conn, 'freelist_count')
+    wal_file = db_file + '-wal'
+    return {
+        'file_size': os.path.getsize(db_file) if os.path.exists(db_file) else 0,
+        'page_size': page_size,
+        'page_count': _pragma(conn, 'page_count'),
+        'freelist_pages': freelist_pages,
+        'freelist_bytes': freelist_pages * page_size,
+        'auto_vacuum': AUTO_VACUUM_MODES.get(_pragma(conn, 'auto_vacuum')),
+        'journal_mode': _pragma(conn, 'journal_mode'),
+        'wal_size': os.path.getsize(wal_file) if os.path.exists(wal_file) else 0,
+        'analyzed': table_exists(conn, 'sqlite_stat1'),
+        'journal': journal_stats(conn),
+    }
+
+
+def journal_stats(conn):
+    """变更日志的 seq 范围和可以清理的记录数；日志尚未建立时返回 None。"""
+    if not table_exists(conn, 'change_journal'):
+        return None
+    limit = prunable_seq(conn)
+    return {
+        'oldest_seq': oldest_seq(conn),
+        'latest_seq': latest_seq(conn),
+        'retention_days': RETENTION_DAYS,
+        'prunable_seq': limit,
+        'prunable_rows': conn.execute('SELECT COUNT(*) FROM change_journal WHERE seq <= ?', (limit,)).fetchone()[0],
+    }
+
+
+def _analyzed_seqs(conn):
+    try:
+        return dict(conn.execute('SELECT table_name, analyzed_seq FROM analyze_state'))
+    except sqlite3.OperationalError:
+        return {}
+
+
+def pending_writes(conn):
+    """各表自上次 ANALYZE 以来的写入 {表名: {'writes': 行数, 'reload': 是否有全量重建}}。"""
+    if not table_exists(conn, 'change_journal'):
+        return {}
+    analyzed = _analyzed_seqs(conn)
+    pending = {}
+    for table_name in JOURNAL_TABLES:
+        writes, reload = conn.execute("""
+            SELECT COUNT(*), COALESCE(MAX(op = 'reload'), 0) FROM change_journal
+            WHERE seq > ? AND table_name = ?
+        """, (analyzed.get(table_name, 0), table_name)).fetchone()
+        pending[table_name] = {'writes': writes, 'reload': bool(reload)}
+    return pending
+
+
+def due_tasks(stats, pending, idle=False):
+    """
+    根据数据库状态返回到期的任务 {任务: 说明}。
+    analyze 的说明是需要分析的表 (None 表示全部表)。
+    """
+    tasks = {}
+    journal = stats['journal']
+    if journal and (journal['prunable_rows'] >= PRUNE_ROWS or (idle and journal['prunable_rows'])):
+        tasks['prune'] = journal['prunable_seq']
+    if not stats['analyzed']:
+        tasks['analyze'] = None
+    else:
+        tables = [table_name for table_name, item in pending.items()
+                  if item['reload'] or item['writes'] >= ANALYZE_ROWS or (idle and item['writes'])]
+        if tables:
+            tasks['analyze'] = tables
+    if stats['journal_mode'] == 'wal' and (stats['wal_size'] >= CHECKPOINT_BYTES or (idle and stats['wal_size'])):
+        tasks['checkpoint'] = stats['wal_size']
+    if stats['auto_vacuum'] == 'incremental' and (
+            stats['freelist_pages'] >= VACUUM_FREE_PAGES or (idle and stats['freelist_pages'])):
+        tasks['vacuum'] = stats['freelist_pages']
+    return tasks
+
+
+def analyze(conn, tables=None):
+    """
+    对 tables (None 为整个数据库) 执行 ANALYZE 和 PRAGMA optimize，
+    并记录各表当前的变更日志 seq。返回分析过的表名列表。
+    """
+    conn.execute(f'PRAGMA analysis_limit = {ANALYSIS_LIMIT}')
+    if tables is None:
+        conn.execute('ANALYZE')
+        tables = [table_name for table_name in JOURNAL_TABLES if table_exists(conn, table_name)]
+    else:
+        for table_name in tables:
+            conn.execute(f'ANALYZE {table_name}')
+    conn.execute('PRAGMA optimize')
+    if table_exists(conn, 'analyze_state'):
+        seq = latest_seq(conn)
+        conn.executemany("""
+            INSERT INTO analyze_state (table_name, analyzed_seq) VALUES (?, ?)
+            ON CONFLICT (table_name) DO UPDATE SET
+                analyzed_seq = excluded.analyzed_seq, analyzed_at = excluded.analyzed_at
+        """, [(table_name, seq) for table_name in tables])
+    conn.commit()
+    return list(tables)
+
+
+def checkpoint(conn):
+    """把 WAL 写回数据库文件并截断，返回 (是否被读写阻塞, WAL 帧数, 已写回的帧数)。"""
+    return tuple(conn.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchone())
+
+
+def incremental_vacuum(conn, step=VACUUM_STEP_PAGES):
+    """分批回收空闲页 (每批一个短事务)，返回回收的页数。需要 auto_vacuum = INCREMENTAL。"""
+    reclaimed = 0
+    while True:
+        before = _pragma(conn, 'freelist_count')
+        if not before:
+            break
+        conn.execute(f'PRAGMA incremental_vacuum({int(step)})').fetchall()
+        conn.commit()
+        after = _pragma(conn, 'freelist_count')
+        if after >= before:
+            break
+        reclaimed += before - after
+    return reclaimed
+
+
+def run_maintenance(conn, db_file, idle=False, force=()):
+    """
+    执行到期的任务 (以及 force 中列出的任务)，返回 {任务: 结果}。
+    conn 需要处于自动提交模式 (isolation_level=None)。
+    """
+    stats = database_stats(conn, db_file)
+    tasks = due_tasks(stats, pending_writes(conn), idle)
+    for task in force:
+        tasks[task] = None
+    results = {}
+    # 先清理日志，释放的页由后面的 vacuum 回收
+    if 'prune' in tasks and stats['journal']:
+        results['prune'] = {'deleted_rows': prune_changes(conn, prunable_seq(conn))}
+    if 'analyze' in tasks:
+        results['analyze'] = analyze(conn, tasks['analyze'])
+    if 'vacuum' in tasks and stats['auto_vacuum'] == 'incremental':
+        results['vacuum'] = {'reclaimed_pages': incremental_vacuum(conn)}
+    # 检查点放在最后，前面任务写入 WAL 的页一并写回
+    if 'checkpoint' in tasks and stats['journal_mode'] == 'wal':
+        busy, log_frames, checkpointed = checkpoint(conn)
+        results['checkpoint'] = {'busy': bool(busy), 'log_frames': log_frames, 'checkpointed': checkpointed}
+    return results
+
+
+def enable_incremental(conn):
+    """把已有数据库切换为 auto_vacuum = INCREMENTAL (执行一次完整的 VACUUM)。"""
+    conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+    conn.execute('VACUUM')
+    return AUTO_VACUUM_MODES.get(_pragma(conn, 'auto_vacuum'))
+
+
+class MaintenanceScheduler:
+    """
+    后台维护线程。databases() 返回需要维护的 [(名称, 数据库文件)]；
+    touch() 在每个请求开始时调用，用于判断空闲。
+    """
+
+    def __init__(self, databases, interval=MAINTENANCE_INTERVAL, idle_seconds=MAINTENANCE_IDLE,
+                 busy_timeout=5.0):
+        self._databases = databases
+        self.interval = interval
+        self.idle_seconds = idle_seconds
+        self.busy_timeout = busy_timeout
+        self._lock = threading.Lock()
+        self._pid = None
+        self._last_request = time.monotonic()
+        # 数据库文件 -> (上次看到的 seq, 看到它变化的时间)
+        self._last_write = {}
+        # 数据库文件 -> 最近一次执行的结果
+        self.last_runs = {}
+
+    def touch(self):
+        self._last_request = time.monotonic()
+
+    def start(self):
+        """启动后台线程 (fork 之后在子进程中重新启动)；interval 为 0 时不启动。"""
+        if self.interval <= 0:
+            return False
+        with self._lock:
+            if self._pid == os.getpid():
+                return False
+            self._pid = os.getpid()
+        threading.Thread(target=self._loop, name='db-maintenance', daemon=True).start()
+        return True
+
+    def _loop(self):
+        while True:
+            time.sleep(self.interval)
+            for name, db_file in self._databases():
+                if not os.path.exists(db_file):
+                    continue
+                try:
+                    self.run_once(db_file)
+                except (OSError, sqlite3.Error) as e:
+                    self.last_runs[db_file] = {'name': name, 'at': _now(), 'error': str(e)}
+
+    def _idle_for(self, db_file, seq):
+        now = time.monotonic()
+        previous = self._last_write.get(db_file)
+        if previous is None or previous[0] != seq:
+            self._last_write[db_file] = (seq, now)
+        return now - max(self._last_request, self._last_write[db_file][1])
+
+    def run_once(self, db_file, force=()):
+        """检查并执行一个数据库的维护任务；其他进程正在维护时跳过，返回 None。"""
+        with _exclusive(db_file + LOCK_SUFFIX) as acquired:
+            if not acquired:
+                return None
+            conn = sqlite3.connect(db_file, timeout=self.busy_timeout, isolation_level=None)
+            try:
+                idle = self._idle_for(db_file, latest_seq(conn)) >= self.idle_seconds
+                results = run_maintenance(conn, db_file, idle, force)
+            finally:
+                conn.close()
+        if results:
+            self.last_runs[db_file] = {'at': _now(), 'idle': idle, 'results': results}
+        return results
+
+    def status(self, db_file):
+        return {
+            'enabled': self.interval > 0 and self._pid == os.getpid(),
+            'interval': self.interval,
+            'idle_seconds': self.idle_seconds,
+            'idle_for': round(time.monotonic() - self._last_request, 1),
+            'last_run': self.last_runs.get(db_file),
+        }
+
+
+def _now():
+    return datetime.now().isoformat(timespec='seconds')
+
+
+class _exclusive:
+    """非阻塞的跨进程文件锁；不支持 fcntl 的平台总是成功 (由 SQLite 自身的锁保证正确性)。"""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def __enter__(self):
+        if fcntl is None:
+            return True
+        self._file = open(self.path, 'a')
+        try:
+            fcntl.flock(self._file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            self._file.close()
+            self._file = None
+            return False
+        return True
+
+    def __exit__(self, *exc_info):
+        if self._file is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+
+
+def maintenance_status(conn, db_file):
+    """状态接口和命令行共用: 数据库统计、各表待分析的写入和阈值。"""
+    analyzed_at = {}
+    if table_exists(conn, 'analyze_state'):
+        analyzed_at = dict(conn.execute('SELECT table_name, analyzed_at FROM analyze_state'))
+    pending = pending_writes(conn)
+    for table_name, item in pending.items():
+        item['analyzed_at'] = analyzed_at.get(table_name)
+    stats = database_stats(conn, db_file)
+    return {
+        'database': stats,
+        'tables': pending,
+        'due': sorted(due_tasks(stats, pending)),
+        'thresholds': {
+            'journal_prune_rows': PRUNE_ROWS,
+            'analyze_rows': ANALYZE_ROWS,
+            'checkpoint_bytes': CHECKPOINT_BYTES,
+            'vacuum_free_pages': VACUUM_FREE_PAGES,
+        },
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='数据库维护 (ANALYZE、WAL 检查点、空闲页回收)')
+    parser.add_argument('--db', default=os.environ.get('FLEET_DB_FILE', os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), 'data', 'vehicle_data_optimized.db')), help='数据库文件')
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('status', help='显示文件大小、空闲页、WAL 大小和待分析的写入')
+    run = commands.add_parser('run', help='执行到期的维护任务')
+    run.add_argument('--force', default='', help=f"无论是否到期都执行的任务，逗号分隔 ({', '.join(TASKS)})")
+    commands.add_parser('enable-incremental', help='切换为 auto_vacuum = INCREMENTAL (完整 VACUUM)')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if not os.path.exists(args.db):
+        sys.exit(f"数据库不存在: {args.db}")
+    conn = sqlite3.connect(args.db, isolation_level=None)
+    try:
+        migrate(conn)
+        if args.command == 'run':
+            force = [task for task in args.force.split(',') if task]
+            unknown = set(force) - set(TASKS)
+            if unknown:
+                sys.exit(f"未知的任务: {', '.join(sorted(unknown))}")
+            results = run_maintenance(conn, args.db, force=force)
+            print("已执行:", json.dumps(results, ensure_ascii=False) if results else '没有到期的任务')
+        elif args.command == 'enable-incremental':
+            print("auto_vacuum:", enable_incremental(conn))
+        print(json.dumps(maintenance_status(conn, args.db), ensure_ascii=False, indent=2))
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,493 @@
+"""
+数据库结构升级 (migrations)。
+
+be/import_data.py 负责建表和导入原始数据，这里只负责在已有表结构之上
+追加后端运行所需的辅助结构 (版本表、触发器、索引等)。
+
+每个升级步骤对应一个递增的版本号，当前版本记录在 SQLite 的
+PRAGMA user_version 中。所有步骤都写成幂等的 (IF NOT EXISTS、先检查列是否存在)，
+因此 import_data.py 重建表后把 user_version 归零再执行一次 migrate() 即可。
+"""
+import sqlite3
+
+MIGRATIONS = []
+
+
+def migration(version):
+    """装饰器: 注册一个版本号为 version 的升级步骤。"""
+    def decorator(func):
+        MIGRATIONS.append((version, func))
+        MIGRATIONS.sort(key=lambda item: item[0])
+        return func
+    return decorator
+
+
+def table_exists(conn, table_name):
+    row = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table_name,)
+    ).fetchone()
+    return row is not None
+
+
+def column_exists(conn, table_name, column_name):
+    return any(row[1] == column_name for row in conn.execute(f"PRAGMA table_info({table_name})"))
+
+
+def migrate(conn):
+    """把数据库升级到最新版本，返回升级后的版本号。"""
+    current = conn.execute('PRAGMA user_version').fetchone()[0]
+    for version, func in MIGRATIONS:
+        if version <= current:
+            continue
+        try:
+            conn.execute('BEGIN')
+            func(conn)
+            # PRAGMA 不支持参数绑定，version 来自代码中的常量
+            conn.execute(f'PRAGMA user_version = {int(version)}')
+            conn.execute('COMMIT')
+        except sqlite3.Error:
+            conn.execute('ROLLBACK')
+            raise
+        current = version
+    return current
+
+
+# --- 升级步骤 ---
+
+DICTIONARY_TABLES = ('departments', 'violation_types', 'service_providers')
+
+
+@migration(1)
+def add_cache_versions(conn):
+    """
+    版本计数表: 字典表发生任何写入时由触发器递增 dictionary 版本号，
+    进程内缓存据此判断是否需要重新加载 (见 dict_cache.py)。
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS cache_versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    conn.execute("INSERT OR IGNORE INTO cache_versions (name, version) VALUES ('dictionary', 0)")
+    for table_name in DICTIONARY_TABLES:
+        if not table_exists(conn, table_name):
+            continue
+        for op in ('INSERT', 'UPDATE', 'DELETE'):
+            conn.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS trg_{table_name}_{op.lower()}_version
+                AFTER {op} ON {table_name}
+                BEGIN
+                    UPDATE cache_versions SET version = version + 1 WHERE name = 'dictionary';
+                END
+            """)
+
+
+# 事实表 -> 按 vehicle_id 查询所用的索引列
+FACT_TABLES = {
+    'violations': 'vehicle_id, violation_time',
+    'maintenance': 'vehicle_id, request_time',
+    'monthly_fuel_summary': 'vehicle_id, year, month',
+}
+
+
+def create_resolve_vehicle_triggers(conn, table_name):
+    """
+    事实表按车牌号补齐 vehicle_id 的触发器 (已存在时跳过)。
+    (修改) 只在 vehicle_id 确实需要变化时更新，写入方已经给出正确的 vehicle_id 时不产生额外的更新
+    (也就不会多记一条变更日志)。
+    """
+    resolved = f"(SELECT v.vehicle_id FROM vehicles v WHERE v.plate_number = NEW.plate_number)"
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_{table_name}_resolve_vehicle_insert
+        AFTER INSERT ON {table_name}
+        WHEN NEW.vehicle_id IS NULL
+        BEGIN
+            UPDATE {table_name} SET vehicle_id = {resolved}
+            WHERE rowid = NEW.rowid AND vehicle_id IS NOT {resolved};
+        END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_{table_name}_resolve_vehicle_update
+        AFTER UPDATE OF plate_number ON {table_name}
+        BEGIN
+            UPDATE {table_name} SET vehicle_id = {resolved}
+            WHERE rowid = NEW.rowid AND vehicle_id IS NOT {resolved};
+        END
+    """)
+
+
+@migration(2)
+def add_fact_vehicle_ids(conn):
+    """
+    为事实表增加整数外键 vehicle_id，统计查询改为按整数关联 vehicles，
+    不再对整张事实表做 plate_number 文本关联。plate_number 仍作为对外标识保留。
+    """
+    if not table_exists(conn, 'vehicles'):
+        return
+    for table_name, index_columns in FACT_TABLES.items():
+        if not table_exists(conn, table_name):
+            continue
+        if not column_exists(conn, table_name, 'vehicle_id'):
+            conn.execute(f"ALTER TABLE {table_name} ADD COLUMN vehicle_id INTEGER REFERENCES vehicles (vehicle_id)")
+        # 回填历史数据
+        conn.execute(f"""
+            UPDATE {table_name}
+            SET vehicle_id = (SELECT v.vehicle_id FROM vehicles v WHERE v.plate_number = {table_name}.plate_number)
+            WHERE vehicle_id IS NULL
+        """)
+        # 兜底: 只提供了车牌号的写入 (例如数据管理页的增删改) 由触发器补齐 vehicle_id
+        create_resolve_vehicle_triggers(conn, table_name)
+        # 先录入事实数据、后录入车辆时，补齐之前无法解析的记录
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_vehicles_link_{table_name}
+            AFTER INSERT ON vehicles
+            BEGIN
+                UPDATE {table_name} SET vehicle_id = NEW.vehicle_id
+                WHERE plate_number = NEW.plate_number AND vehicle_id IS NULL;
+            END
+        """)
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table_name}_vehicle_id ON {table_name} ({index_columns})")
+
+
+# 变更日志覆盖的表 -> (主键列, 所属月份表达式)，月份表达式中的 {row} 会被替换为 NEW / OLD
+JOURNAL_TABLES = {
+    'vehicles': ('vehicle_id', "NULL"),
+    'violations': ('violation_id', "substr({row}.violation_time, 1, 7)"),
+    'maintenance': ('maintenance_id', "substr({row}.request_time, 1, 7)"),
+    'monthly_fuel_summary': ('summary_id', "printf('%04d-%02d', {row}.year, {row}.month)"),
+}
+# (新增) 更新触发器记录的 op: 车辆调整部门记为 'move'，前缀和索引只需处理这一种车辆修改 (见 range_index.py)
+JOURNAL_UPDATE_OPS = {
+    'vehicles': "CASE WHEN OLD.department_id IS NOT NEW.department_id THEN 'move' ELSE 'update' END",
+}
+
+
+def create_journal_triggers(conn, table_name):
+    """为一张表创建变更日志触发器 (已存在时跳过)。"""
+    pk_column, period = JOURNAL_TABLES[table_name]
+    new_period, old_period = period.format(row='NEW'), period.format(row='OLD')
+    update_op = JOURNAL_UPDATE_OPS.get(table_name, "'update'")
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_{table_name}_journal_insert
+        AFTER INSERT ON {table_name}
+        BEGIN
+            INSERT INTO change_journal (table_name, op, pk, new_vehicle_id, new_period)
+            VALUES ('{table_name}', 'insert', NEW.{pk_column}, NEW.vehicle_id, {new_period});
+        END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_{table_name}_journal_update
+        AFTER UPDATE ON {table_name}
+        BEGIN
+            INSERT INTO change_journal (table_name, op, pk, old_vehicle_id, old_period, new_vehicle_id, new_period)
+            VALUES ('{table_name}', {update_op}, NEW.{pk_column}, OLD.vehicle_id, {old_period}, NEW.vehicle_id, {new_period});
+        END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_{table_name}_journal_delete
+        AFTER DELETE ON {table_name}
+        BEGIN
+            INSERT INTO change_journal (table_name, op, pk, old_vehicle_id, old_period)
+            VALUES ('{table_name}', 'delete', OLD.{pk_column}, OLD.vehicle_id, {old_period});
+        END
+    """)
+
+
+@migration(3)
+def add_change_journal(conn):
+    """
+    变更日志 (change data capture): 由触发器记录上述表的每一次增删改。
+    seq 单调递增且不会复用 (AUTOINCREMENT)，下游按 seq 增量同步 (见 journal.py)。
+    除主键外还记录修改前后的 vehicle_id 和月份，方便汇总类缓存只重算受影响的部分。
+    op = 'reload' 表示整张表被重新导入，下游需要全量重建。
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS change_journal (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            table_name TEXT NOT NULL,
+            op TEXT NOT NULL,
+            pk INTEGER,
+            old_vehicle_id INTEGER,
+            old_period TEXT,
+            new_vehicle_id INTEGER,
+            new_period TEXT,
+            changed_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now'))
+        )
+    """)
+    for table_name in JOURNAL_TABLES:
+        if not table_exists(conn, table_name):
+            continue
+        create_journal_triggers(conn, table_name)
+        # 建表/重新导入时写入的数据没有经过触发器，记录一条全量重建标记
+        conn.execute("INSERT INTO change_journal (table_name, op) VALUES (?, 'reload')", (table_name,))
+
+
+# 维护 Top-N 计数的维度 -> (事实表, 时间列, 键列, 触发器中新行的键)
+# 新写入行的 location_id 由同一个触发器先行登记，因此直接按地点文本查字典表
+TOP_COUNT_KINDS = {
+    'location': ('violations', 'violation_time', 'location_id',
+                 "(SELECT location_id FROM violation_locations WHERE name = trim(NEW.violation_location))"),
+    'violation_type': ('violations', 'violation_time', 'violation_type_id', "NEW.violation_type_id"),
+    'provider': ('maintenance', 'request_time', 'provider_id', "NEW.provider_id"),
+}
+# 事实表 -> 影响计数的列 (UPDATE OF 触发条件)
+TOP_COUNT_COLUMNS = {
+    'violations': 'violation_location, violation_time, violation_type_id',
+    'maintenance': 'request_time, provider_id',
+}
+# 把违章地点文本登记到字典表并回写 location_id (只在 location_id 需要变化时更新)
+INTERN_LOCATION_SQL = """
+    INSERT OR IGNORE INTO violation_locations (name)
+    SELECT trim(NEW.violation_location) WHERE trim(NEW.violation_location) <> '';
+    UPDATE violations
+    SET location_id = (SELECT location_id FROM violation_locations WHERE name = trim(NEW.violation_location))
+    WHERE rowid = NEW.rowid
+      AND location_id IS NOT (SELECT location_id FROM violation_locations WHERE name = trim(NEW.violation_location));
+"""
+
+
+def _top_count_statements(table_name, row):
+    """生成计数 +1 (row = 'NEW') 或 -1 (row = 'OLD') 的语句。"""
+    statements = []
+    for kind, (source, time_column, key_column, new_key) in TOP_COUNT_KINDS.items():
+        if source != table_name:
+            continue
+        if row == 'NEW':
+            statements.append(f"""
+                INSERT INTO top_counts (kind, period, key_id, count)
+                SELECT '{kind}', substr(NEW.{time_column}, 1, 7), {new_key}, 1
+                WHERE NEW.{time_column} IS NOT NULL AND {new_key} IS NOT NULL
+                ON CONFLICT (kind, period, key_id) DO UPDATE SET count = count + 1;
+            """)
+        else:
+            statements.append(f"""
+                UPDATE top_counts SET count = count - 1
+                WHERE kind = '{kind}' AND period = substr(OLD.{time_column}, 1, 7) AND key_id = OLD.{key_column};
+                DELETE FROM top_counts
+                WHERE kind = '{kind}' AND period = substr(OLD.{time_column}, 1, 7) AND key_id = OLD.{key_column}
+                  AND count <= 0;
+            """)
+    return ''.join(statements)
+
+
+@migration(4)
+def add_top_counts(conn):
+    """
+    违章地点字典表和按月的 Top-N 计数表。
+    - violation_locations: 违章地点文本 (去除首尾空白) 登记为整数 location_id，violations.location_id 引用它。
+    - top_counts: 每月各违章地点、违章类型、维保单位的记录数，由触发器精确维护，
+      Top-N 查询只需汇总所选月份的计数 (见 top_counts.py)，不再对违章表做文本 GROUP BY。
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS violation_locations (
+            location_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL UNIQUE
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS top_counts (
+            kind TEXT NOT NULL,
+            period TEXT NOT NULL,
+            key_id INTEGER NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (kind, period, key_id)
+        ) WITHOUT ROWID
+    """)
+    if not table_exists(conn, 'violations') or not table_exists(conn, 'maintenance'):
+        return
+
+    if not column_exists(conn, 'violations', 'location_id'):
+        conn.execute("ALTER TABLE violations ADD COLUMN location_id INTEGER REFERENCES violation_locations (location_id)")
+    # 回填时暂时移除违章表的变更日志更新触发器，避免为每一行写一条日志，改为记录一次全量重建标记
+    conn.execute("DROP TRIGGER IF EXISTS trg_violations_journal_update")
+    conn.execute("""
+        INSERT OR IGNORE INTO violation_locations (name)
+        SELECT DISTINCT trim(violation_location) FROM violations WHERE trim(violation_location) <> ''
+    """)
+    conn.execute("""
+        UPDATE violations
+        SET location_id = (SELECT l.location_id FROM violation_locations l WHERE l.name = trim(violations.violation_location))
+    """)
+    if table_exists(conn, 'change_journal'):
+        create_journal_triggers(conn, 'violations')
+        conn.execute("INSERT INTO change_journal (table_name, op) VALUES ('violations', 'reload')")
+
+    conn.execute("DELETE FROM top_counts")
+    for kind, (table_name, time_column, key_column, _) in TOP_COUNT_KINDS.items():
+        conn.execute(f"""
+            INSERT INTO top_counts (kind, period, key_id, count)
+            SELECT '{kind}', substr({time_column}, 1, 7), {key_column}, COUNT(*)
+            FROM {table_name}
+            WHERE {time_column} IS NOT NULL AND {key_column} IS NOT NULL
+            GROUP BY substr({time_column}, 1, 7), {key_column}
+        """)
+
+    for table_name, columns in TOP_COUNT_COLUMNS.items():
+        intern = INTERN_LOCATION_SQL if table_name == 'violations' else ''
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_{table_name}_top_counts_insert
+            AFTER INSERT ON {table_name}
+            BEGIN
+                {intern}
+                {_top_count_statements(table_name, 'NEW')}
+            END
+        """)
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_{table_name}_top_counts_update
+            AFTER UPDATE OF {columns} ON {table_name}
+            BEGIN
+                {intern}
+                {_top_count_statements(table_name, 'OLD')}
+                {_top_count_statements(table_name, 'NEW')}
+            END
+        """)
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_{table_name}_top_counts_delete
+            AFTER DELETE ON {table_name}
+            BEGIN
+                {_top_count_statements(table_name, 'OLD')}
+            END
+        """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_violations_location_id ON violations (location_id)")
+
+
+@migration(5)
+def add_archive_partitions(conn):
+    """
+    归档分区登记表: 已冻结到冷归档文件中的 (事实表, 年份)，查询时据此路由 (见 partitions.py)。
+    columns 为归档表的列名 (JSON 数组)；全量重新导入后的新库中登记表为空，旧的归档文件不再被引用。
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS archive_partitions (
+            table_name TEXT NOT NULL,
+            year INTEGER NOT NULL,
+            archive_file TEXT NOT NULL,
+            columns TEXT NOT NULL,
+            row_count INTEGER NOT NULL,
+            frozen_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%d %H:%M:%S', 'now')),
+            PRIMARY KEY (table_name, year)
+        )
+    """)
+
+
+@migration(6)
+def add_column_scales(conn):
+    """
+    定点存储的换算比例: 金额以分、油量以毫升保存为整数时，记录每一列的比例 (见 fixed_point.py)。
+    表为空表示按原来的浮点方式存储。
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS column_scales (
+            table_name TEXT NOT NULL,
+            column_name TEXT NOT NULL,
+            scale INTEGER NOT NULL,
+            PRIMARY KEY (table_name, column_name)
+        )
+    """)
+
+
+@migration(7)
+def add_analyze_state(conn):
+    """
+    后台维护 (见 maintenance.py): 记录每张表上次 ANALYZE 时变更日志的 seq，
+    之后该表的写入量即 seq 更大的日志条数。
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS analyze_state (
+            table_name TEXT PRIMARY KEY,
+            analyzed_seq INTEGER NOT NULL,
+            analyzed_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%d %H:%M:%S', 'now'))
+        )
+    """)
+
+
+@migration(8)
+def add_journal_consumers(conn):
+    """
+    变更日志的持久下游 (Parquet 导出、通过 /api/changes 同步的外部系统) 记录自己处理到的 seq，
+    清理日志时不删除它们尚未处理的记录 (见 journal.py 中的 prunable_seq)。
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS journal_consumers (
+            name TEXT PRIMARY KEY,
+            seq INTEGER NOT NULL,
+            updated_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%d %H:%M:%S', 'now'))
+        )
+    """)
+
+
+@migration(9)
+def journal_vehicle_moves(conn):
+    """
+    车辆的变更日志区分调整部门 (op = 'move') 和其他修改 (op = 'update')，
+    前缀和索引忽略车辆其他信息的修改，不再因此全量重建。
+    之前的日志无法区分，记录一条全量重建标记。
+    """
+    if not table_exists(conn, 'vehicles') or not table_exists(conn, 'change_journal'):
+        return
+    conn.execute("DROP TRIGGER IF EXISTS trg_vehicles_journal_update")
+    create_journal_triggers(conn, 'vehicles')
+    conn.execute("INSERT INTO change_journal (table_name, op) VALUES ('vehicles', 'reload')")
+
+
+@migration(10)
+def normalize_plate_numbers(conn):
+    """
+    已有的车牌号统一为导入时的规范写法 (见 plates.py)，此后导入、增删改和补齐 vehicle_id 的触发器
+    按车牌号关联时都是精确匹配。规范化后与另一辆车的车牌号重复时保持原样。
+    事实表中的车牌号只在对应的车辆已规范化 (原写法不再是某辆车的车牌号) 时更新；
+    更新期间暂时移除变更日志的更新触发器，改为记录一次全量重建标记 (与升级步骤 4 相同)。
+    """
+    from plates import normalize_plate
+    if not table_exists(conn, 'vehicles'):
+        return
+    vehicles = conn.execute('SELECT vehicle_id, plate_number FROM vehicles ORDER BY vehicle_id').fetchall()
+    plates = {plate for _, plate in vehicles}
+    for vehicle_id, plate in vehicles:
+        normalized = normalize_plate(plate)
+        if normalized and normalized != plate and normalized not in plates:
+            conn.execute('UPDATE vehicles SET plate_number = ? WHERE vehicle_id = ?', (normalized, vehicle_id))
+            plates.discard(plate)
+            plates.add(normalized)
+
+    journaled = table_exists(conn, 'change_journal')
+    for table_name in FACT_TABLES:
+        if not table_exists(conn, table_name):
+            continue
+        renames = []
+        for (plate,) in conn.execute(f'SELECT DISTINCT plate_number FROM {table_name} WHERE plate_number IS NOT NULL'):
+            normalized = normalize_plate(plate)
+            if normalized and normalized != plate and plate not in plates:
+                renames.append((normalized, plate))
+        if not renames:
+            continue
+        conn.execute(f"DROP TRIGGER IF EXISTS trg_{table_name}_journal_update")
+        conn.executemany(f"UPDATE {table_name} SET plate_number = ? WHERE plate_number = ?", renames)
+        if journaled:
+            create_journal_triggers(conn, table_name)
+            conn.execute("INSERT INTO change_journal (table_name, op) VALUES (?, 'reload')", (table_name,))
+
+
+@migration(11)
+def journal_final_values(conn):
+    """
+    写入一行事实数据只记一条变更日志，且记录的是最终的 vehicle_id:
+    - 补齐 vehicle_id 的触发器改为只在值需要变化时更新 (见 create_resolve_vehicle_triggers)，
+      应用的写入路径在写入前已解析出 vehicle_id (见 app.py 中的 with_resolved_ids)；
+    - 同一事件的触发器按创建时间从新到旧执行，重新创建事实表的变更日志触发器，使其先于
+      补齐 vehicle_id、登记违章地点的触发器执行。即使这些触发器仍需更新该行 (其他写入方)，
+      日志中也是先 insert 后 update，不会出现先更新一条还不存在的记录。
+    只替换触发器，不修改数据，不需要全量重建标记。
+    """
+    for table_name in FACT_TABLES:
+        if not table_exists(conn, table_name):
+            continue
+        if column_exists(conn, table_name, 'vehicle_id'):
+            conn.execute(f"DROP TRIGGER IF EXISTS trg_{table_name}_resolve_vehicle_insert")
+            conn.execute(f"DROP TRIGGER IF EXISTS trg_{table_name}_resolve_vehicle_update")
+            create_resolve_vehicle_triggers(conn, table_name)
+        if table_exists(conn, 'change_journal'):
+            for op in ('insert', 'update', 'delete'):
+                conn.execute(f"DROP TRIGGER IF EXISTS trg_{table_name}_journal_{op}")
+            create_journal_triggers(conn, table_name)
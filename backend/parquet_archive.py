@@ -0,0 +1,357 @@
+"""
+事实表按年/月分区导出为 Parquet 列式文件，供离线分析和长期留存，并提供按列的内存映射读取。
+
+目录结构 (默认 <数据库>.parquet):
+    violations/year=2024/month=03/data.parquet
+    violations/undated/data.parquet        # 时间为空或格式不正确的记录
+    _manifest.json                         # 已导出到的变更日志 seq、每个分区的行数，
+                                           # 以及无法转换为列类型而导出为 NULL 的值的个数 (coerced)
+
+增量导出 (export): 与前缀和索引相同，通过变更日志 (见 journal.py) 找出上次导出之后
+新增、修改或删除过记录的月份，只重写这些分区；分区内已没有记录时删除文件。
+第一次导出、整表重新导入 (reload) 或日志已被清理时整表导出。
+读取的是 partition_source，已冻结到归档文件的年份 (见 partitions.py) 同样会被导出。
+每个文件先写入临时文件再改名，清单最后写入；中途失败时下次导出会重做未完成的分区。
+导出目录登记为变更日志的下游 (journal_consumers)，日志清理时保留它尚未导出的记录。
+
+读取 (ParquetArchive): 按月份范围选出分区文件，只读取需要的列，
+文件以 memory_map 方式打开，由操作系统按需换入页面，不把整个文件读进进程内存。
+monthly_totals() 给出与汇总接口相同口径的各月合计 (指标名见 range_index.METRICS)，
+历史月份的统计可以直接从导出文件得出，不依赖线上数据库中仍保留这些记录。
+
+依赖 pyarrow，只在导出和读取时导入，后端服务本身不需要。
+
+用法 (在 backend 目录下):
+    python parquet_archive.py export
+    python parquet_archive.py status
+    python parquet_archive.py totals --start 2023-01 --end 2023-12
+"""
+import argparse
+import json
+import os
+import re
+import sqlite3
+import sys
+
+from fixed_point import column_scales
+from granularity import month_number
+from journal import ack_consumer, has_gap, iter_changes, latest_seq, oldest_seq
+from migrations import JOURNAL_TABLES, table_exists
+from partitions import partition_source
+
+PARQUET_SUFFIX = '.parquet'
+MANIFEST_FILE = '_manifest.json'
+UNDATED = 'undated'
+EXPORTED_TABLES = ('violations', 'maintenance', 'monthly_fuel_summary')
+# 导出的数据文件名；每个分区一个文件
+PARTITION_FILE = 'data.parquet'
+
+# 事实表 -> {指标: 求和的列}，另有记录数指标 (与 range_index.SOURCES 口径一致)
+SUM_COLUMNS = {
+    'monthly_fuel_summary': {
+        'total_distance': 'distance_driven',
+        'total_fuel': 'total_fuel_amount',
+        'total_fuel_cost': 'total_fuel_cost',
+    },
+    'violations': {},
+    'maintenance': {'total_maintenance_cost': 'maintenance_cost'},
+}
+COUNT_METRICS = {
+    'monthly_fuel_summary': 'fuel_records',
+    'violations': 'violation_count',
+    'maintenance': 'maintenance_count',
+}
+
+_PERIOD_RE = re.compile(r'(\d{4})-(0[1-9]|1[0-2])')
+
+
+def partition_key(period):
+    """记录所属的月份 (变更日志中的 period) -> 分区键 'YYYY-MM'；无法识别时为 UNDATED。"""
+    if period and _PERIOD_RE.fullmatch(period) and period[:4] != '0000':
+        return period
+    return UNDATED
+
+
+def partition_path(table_name, key):
+    """分区键 -> 相对于导出目录的文件路径。"""
+    if key == UNDATED:
+        return os.path.join(table_name, UNDATED, PARTITION_FILE)
+    return os.path.join(table_name, f'year={key[:4]}', f'month={key[5:]}', PARTITION_FILE)
+
+
+def _arrow_type(declared):
+    """SQLite 声明的列类型 -> Arrow 类型 (按 SQLite 的类型亲和规则)。"""
+    import pyarrow as pa
+    declared = (declared or '').upper()
+    if 'INT' in declared:
+        return pa.int64()
+    if any(word in declared for word in ('CHAR', 'CLOB', 'TEXT', 'DATE', 'TIME')):
+        return pa.string()
+    return pa.float64()
+
+
+def _convert(value, arrow_type):
+    """SQLite 的动态类型值 -> 列类型；无法转换时抛出 ValueError。"""
+    import pyarrow as pa
+    if value is None:
+        return None
+    if arrow_type == pa.string():
+        return value if isinstance(value, str) else str(value)
+    try:
+        if arrow_type != pa.int64():
+            return float(value)
+        if isinstance(value, int):
+            return value
+        if isinstance(value, str) and value.strip().lstrip('+-').isdigit():
+            return int(value)
+        # (修改) REAL 或 '12.5' 这样的文本四舍五入取整 (与 fixed_point.py 的换算相同)，不截断小数
+        return int(round(float(value)))
+    except (TypeError, ValueError, OverflowError):
+        raise ValueError(f"无法转换为 {arrow_type}: {value!r}") from None
+
+
+def table_schema(conn, table_name):
+    """表的 Arrow schema；所有分区使用同一个 schema，读取时可以直接拼接。"""
+    import pyarrow as pa
+    columns = conn.execute(f"PRAGMA main.table_info({table_name})").fetchall()
+    return pa.schema([(column[1], _arrow_type(column[2])) for column in columns])
+
+
+def read_manifest(out_dir):
+    path = os.path.join(out_dir, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return {'seq': 0, 'tables': {}}
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _write_atomic(path, write):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _dirty_partitions(conn, since, tables):
+    """
+    seq > since 的变更涉及的分区: {表名: 分区键集合}，值为 None 表示整表导出。
+    日志在 since 之后被清理过 (无法确定增量) 时所有表都整表导出。
+    """
+    if not since:
+        return {table_name: None for table_name in tables}
+    if not oldest_seq(conn) or has_gap(conn, since):
+        return {table_name: None for table_name in tables}
+    dirty = {table_name: set() for table_name in tables}
+    for batch in iter_changes(conn, since, tables=list(tables)):
+        for change in batch:
+            keys = dirty[change['table_name']]
+            if keys is None:
+                continue
+            if change['op'] == 'reload':
+                dirty[change['table_name']] = None
+                continue
+            columns = {'insert': ('new_period',), 'delete': ('old_period',)}.get(
+                change['op'], ('old_period', 'new_period'))
+            keys.update(partition_key(change[column]) for column in columns)
+    return dirty
+
+
+def _read_partitions(conn, table_name, keys):
+    """读取分区键在 keys 中的记录 (keys 为 None 时读取整表)，返回 {分区键: [行]}。"""
+    _, period_sql = JOURNAL_TABLES[table_name]
+    period = period_sql.format(row='t')
+    months = sorted(key for key in (keys or ()) if key != UNDATED)
+    if keys is None or UNDATED in keys:
+        # 整表或无法识别月份的记录: 读取全部行后在 Python 中分组
+        sql, params = f"SELECT {period}, t.* FROM {partition_source(conn, table_name)} t", ()
+    else:
+        sql = f"""
+            SELECT {period}, t.* FROM {partition_source(conn, table_name, months[0], months[-1])} t
+            WHERE {period} IN (SELECT value FROM json_each(?))
+        """
+        params = (json.dumps(months),)
+    rows = {}
+    for row in conn.execute(sql, params):
+        key = partition_key(row[0])
+        if keys is None or key in keys:
+            rows.setdefault(key, []).append(row[1:])
+    return rows
+
+
+def _write_partition(path, schema, rows, scales):
+    """
+    写入一个分区；scales 为该表定点存储列的比例 (见 fixed_point.py)，导出文件中总是原单位。
+    返回无法转换而写为 NULL 的值的个数 {列: 个数}。
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    columns = []
+    coerced = {}
+    for i, field in enumerate(schema):
+        values = []
+        for row in rows:
+            try:
+                values.append(_convert(row[i], field.type))
+            except ValueError:
+                values.append(None)
+                coerced[field.name] = coerced.get(field.name, 0) + 1
+        scale = scales.get(field.name)
+        if scale:
+            values = [None if value is None else value / scale for value in values]
+        columns.append(pa.array(values, type=field.type))
+    _write_atomic(path, lambda tmp_path: pq.write_table(pa.Table.from_arrays(columns, schema=schema), tmp_path))
+    return coerced
+
+
+def export(conn, out_dir, tables=EXPORTED_TABLES):
+    """
+    把事实表增量导出到 out_dir，返回 {表名: {'written': [分区键], 'removed': [分区键]}}。
+    整个导出在一个读事务中完成，导出的数据与记录的 seq 一致。
+    """
+    tables = [table_name for table_name in tables if table_exists(conn, table_name)]
+    manifest = read_manifest(out_dir)
+    result = {}
+    conn.execute('BEGIN')
+    try:
+        seq = latest_seq(conn)
+        dirty = _dirty_partitions(conn, manifest.get('seq', 0), tables)
+        for table_name in tables:
+            keys = dirty[table_name]
+            if keys is not None and not keys:
+                continue
+            exported = manifest['tables'].setdefault(table_name, {})
+            coerced = manifest.setdefault('coerced', {}).setdefault(table_name, {})
+            schema = table_schema(conn, table_name)
+            scales = column_scales(conn).get(table_name, {})
+            rows = _read_partitions(conn, table_name, keys)
+            written = sorted(rows)
+            for key in written:
+                counts = _write_partition(os.path.join(out_dir, partition_path(table_name, key)),
+                                          schema, rows[key], scales)
+                exported[key] = len(rows[key])
+                # (新增) 记录分区中无法转换为列类型、导出为 NULL 的值的个数，重写分区时替换
+                if counts:
+                    coerced[key] = counts
+                else:
+                    coerced.pop(key, None)
+            # 分区内已没有记录 (整表导出时为本次没有出现的分区)
+            removed = sorted(key for key in exported if key not in rows and (keys is None or key in keys))
+            for key in removed:
+                path = os.path.join(out_dir, partition_path(table_name, key))
+                if os.path.exists(path):
+                    os.remove(path)
+                del exported[key]
+                coerced.pop(key, None)
+            result[table_name] = {'written': written, 'removed': removed}
+    finally:
+        conn.execute('COMMIT')
+    manifest['seq'] = seq
+    for table_name in manifest['tables']:
+        manifest['tables'][table_name] = dict(sorted(manifest['tables'][table_name].items()))
+    manifest['coerced'] = {table_name: dict(sorted(counts.items()))
+                           for table_name, counts in manifest.get('coerced', {}).items() if counts}
+
+    def write_manifest(tmp_path):
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=1)
+    _write_atomic(os.path.join(out_dir, MANIFEST_FILE), write_manifest)
+    # 登记为变更日志的下游，清理日志时保留下次增量导出需要的记录
+    if table_exists(conn, 'journal_consumers'):
+        ack_consumer(conn, f'parquet:{os.path.abspath(out_dir)}', seq)
+        conn.commit()
+    return result
+
+
+class ParquetArchive:
+    """已导出的 Parquet 分区的只读访问，文件以内存映射方式读取。"""
+
+    def __init__(self, out_dir):
+        self.out_dir = out_dir
+        self.manifest = read_manifest(out_dir)
+
+    def partitions(self, table_name, start_month=None, end_month=None):
+        """
+        表的分区键 (升序)。同时给出起止月份时只返回范围内的月份 (不含 UNDATED)，
+        与汇总接口的月份筛选规则一致。
+        """
+        keys = sorted(self.manifest['tables'].get(table_name, {}))
+        start, end = month_number(start_month), month_number(end_month)
+        if start_month and end_month and start is not None and end is not None:
+            keys = [key for key in keys if key != UNDATED and start <= month_number(key) <= end]
+        return keys
+
+    def read_partition(self, table_name, key, columns=None):
+        """读取一个分区的若干列，返回 pyarrow.Table。"""
+        import pyarrow.parquet as pq
+        return pq.read_table(os.path.join(self.out_dir, partition_path(table_name, key)),
+                             columns=columns, memory_map=True)
+
+    def read_columns(self, table_name, columns=None, start_month=None, end_month=None):
+        """读取月份范围内所有分区的若干列，拼接为一个 pyarrow.Table。"""
+        import pyarrow as pa
+        tables = [self.read_partition(table_name, key, columns)
+                  for key in self.partitions(table_name, start_month, end_month)]
+        return pa.concat_tables(tables) if tables else None
+
+    def monthly_totals(self, table_name, start_month=None, end_month=None):
+        """各月的指标合计 {分区键: {指标: 值}}。每个分区就是一个月，只读取求和用到的列。"""
+        import pyarrow.compute as pc
+        sums = SUM_COLUMNS[table_name]
+        totals = {}
+        for key in self.partitions(table_name, start_month, end_month):
+            data = self.read_partition(table_name, key, list(sums.values()))
+            values = {metric: pc.sum(data[column]).as_py() or 0 for metric, column in sums.items()}
+            values[COUNT_METRICS[table_name]] = data.num_rows
+            totals[key] = values
+        return totals
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='事实表的 Parquet 导出')
+    parser.add_argument('--db', default=os.environ.get('FLEET_DB_FILE', os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), 'data', 'vehicle_data_optimized.db')), help='数据库文件')
+    parser.add_argument('--out', help='导出目录，默认 <数据库>.parquet')
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('export', help='增量导出')
+    commands.add_parser('status', help='显示已导出的分区')
+    totals = commands.add_parser('totals', help='从导出文件计算各月合计')
+    totals.add_argument('--start', help='起始月份 (YYYY-MM)')
+    totals.add_argument('--end', help='结束月份 (YYYY-MM)')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    out_dir = args.out or args.db + PARQUET_SUFFIX
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        sys.exit("需要先安装 pyarrow: pip install pyarrow")
+    if args.command == 'export':
+        if not os.path.exists(args.db):
+            sys.exit(f"数据库不存在: {args.db}")
+        conn = sqlite3.connect(args.db, isolation_level=None)
+        try:
+            for table_name, changes in export(conn, out_dir).items():
+                print(f"{table_name}: 写入 {len(changes['written'])} 个分区，删除 {len(changes['removed'])} 个分区")
+        finally:
+            conn.close()
+    archive = ParquetArchive(out_dir)
+    if args.command == 'totals':
+        for table_name in EXPORTED_TABLES:
+            for key, values in archive.monthly_totals(table_name, args.start, args.end).items():
+                print(table_name, key, json.dumps(values, ensure_ascii=False))
+        return
+    print(f"导出目录: {out_dir} (seq {archive.manifest.get('seq', 0)})")
+    for table_name, partitions in archive.manifest['tables'].items():
+        print(f"{table_name}: {len(partitions)} 个分区，{sum(partitions.values())} 行")
+        for key, counts in archive.manifest.get('coerced', {}).get(table_name, {}).items():
+            print(f"  {key}: 无法转换、导出为 NULL 的值 {json.dumps(counts, ensure_ascii=False)}")
+
+
+if __name__ == '__main__':
+    main()
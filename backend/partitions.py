@@ -0,0 +1,236 @@
+"""
+事实表按年份冻结到冷归档文件，以及查询时的分区路由。
+
+违章、维保、月度油耗三张事实表只增不减，多年之后主库中大部分是不会再变化的历史数据。
+已经结束的年份可以冻结 (freeze_year): 该年的记录移入归档文件 <数据库>.archive 中的
+按年分表 (例如 violations_2023)，归档文件整理 (VACUUM) 后设为只读，主库只保留活跃年份。
+所有归档年份放在同一个文件里，只需 ATTACH 一次 (SQLite 默认最多附加 10 个数据库)。
+
+查询路由 (partition_source): 读取事实表的地方用它代替表名。
+- 没有归档时返回表名本身，查询与原来完全相同。
+- 否则返回主库表与归档表的 UNION ALL 子查询；同时给出起止月份时只包含范围内的年份，
+  只查询活跃年份时不会读取任何归档表。SQLite 会把外层的 WHERE 条件下推到每个分支，
+  各分支仍然使用 vehicle_id 索引。
+主库表始终参与查询，冻结之后补录到已归档年份的记录也会被统计。
+
+冻结时主库中的删除不经过变更日志和 Top-N 计数的删除触发器:
+这些记录只是换了存放位置，计数保持不变，变更日志记一条 reload 让前缀和索引重建。
+已归档的记录不在数据管理页中显示，也不能再修改。
+
+用法 (在 backend 目录下):
+    python partitions.py status
+    python partitions.py freeze --year 2023
+    python partitions.py freeze --before 2025      # 冻结 2025 年之前的所有年份
+"""
+import argparse
+import json
+import os
+import sqlite3
+import stat
+import sys
+from datetime import date
+
+from granularity import month_number
+from migrations import migrate, table_exists
+
+ARCHIVE_SCHEMA = 'archive'
+ARCHIVE_SUFFIX = '.archive'
+
+# 事实表 -> 记录所属年份的表达式
+PARTITIONED_TABLES = {
+    'violations': "CAST(substr(violation_time, 1, 4) AS INTEGER)",
+    'maintenance': "CAST(substr(request_time, 1, 4) AS INTEGER)",
+    'monthly_fuel_summary': "year",
+}
+# 冻结时临时移除的删除触发器 (见 migrations.py)
+DELETE_TRIGGERS = ('trg_{table}_journal_delete', 'trg_{table}_top_counts_delete')
+
+
+def archive_table(table_name, year):
+    return f"{table_name}_{int(year)}"
+
+
+def registered_partitions(conn, table_name=None):
+    """登记的归档分区 [(table_name, year, archive_file, columns)]；尚未执行 migrations 时为空。"""
+    where, params = ('WHERE table_name = ?', (table_name,)) if table_name else ('', ())
+    try:
+        rows = conn.execute(f"""
+            SELECT table_name, year, archive_file, columns FROM archive_partitions {where} ORDER BY table_name, year
+        """, params).fetchall()
+    except sqlite3.OperationalError:
+        return []
+    return [(row[0], row[1], row[2], json.loads(row[3])) for row in rows]
+
+
+def _is_attached(conn):
+    return any(row[1] == ARCHIVE_SCHEMA for row in conn.execute('PRAGMA database_list'))
+
+
+def attach_archive(conn, archive_file):
+    """把归档文件附加到连接上 (schema 名 archive)，已附加时跳过。"""
+    if not _is_attached(conn):
+        conn.execute(f'ATTACH DATABASE ? AS {ARCHIVE_SCHEMA}', (archive_file,))
+
+
+def _table_columns(conn, table_name, schema='main'):
+    return [row[1] for row in conn.execute(f"PRAGMA {schema}.table_info({table_name})")]
+
+
+def partition_source(conn, table_name, start_month=None, end_month=None):
+    """
+    返回查询 table_name 时 FROM 之后使用的表达式 (表名或带括号的子查询，可以直接加别名)。
+    同时给出合法的起止月份时只包含范围内的归档年份。
+    """
+    partitions = registered_partitions(conn, table_name)
+    start, end = month_number(start_month), month_number(end_month)
+    if start_month and end_month and start is not None and end is not None:
+        first_year, last_year = start // 12, end // 12
+        partitions = [p for p in partitions if first_year <= p[1] <= last_year]
+    partitions = [p for p in partitions if os.path.exists(p[2])]
+    if not partitions:
+        return table_name
+
+    attach_archive(conn, partitions[0][2])
+    columns = _table_columns(conn, table_name)
+    branches = [f"SELECT {', '.join(columns)} FROM main.{table_name}"]
+    for _, year, _, archived_columns in partitions:
+        # 冻结之后主库表新增的列在归档表中不存在，按 NULL 补齐
+        selected = ', '.join(c if c in archived_columns else f"NULL AS {c}" for c in columns)
+        branches.append(f"SELECT {selected} FROM {ARCHIVE_SCHEMA}.{archive_table(table_name, year)}")
+    return '(' + ' UNION ALL '.join(branches) + ')'
+
+
+def set_writable(path, writable):
+    """归档文件在写入期间可写，其余时间只读。"""
+    if os.path.exists(path):
+        mode = stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH
+        os.chmod(path, mode | stat.S_IWUSR if writable else mode)
+
+
+def freeze_year(conn, db_file, year, allow_current=False):
+    """
+    把 year 年的事实记录移入归档文件，返回 {表名: 移动的行数}。
+    默认只允许冻结已经结束的年份。归档文件在写入完成后整理并设为只读。
+    """
+    year = int(year)
+    if year >= date.today().year and not allow_current:
+        raise ValueError(f'{year} 年尚未结束，不能冻结')
+    migrate(conn)
+    partitions = registered_partitions(conn)
+    # 已有归档时继续使用登记的文件 (数据库文件被复制或移动后仍然指向原来的归档)
+    archive_file = partitions[0][2] if partitions else os.path.abspath(db_file + ARCHIVE_SUFFIX)
+    registered = {(p[0], p[1]) for p in partitions}
+
+    set_writable(archive_file, True)
+    if _is_attached(conn):
+        conn.execute(f'DETACH DATABASE {ARCHIVE_SCHEMA}')
+    conn.execute(f'ATTACH DATABASE ? AS {ARCHIVE_SCHEMA}', (archive_file,))
+    moved = {}
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        for table_name, year_sql in PARTITIONED_TABLES.items():
+            if not table_exists(conn, table_name):
+                continue
+            count = conn.execute(f"SELECT COUNT(*) FROM main.{table_name} WHERE {year_sql} = ?", (year,)).fetchone()[0]
+            if not count:
+                continue
+            target = f"{ARCHIVE_SCHEMA}.{archive_table(table_name, year)}"
+            if (table_name, year) in registered:
+                # 补录到已冻结年份的记录追加到原有的归档表
+                columns = ', '.join(c for c in _table_columns(conn, table_name)
+                                    if c in _table_columns(conn, archive_table(table_name, year), ARCHIVE_SCHEMA))
+                conn.execute(f"INSERT INTO {target} ({columns}) SELECT {columns} FROM main.{table_name} WHERE {year_sql} = ?",
+                             (year,))
+            else:
+                # 归档文件中可能留有全量重新导入之前的同名表，已不再被引用
+                conn.execute(f"DROP TABLE IF EXISTS {target}")
+                conn.execute(f"CREATE TABLE {target} AS SELECT * FROM main.{table_name} WHERE {year_sql} = ?", (year,))
+                conn.execute(f"""
+                    CREATE INDEX IF NOT EXISTS {ARCHIVE_SCHEMA}.idx_{archive_table(table_name, year)}_vehicle_id
+                    ON {archive_table(table_name, year)} (vehicle_id)
+                """)
+
+            triggers = [name.format(table=table_name) for name in DELETE_TRIGGERS]
+            saved = conn.execute(f"""
+                SELECT sql FROM main.sqlite_master
+                WHERE type = 'trigger' AND name IN ({', '.join('?' for _ in triggers)})
+            """, triggers).fetchall()
+            for name in triggers:
+                conn.execute(f"DROP TRIGGER IF EXISTS main.{name}")
+            conn.execute(f"DELETE FROM main.{table_name} WHERE {year_sql} = ?", (year,))
+            for (sql,) in saved:
+                conn.execute(sql)
+            conn.execute("INSERT INTO change_journal (table_name, op) VALUES (?, 'reload')", (table_name,))
+
+            archived_columns = _table_columns(conn, archive_table(table_name, year), ARCHIVE_SCHEMA)
+            total = conn.execute(f"SELECT COUNT(*) FROM {target}").fetchone()[0]
+            conn.execute("""
+                INSERT INTO archive_partitions (table_name, year, archive_file, columns, row_count)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (table_name, year) DO UPDATE SET
+                    archive_file = excluded.archive_file, columns = excluded.columns,
+                    row_count = excluded.row_count, frozen_at = excluded.frozen_at
+            """, (table_name, year, archive_file, json.dumps(archived_columns), total))
+            moved[table_name] = count
+        conn.execute('COMMIT')
+    except sqlite3.Error:
+        conn.execute('ROLLBACK')
+        raise
+    finally:
+        conn.execute(f'DETACH DATABASE {ARCHIVE_SCHEMA}')
+
+    archive = sqlite3.connect(archive_file)
+    try:
+        archive.execute('VACUUM')
+    finally:
+        archive.close()
+    set_writable(archive_file, False)
+    return moved
+
+
+def active_years(conn):
+    """主库各事实表中仍然存在的年份 {表名: [年份]}。"""
+    years = {}
+    for table_name, year_sql in PARTITIONED_TABLES.items():
+        if table_exists(conn, table_name):
+            years[table_name] = [row[0] for row in conn.execute(f"""
+                SELECT DISTINCT {year_sql} AS y FROM {table_name} WHERE y IS NOT NULL ORDER BY y
+            """)]
+    return years
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='事实表按年份归档')
+    parser.add_argument('--db', default=os.environ.get('FLEET_DB_FILE', os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), 'data', 'vehicle_data_optimized.db')), help='数据库文件')
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('status', help='显示活跃年份和已归档的分区')
+    freeze = commands.add_parser('freeze', help='冻结已结束的年份')
+    group = freeze.add_mutually_exclusive_group(required=True)
+    group.add_argument('--year', type=int, help='冻结某一年')
+    group.add_argument('--before', type=int, help='冻结该年份之前的所有年份')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if not os.path.exists(args.db):
+        sys.exit(f"数据库不存在: {args.db}")
+    conn = sqlite3.connect(args.db, isolation_level=None)
+    try:
+        if args.command == 'freeze':
+            if args.year is not None:
+                years = [args.year]
+            else:
+                years = sorted({y for ys in active_years(conn).values() for y in ys if y < args.before})
+            for year in years:
+                print(f"{year}: {freeze_year(conn, args.db, year) or '没有需要冻结的记录'}")
+        print("活跃年份:", json.dumps(active_years(conn), ensure_ascii=False))
+        for table_name, year, archive_file, _ in registered_partitions(conn):
+            print(f"已归档: {table_name} {year} -> {archive_file}")
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,31 @@
+"""
+车牌号的规范化规则: 全角转半角、去掉空白和分隔符 ('·'、'-')、字母转大写。
+
+导入 (ingest.py 中按列批量处理的 normalize_plates)、数据管理的增删改、批量写入和
+数据库升级 (migrations.py) 使用同一套规则，按车牌号关联车辆时两边的写法一致。
+本模块不依赖 pandas。
+"""
+import re
+
+FULL_WIDTH = str.maketrans({**{chr(0xFF01 + i): chr(0x21 + i) for i in range(94)}, '　': ' '})
+PLATE_NOISE = r'[\s·•\-]'
+_PLATE_NOISE_RE = re.compile(PLATE_NOISE)
+
+
+def normalize_plate(value):
+    """规范化单个车牌号，空值或规范化后为空时返回 None。"""
+    if value is None:
+        return None
+    return _PLATE_NOISE_RE.sub('', str(value).translate(FULL_WIDTH)).upper() or None
+
+
+def plate_map(conn):
+    """
+    规范化车牌号 -> vehicle_id。规范化之前录入的车牌号 (如 '皖P·12345'、小写字母)
+    也能与规范化后的车牌号对上；规范化后重复时取 vehicle_id 较小的车辆。
+    """
+    plates = {}
+    for plate, vehicle_id in conn.execute('SELECT plate_number, vehicle_id FROM vehicles ORDER BY vehicle_id'):
+        plates.setdefault(normalize_plate(plate), vehicle_id)
+    plates.pop(None, None)
+    return plates
@@ -0,0 +1,740 @@
+"""
+按月份的前缀和 (prefix sum) 索引，用于任意月份区间的汇总、排名和趋势。
+
+对每辆车、每个部门和整个车队，沿月份轴保存各项指标的累计值:
+    P[m] = 第 0 个月到第 m-1 个月的合计 (P[0] = 0)
+任意区间 [a, b] 的合计 = P[b + 1] - P[a]，只需两次查表和一次减法，
+与区间长短和原始记录数量无关；按车辆排名时对整列做向量化的减法和排序。
+
+违章和维保带有具体日期，另按部门在日期轴上保存一份累计值，
+任意粒度 (周 / 月 / 季 / 年，见 granularity.py) 的趋势都是各个桶边界上的差值，
+并且在筛选范围的首尾精确截断 (例如跨月的周只计入范围内的天数)。
+
+- 每个 "单元" 是 (vehicle_id, 月份) 在某张事实表上的汇总；vehicle_id 为空
+  或已不在 vehicles 表中的记录各自占一行，不属于任何部门，但计入车队合计。
+- 时间为空或格式不正确的记录无法归入月份，单独累计，只在不筛选时间时计入
+  (与原先 SQL 在不带 WHERE 时的结果一致)。
+- 数据变化后通过变更日志 (见 journal.py) 增量更新: 只重新查询受影响的单元，
+  把差值加到该月及之后的累计值上。
+  (修改) 车辆调整部门 (日志中 op = 'move') 时把该车的累计值从原部门移到新部门，
+  新增车辆追加一行，车辆其他信息的修改不影响索引。
+  (修改) 月份轴在最后一个月之后预留 MONTH_HEADROOM 个月，写入新的月份时直接使用预留部分；
+  月份轴的实际范围 (months) 由有记录的月份决定，与全量构建的结果相同。
+- 整表重新导入、变化过多、写入预留范围之外的月份或需要的日志已被清理时全量重建。
+  (修改) 重建在后台线程中进行，期间继续返回旧索引 (RangeIndex.rebuilding 为真)，
+  只有进程内第一次使用时同步构建。
+
+索引对象本身不可变，更新时生成新对象后整体替换，读请求无需加锁。
+(修改) 各车辆的累计值按 CHUNK_ROWS 行分块保存，增量更新只复制被修改的分块和部门，
+其余部分与旧索引共享。
+"""
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import date, timedelta
+
+import numpy as np
+
+from granularity import MONTHS_PER_BUCKET, day_bucket, days_in_month, month_bucket, month_label, month_number
+from fixed_point import column_scales, scale_aggregate
+from journal import has_gap, iter_changes, latest_seq
+from partitions import partition_source
+
+# 指标名与接口返回字段保持一致
+METRICS = (
+    'total_distance', 'total_fuel', 'total_fuel_cost', 'fuel_records',
+    'violation_count', 'total_maintenance_cost', 'maintenance_count',
+)
+METRIC_INDEX = {name: i for i, name in enumerate(METRICS)}
+
+
+def _month_sql(column):
+    """时间列 -> 'YYYY-MM'，无法识别时为 NULL。"""
+    return (f"CASE WHEN substr({column}, 1, 7) GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]' "
+            f"AND substr({column}, 1, 4) <> '0000' AND substr({column}, 6, 2) BETWEEN '01' AND '12' "
+            f"THEN substr({column}, 1, 7) END")
+
+
+# 事实表 -> (月份表达式, {指标: 聚合表达式})；各表的指标互不重叠
+SOURCES = {
+    'monthly_fuel_summary': (
+        "CASE WHEN year BETWEEN 1 AND 9999 AND month BETWEEN 1 AND 12 "
+        "THEN printf('%04d-%02d', year, month) END",
+        {
+            'total_distance': 'SUM(distance_driven)',
+            'total_fuel': 'SUM(total_fuel_amount)',
+            'total_fuel_cost': 'SUM(total_fuel_cost)',
+            'fuel_records': 'COUNT(*)',
+        },
+    ),
+    'violations': (
+        _month_sql('violation_time'),
+        {'violation_count': 'COUNT(*)'},
+    ),
+    'maintenance': (
+        _month_sql('request_time'),
+        {
+            'total_maintenance_cost': 'SUM(maintenance_cost)',
+            'maintenance_count': 'COUNT(*)',
+        },
+    ),
+}
+# 各表的记录数指标，用于判断某个桶内是否有记录
+RECORD_COUNTS = {
+    'monthly_fuel_summary': 'fuel_records',
+    'violations': 'violation_count',
+    'maintenance': 'maintenance_count',
+}
+RECORD_COUNT_COLUMNS = [METRIC_INDEX[name] for name in RECORD_COUNTS.values()]
+# 带具体日期的事实表 -> 时间列，这些表另有按天的累计值
+DAILY_SOURCES = {
+    'violations': 'violation_time',
+    'maintenance': 'request_time',
+}
+DAILY_METRICS = tuple(metric for table in DAILY_SOURCES for metric in SOURCES[table][1])
+DAILY_METRIC_INDEX = {name: i for i, name in enumerate(DAILY_METRICS)}
+
+# 单次同步中受影响的单元超过该数量时，全量重建比逐个重算更快
+MAX_INCREMENTAL_CELLS = 2000
+# (新增) 月份轴在最后一个月之后预留的月数
+MONTH_HEADROOM = 24
+# (新增) 车辆累计值每块的行数
+CHUNK_ROWS = 256
+
+
+def to_json_numbers(values):
+    """numpy 数组 -> Python 数值列表；消除累计误差，整数值输出为 int。"""
+    return [int(v) if v.is_integer() else v for v in np.round(values, 6).tolist()]
+
+
+def _metric_columns(table):
+    return [METRIC_INDEX[name] for name in SOURCES[table][1]]
+
+
+def _daily_columns(table):
+    return [DAILY_METRIC_INDEX[name] for name in SOURCES[table][1]]
+
+
+def _month_start_days(first_month, month_count):
+    """月份轴 -> 每个月第一天在日期轴上的下标 (长度 month_count + 1，最后一项为总天数)。"""
+    days = [days_in_month(first_month + i) for i in range(month_count)]
+    return np.concatenate(([0], np.cumsum(days))).astype(np.intp)
+
+
+class PrefixSums:
+    """
+    某一时刻的前缀和索引 (只读)。
+    (修改) 数组沿月份轴从 base_month 开始、共 capacity 个月 (含预留部分)；
+    first_month / month_count 是其中有记录的范围。
+    """
+
+    def __init__(self, seq, vehicle_keys, row_of, row_departments, base_month, capacity, chunks, undated,
+                 department_prefix, department_undated, day_prefix,
+                 fleet_prefix, fleet_undated, fleet_day_prefix):
+        self.seq = seq
+        # 行键: vehicles 表中的车辆，悬空的 vehicle_id 和 None；row_departments 为各行的部门 (悬空的行为 None)
+        self.vehicle_keys = vehicle_keys
+        self.row_of = row_of
+        self.row_departments = row_departments
+        self.base_month = base_month
+        self.capacity = capacity
+        self.chunks = chunks            # [(CHUNK_ROWS, capacity + 1, 指标数)]，第 i 行在 chunks[i // CHUNK_ROWS]
+        self.undated = undated          # (行数, 指标数)
+        # 部门 -> (capacity + 1, 指标数) / (指标数,)；部门按车辆当前所属部门汇总
+        self.department_prefix = department_prefix
+        self.department_undated = department_undated
+        # 按天的累计值: 部门 (不属于任何部门的记录为 None) -> (天数 + 1, DAILY_METRICS)
+        self.day_prefix = day_prefix
+        self.fleet_prefix = fleet_prefix
+        self.fleet_undated = fleet_undated
+        self.fleet_day_prefix = fleet_day_prefix
+        self.department_ids = sorted({d for d in row_departments if d is not None})
+        self.base_day = date(base_month // 12, base_month % 12 + 1, 1)
+        self.month_start_day = _month_start_days(base_month, capacity)
+
+        # 月份轴的实际范围: 第一个到最后一个有记录的月份
+        counts = np.diff(fleet_prefix[:, RECORD_COUNT_COLUMNS].sum(axis=1))
+        present = np.flatnonzero(counts > 0.5)
+        self.lo = int(present[0]) if present.size else 0
+        self.month_count = int(present[-1]) - self.lo + 1 if present.size else 0
+        self.first_month = base_month + self.lo
+
+    @property
+    def months(self):
+        return [month_label(self.first_month + i) for i in range(self.month_count)]
+
+    def window(self, start_month=None, end_month=None):
+        """
+        月份区间 -> (lo, hi, 是否计入无时间的记录)，区间合计为 P[hi] - P[lo]。
+        与各接口一致: 只有同时给出起止月份时才筛选时间。
+        """
+        first, last = self.lo, self.lo + self.month_count
+        if not (start_month and end_month):
+            return first, last, True
+        start, end = month_number(start_month), month_number(end_month)
+        if start is None or end is None or start > end:
+            return first, first, False
+        lo = min(max(start - self.base_month, first), last)
+        hi = min(max(end - self.base_month + 1, first), last)
+        return lo, max(lo, hi), False
+
+    def _range(self, prefix, undated, window):
+        lo, hi, include_undated = window
+        totals = prefix[..., hi, :] - prefix[..., lo, :]
+        return totals + undated if include_undated else totals
+
+    def vehicle_totals(self, vehicle_ids, start_month=None, end_month=None, metrics=METRICS):
+        """返回 (len(vehicle_ids), len(metrics)) 的数组；索引中没有的车辆为 0。"""
+        columns = [METRIC_INDEX[m] for m in metrics]
+        lo, hi, include_undated = self.window(start_month, end_month)
+        rows = np.array([self.row_of.get(vid, -1) for vid in vehicle_ids], dtype=np.intp)
+        result = np.zeros((len(rows), len(METRICS)))
+        found = np.flatnonzero(rows >= 0)
+        chunk_of, offset = np.divmod(rows[found], CHUNK_ROWS)
+        for chunk in np.unique(chunk_of):
+            selected = chunk_of == chunk
+            block = self.chunks[chunk][offset[selected]]
+            result[found[selected]] = block[:, hi] - block[:, lo]
+        if include_undated:
+            result[found] += self.undated[rows[found]]
+        return result[:, columns]
+
+    def department_totals(self, start_month=None, end_month=None, metrics=METRICS):
+        """返回 {department_id: {指标: 值}}，部门按车辆当前所属部门汇总。"""
+        columns = [METRIC_INDEX[m] for m in metrics]
+        window = self.window(start_month, end_month)
+        return {
+            dept_id: dict(zip(metrics, to_json_numbers(
+                self._range(self.department_prefix[dept_id], self.department_undated[dept_id], window)[columns])))
+            for dept_id in self.department_ids
+        }
+
+    def fleet_totals(self, start_month=None, end_month=None, metrics=METRICS):
+        """返回整个车队 (包括未关联车辆的记录) 的 {指标: 值}。"""
+        columns = [METRIC_INDEX[m] for m in metrics]
+        totals = self._range(self.fleet_prefix, self.fleet_undated, self.window(start_month, end_month))
+        return dict(zip(metrics, to_json_numbers(totals[columns])))
+
+    # --- 趋势 ---
+
+    def _month_boundaries(self, granularity):
+        """月份轴上各桶的起点 (按月 / 季 / 年对齐到自然的季度和年份)。"""
+        starts = np.arange(self.capacity + 1)
+        return starts[(self.base_month + starts) % MONTHS_PER_BUCKET[granularity] == 0]
+
+    def _bucket_points(self, granularity, lo, hi, daily):
+        """筛选范围 [lo, hi) (月份下标) 内各桶的起点，末尾附上范围终点；daily 时为日期轴上的下标。"""
+        if daily:
+            lo, hi = self.month_start_day[lo], self.month_start_day[hi]
+            if granularity == 'week':
+                starts = np.arange((7 - self.base_day.weekday()) % 7, hi, 7)
+            else:
+                starts = self.month_start_day[self._month_boundaries(granularity)]
+        else:
+            starts = self._month_boundaries(granularity)
+        if hi <= lo:
+            return np.zeros(0, dtype=np.intp)
+        inner = starts[(starts > lo) & (starts < hi)]
+        return np.concatenate(([lo], inner, [hi])).astype(np.intp)
+
+    def series(self, table, granularity, start_month=None, end_month=None, department_id=None):
+        """
+        按粒度返回某张事实表的趋势: (实际粒度, 标签列表, {指标: 数值列表})。
+        department_id 为 None 时为整个车队；只包含有记录的桶，与原先 GROUP BY 的结果一致。
+        油耗汇总表没有周数据，按周请求时回退为按月。
+        """
+        daily = table in DAILY_SOURCES
+        if not daily and granularity == 'week':
+            granularity = 'month'
+        metrics = list(SOURCES[table][1])
+        empty = (granularity, [], {metric: [] for metric in metrics})
+        if department_id is not None and department_id not in self.department_ids:
+            return empty
+
+        if daily:
+            columns = _daily_columns(table)
+            prefix = self.fleet_day_prefix if department_id is None else self.day_prefix[department_id]
+        else:
+            columns = _metric_columns(table)
+            prefix = self.fleet_prefix if department_id is None else self.department_prefix[department_id]
+        lo, hi, _ = self.window(start_month, end_month)
+        points = self._bucket_points(granularity, lo, hi, daily)
+        if len(points) < 2:
+            return empty
+
+        totals = prefix[points[1:]][:, columns] - prefix[points[:-1]][:, columns]
+        keep = totals[:, metrics.index(RECORD_COUNTS[table])] > 0
+        if daily:
+            labels = [day_bucket(self.base_day + timedelta(days=int(d)), granularity) for d in points[:-1][keep]]
+        else:
+            labels = [month_bucket(self.base_month + int(m), granularity) for m in points[:-1][keep]]
+        return granularity, labels, {metric: to_json_numbers(totals[keep, i]) for i, metric in enumerate(metrics)}
+
+
+def rank_order(values, descending=True, tie_breaker=None):
+    """
+    向量化排名，返回排序后的下标。
+    默认按值排序、值相同时保持输入顺序；给出 tie_breaker 时值相同再按它升序。
+    """
+    values = np.asarray(values)
+    keys = -values if descending else values
+    if tie_breaker is None:
+        return np.argsort(keys, kind='stable')
+    return np.lexsort((np.asarray(tie_breaker), keys))
+
+
+def _aggregate_sql(conn, table):
+    """(新增) 表的各项聚合表达式；定点存储的列求和后换算回原单位 (见 fixed_point.py)。"""
+    scales = column_scales(conn)
+    return ', '.join(scale_aggregate(scales, table, expression) for expression in SOURCES[table][1].values())
+
+
+def _cell_vector(row):
+    """查询结果行 -> 该表负责的各指标值 (NULL 按 0 计)。"""
+    return np.array([value or 0 for value in row], dtype=float)
+
+
+@contextmanager
+def read_snapshot(conn):
+    """(新增) 在一个读事务中读取: 日志位置、车辆所属部门和事实表来自数据库的同一个时刻。"""
+    for table in SOURCES:
+        # ATTACH 不能在事务中执行，先附加归档文件 (见 partitions.py)
+        partition_source(conn, table)
+    if conn.in_transaction:
+        yield
+        return
+    conn.execute('BEGIN')
+    try:
+        yield
+    finally:
+        conn.rollback()
+
+
+def _load_cells(conn):
+    """全量读取所有单元，返回 {(vehicle_id, 月份序号 | None): 指标向量}。"""
+    cells = {}
+    for table, (period_sql, _) in SOURCES.items():
+        columns = _metric_columns(table)
+        rows = conn.execute(f"""
+            SELECT vehicle_id, {period_sql} AS period, {_aggregate_sql(conn, table)}
+            FROM {partition_source(conn, table)}
+            GROUP BY vehicle_id, period
+        """)
+        for row in rows:
+            vector = cells.setdefault((row[0], month_number(row[1])), np.zeros(len(METRICS)))
+            vector[columns] = _cell_vector(row[2:])
+    return cells
+
+
+def _read_days(conn, table, where, params=(), month=None):
+    """
+    按 (vehicle_id, 月份, 日) 汇总带日期的事实表 (只包含月份有效的记录)，
+    产出 (vehicle_id, 月份序号, 当月第几天 (从 0 开始), 指标向量)。
+    日无法识别时按 1 号计，超出当月天数时取最后一天。
+    给出 month (月份序号) 时只读取该月所在年份的分区 (见 partitions.py)。
+    """
+    period_sql = SOURCES[table][0]
+    label = None if month is None else month_label(month)
+    rows = conn.execute(f"""
+        SELECT vehicle_id, {period_sql} AS period, substr({DAILY_SOURCES[table]}, 9, 2) AS day,
+               {_aggregate_sql(conn, table)}
+        FROM {partition_source(conn, table, label, label)}
+        WHERE ({period_sql}) IS NOT NULL AND {where}
+        GROUP BY vehicle_id, period, day
+    """, params)
+    for row in rows:
+        month = month_number(row[1])
+        day = int(row[2]) if row[2] and row[2].isdigit() else 1
+        yield row[0], month, min(max(day, 1), days_in_month(month)) - 1, _cell_vector(row[3:])
+
+
+def build(conn):
+    """从数据库全量构建索引。"""
+    with read_snapshot(conn):
+        seq = latest_seq(conn)
+        vehicles = conn.execute('SELECT vehicle_id, department_id FROM vehicles ORDER BY vehicle_id').fetchall()
+        cells = _load_cells(conn)
+
+        known = [row[0] for row in vehicles]
+        known_set = set(known)
+        dangling = sorted({vid for vid, _ in cells if vid is not None and vid not in known_set})
+        vehicle_keys = known + dangling + [None]
+        row_of = {key: i for i, key in enumerate(vehicle_keys)}
+        row_departments = [row[1] for row in vehicles] + [None] * (len(dangling) + 1)
+
+        months = [m for _, m in cells if m is not None]
+        # 还没有记录时从本月开始，之后写入的新数据可以直接增量更新
+        base_month = min(months) if months else month_number(date.today().strftime('%Y-%m'))
+        capacity = (max(months) - base_month + 1 if months else 0) + MONTH_HEADROOM
+
+        # 行数补齐到 CHUNK_ROWS 的整数倍，先按月填入各单元，再就地累加
+        prefix = np.zeros((-(-len(vehicle_keys) // CHUNK_ROWS) * CHUNK_ROWS, capacity + 1, len(METRICS)))
+        undated = np.zeros((len(vehicle_keys), len(METRICS)))
+        for (vid, month), vector in cells.items():
+            if month is None:
+                undated[row_of[vid]] = vector
+            else:
+                prefix[row_of[vid], month - base_month + 1] = vector
+        np.cumsum(prefix[:, 1:], axis=1, out=prefix[:, 1:])
+
+        departments = np.full(len(prefix), -1)
+        departments[:len(row_departments)] = [-1 if d is None else d for d in row_departments]
+        department_ids = sorted({d for d in row_departments if d is not None})
+        department_prefix = {d: prefix[departments == d].sum(axis=0) for d in department_ids}
+        department_undated = {d: undated[departments[:len(undated)] == d].sum(axis=0) for d in department_ids}
+
+        # 按天的累计值按部门分组，不属于任何部门的记录为 None 组
+        group_of = {row[0]: row[1] for row in vehicles}
+        month_start_day = _month_start_days(base_month, capacity)
+        daily = {group: np.zeros((month_start_day[-1], len(DAILY_METRICS))) for group in department_ids + [None]}
+        for table in DAILY_SOURCES:
+            columns = _daily_columns(table)
+            for vid, month, day, vector in _read_days(conn, table, '1'):
+                offset = month_start_day[month - base_month] + day
+                daily[group_of.get(vid)][offset, columns] += vector
+    day_prefix = {}
+    for group, days in daily.items():
+        day_prefix[group] = np.zeros((len(days) + 1, len(DAILY_METRICS)))
+        np.cumsum(days, axis=0, out=day_prefix[group][1:])
+    return PrefixSums(seq, vehicle_keys, row_of, row_departments, base_month, capacity,
+                      [prefix[i:i + CHUNK_ROWS] for i in range(0, len(prefix), CHUNK_ROWS)], undated, department_prefix, department_undated, day_prefix,
+                      prefix.sum(axis=0), undated.sum(axis=0), sum(day_prefix.values()))
+
+
+def _read_cell(conn, table, vehicle_id, month):
+    period_sql = SOURCES[table][0]
+    label = None if month is None else month_label(month)
+    row = conn.execute(f"""
+        SELECT {_aggregate_sql(conn, table)}
+        FROM {partition_source(conn, table, label, label)}
+        WHERE vehicle_id IS ? AND ({period_sql}) IS ?
+    """, (vehicle_id, label)).fetchone()
+    return _cell_vector(row)
+
+
+def _read_group_month(conn, table, department, month):
+    """重新读取某个部门 (None 为不属于任何部门的记录) 在某个月每天的数据，返回 (当月天数, 该表指标数) 的数组。"""
+    if department is not None:
+        where = "vehicle_id IN (SELECT vehicle_id FROM vehicles WHERE department_id = ?)"
+        params = [department]
+    else:
+        where = "(vehicle_id IS NULL OR vehicle_id NOT IN (SELECT vehicle_id FROM vehicles WHERE department_id IS NOT NULL))"
+        params = []
+    label = month_label(month)
+    # 时间列的前缀条件可以使用 (vehicle_id, 时间) 索引，只扫描该月的记录
+    days = np.zeros((days_in_month(month), len(SOURCES[table][1])))
+    for _, _, day, vector in _read_days(conn, table, f"{where} AND {DAILY_SOURCES[table]} GLOB ? "
+                                                     f"AND ({SOURCES[table][0]}) = ?",
+                                        params + [f'{label}*', label], month):
+        days[day] += vector
+    return days
+
+
+def _current_department(conn, vehicle_id):
+    """车辆当前所属的部门；车辆不存在或未分配部门时为 None。"""
+    row = conn.execute('SELECT department_id FROM vehicles WHERE vehicle_id = ?', (vehicle_id,)).fetchone()
+    return row[0] if row else None
+
+
+def _affected(changes):
+    """
+    变更 -> (受影响的 (表, vehicle_id, 月份序号) 集合, 新增、删除或调整部门的车辆集合)；
+    需要全量重建时返回 None。车辆其他信息的修改 (op = 'update') 不影响索引。
+    """
+    cells, vehicles = set(), set()
+    for change in changes:
+        table, op = change['table_name'], change['op']
+        if op == 'reload':
+            return None
+        if table == 'vehicles':
+            if op in ('update', 'move') and change['old_vehicle_id'] != change['new_vehicle_id']:
+                return None
+            if op == 'update':
+                continue
+            vehicles.add(change['old_vehicle_id'] if op == 'delete' else change['new_vehicle_id'])
+        elif table in SOURCES:
+            sides = {'insert': ('new',), 'delete': ('old',)}.get(op, ('old', 'new'))
+            for side in sides:
+                cells.add((table, change[f'{side}_vehicle_id'], month_number(change[f'{side}_period'])))
+        if len(cells) + len(vehicles) > MAX_INCREMENTAL_CELLS:
+            return None
+    return cells, vehicles
+
+
+class _Update:
+    """
+    (新增) 在旧索引上做增量修改 (写时复制): 第一次修改某个分块、部门或行信息时才复制它，
+    其余数组与旧索引共享，旧索引保持不变。
+    """
+
+    def __init__(self, index):
+        self.index = index
+        self.vehicle_keys = index.vehicle_keys
+        self.row_of = index.row_of
+        self.row_departments = index.row_departments
+        self.undated = index.undated
+        self.chunks = list(index.chunks)
+        self.department_prefix = dict(index.department_prefix)
+        self.department_undated = dict(index.department_undated)
+        self.day_prefix = dict(index.day_prefix)
+        self.fleet_prefix = index.fleet_prefix.copy()
+        self.fleet_undated = index.fleet_undated.copy()
+        self.fleet_day_prefix = index.fleet_day_prefix.copy()
+        self._copied = set()
+
+    def _writable(self, store, key):
+        if (id(store), key) not in self._copied:
+            store[key] = store[key].copy()
+            self._copied.add((id(store), key))
+        return store[key]
+
+    def _own_rows(self):
+        if 'rows' not in self._copied:
+            self.vehicle_keys = list(self.vehicle_keys)
+            self.row_of = dict(self.row_of)
+            self.row_departments = list(self.row_departments)
+            self.undated = self.undated.copy()
+            self._copied.add('rows')
+
+    def _department(self, department):
+        """部门的 (累计值, 无时间记录合计, 按天累计值)，不存在时新建。"""
+        if department not in self.department_prefix:
+            index = self.index
+            self.department_prefix[department] = np.zeros((index.capacity + 1, len(METRICS)))
+            self.department_undated[department] = np.zeros(len(METRICS))
+            self._copied.update({(id(self.department_prefix), department), (id(self.department_undated), department)})
+        if department not in self.day_prefix:
+            self.day_prefix[department] = np.zeros_like(self.fleet_day_prefix)
+            self._copied.add((id(self.day_prefix), department))
+        return (self._writable(self.department_prefix, department),
+                self._writable(self.department_undated, department),
+                self._writable(self.day_prefix, department))
+
+    def department_of(self, vehicle_id):
+        row = self.row_of.get(vehicle_id)
+        return None if row is None else self.row_departments[row]
+
+    def add_row(self, vehicle_id, department):
+        """新车辆或新出现的悬空 vehicle_id: 追加一行 (累计值为 0)。"""
+        self._own_rows()
+        row = len(self.vehicle_keys)
+        self.vehicle_keys.append(vehicle_id)
+        self.row_of[vehicle_id] = row
+        self.row_departments.append(department)
+        self.undated = np.concatenate((self.undated, np.zeros((1, len(METRICS)))))
+        if row // CHUNK_ROWS == len(self.chunks):
+            self.chunks.append(np.zeros((CHUNK_ROWS, self.index.capacity + 1, len(METRICS))))
+            self._copied.add((id(self.chunks), len(self.chunks) - 1))
+        if department is not None:
+            self._department(department)
+        return row
+
+    def move(self, conn, vehicle_id, department):
+        """车辆调整部门 (删除车辆时 department 为 None): 把该行的累计值和按天的数据从原部门移到新部门。"""
+        row = self.row_of[vehicle_id]
+        previous = self.row_departments[row]
+        if previous == department:
+            return previous
+        self._own_rows()
+        self.row_departments[row] = department
+        prefix = self.chunks[row // CHUNK_ROWS][row % CHUNK_ROWS]
+        days = np.zeros_like(self.fleet_day_prefix)
+        for table in DAILY_SOURCES:
+            columns = _daily_columns(table)
+            for _, month, day, vector in _read_days(conn, table, 'vehicle_id = ?', [vehicle_id]):
+                offset = month - self.index.base_month
+                if 0 <= offset < self.index.capacity:
+                    days[self.index.month_start_day[offset] + day + 1, columns] += vector
+        np.cumsum(days, axis=0, out=days)
+        for group, sign in ((previous, -1), (department, 1)):
+            if group is None:
+                self._writable(self.day_prefix, None)[:] += sign * days
+                continue
+            department_prefix, department_undated, day_prefix = self._department(group)
+            department_prefix += sign * prefix
+            department_undated += sign * self.undated[row]
+            day_prefix += sign * days
+        return previous
+
+    def apply_cell(self, conn, table, vehicle_id, month):
+        """重新查询一个单元，把与旧值的差加到该车辆、所属部门和车队的累计值上。"""
+        row = self.row_of.get(vehicle_id)
+        if row is None:
+            row = self.add_row(vehicle_id, None if vehicle_id is None else _current_department(conn, vehicle_id))
+        department = self.row_departments[row]
+        columns = _metric_columns(table)
+        current = _read_cell(conn, table, vehicle_id, month)
+        if month is None:
+            self._own_rows()
+            delta = current - self.undated[row, columns]
+            self.undated[row, columns] = current
+            self.fleet_undated[columns] += delta
+            if department is not None:
+                self._department(department)[1][columns] += delta
+            return
+        offset = month - self.index.base_month
+        chunk = self.chunks[row // CHUNK_ROWS]
+        cell = row % CHUNK_ROWS
+        delta = current - (chunk[cell, offset + 1, columns] - chunk[cell, offset, columns])
+        if not delta.any():
+            return
+        chunk = self._writable(self.chunks, row // CHUNK_ROWS)
+        chunk[cell, offset + 1:][:, columns] += delta
+        self.fleet_prefix[offset + 1:][:, columns] += delta
+        if department is not None:
+            self._department(department)[0][offset + 1:][:, columns] += delta
+
+    def apply_group_month(self, conn, table, department, month):
+        """带日期的表: 重新读取部门分组当月每天的数据，以差值更新按天的累计值。"""
+        columns = _daily_columns(table)
+        start = self.index.month_start_day[month - self.index.base_month]
+        end = start + days_in_month(month)
+        day_prefix = self._writable(self.day_prefix, department) if department is None \
+            else self._department(department)[2]
+        current = _read_group_month(conn, table, department, month)
+        previous = np.diff(day_prefix[start:end + 1][:, columns], axis=0)
+        change = np.cumsum(current - previous, axis=0)
+        for prefix in (day_prefix, self.fleet_day_prefix):
+            prefix[start + 1:end + 1][:, columns] += change
+            prefix[end + 1:][:, columns] += change[-1]
+
+    def freeze(self, seq):
+        return PrefixSums(seq, self.vehicle_keys, self.row_of, self.row_departments,
+                          self.index.base_month, self.index.capacity, self.chunks, self.undated,
+                          self.department_prefix, self.department_undated, self.day_prefix,
+                          self.fleet_prefix, self.fleet_undated, self.fleet_day_prefix)
+
+
+def apply_changes(conn, index, seq, changes):
+    """
+    (修改) 按变更增量更新，返回 seq 时刻的新索引；需要全量重建时返回 None。
+    先处理车辆的新增、删除和部门调整 (部门以数据库中的当前值为准)，再重算受影响的单元:
+    每个单元重新查询一次，与索引中的旧值相减得到差值，加到该月及之后的累计值上；
+    带日期的表再按 (部门, 月份) 重新读取当月每天的数据，同样以差值更新按天的累计值。
+    调用方需在读事务中调用 (见 read_snapshot)，保证部门和事实表来自同一时刻。
+    """
+    affected = _affected(changes)
+    if affected is None:
+        return None
+    cells, vehicles = affected
+    for _, _, month in cells:
+        if month is not None and not 0 <= month - index.base_month < index.capacity:
+            return None
+
+    update = _Update(index)
+    moved = {}
+    for vid in vehicles:
+        department = _current_department(conn, vid)
+        if vid not in update.row_of:
+            if department is not None:
+                update.add_row(vid, department)
+        else:
+            previous = update.move(conn, vid, department)
+            if previous != department:
+                moved[vid] = previous
+
+    group_months = set()
+    for table, vid, month in cells:
+        update.apply_cell(conn, table, vid, month)
+        if table in DAILY_SOURCES and month is not None:
+            # 同一个月内改动日期不会改变月合计，但会改变按天的分布，因此总是重读；
+            # 同一批中调整过部门的车辆，原部门的该月也要重读
+            group_months.add((table, update.department_of(vid), month))
+            if vid in moved:
+                group_months.add((table, moved[vid], month))
+    for table, department, month in group_months:
+        update.apply_group_month(conn, table, department, month)
+    return update.freeze(seq)
+
+
+def database_file(conn):
+    """连接的主数据库文件路径；内存数据库为空字符串。"""
+    for row in conn.execute('PRAGMA database_list'):
+        if row[1] == 'main':
+            return row[2]
+    return ''
+
+
+class RangeIndex:
+    """
+    进程内共享的前缀和索引。每次读取前调用 sync(conn):
+    日志没有新记录时只多一次 MAX(seq) 查询，否则增量更新。
+    (修改) 需要全量重建时在后台线程中重建，期间返回旧索引 (rebuilding 为真，调用方不应缓存结果)。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._index = None
+        self._rebuild_thread = None
+        self.last_error = None
+
+    @property
+    def rebuilding(self):
+        thread = self._rebuild_thread
+        return thread is not None and thread.is_alive()
+
+    def sync(self, conn, block=False):
+        """返回与数据库同步的索引；block 为真时需要重建也在当前线程完成 (preload 时使用)。"""
+        seq = latest_seq(conn)
+        index = self._index
+        if index is not None and index.seq == seq:
+            return index
+        with self._lock:
+            index = self._index
+            if index is None:
+                # 首次使用: 没有可以返回的旧索引，只能同步构建
+                index = self._index = build(conn)
+            elif index.seq != seq and (block or not self.rebuilding):
+                updated = self._update(conn, index)
+                if updated is None and (block or not database_file(conn)):
+                    updated = build(conn)
+                if updated is None:
+                    self._start_rebuild(database_file(conn))
+                else:
+                    index = self._index = updated
+            return index
+
+    def _update(self, conn, index):
+        with read_snapshot(conn):
+            seq = latest_seq(conn)
+            if seq == index.seq:
+                return index
+            if seq < index.seq or has_gap(conn, index.seq):
+                # 日志被重建 (seq 变小)，或需要的记录已被清理
+                return None
+            return apply_changes(conn, index, seq, self._read_changes(conn, index.seq, seq))
+
+    def _start_rebuild(self, db_file):
+        thread = threading.Thread(target=self._rebuild, args=(db_file,), name='range-index-rebuild', daemon=True)
+        self._rebuild_thread = thread
+        thread.start()
+
+    def _rebuild(self, db_file):
+        """后台线程: 用独立的连接全量构建，完成后替换索引；之后的变更由下一次 sync 增量追上。"""
+        try:
+            conn = sqlite3.connect(db_file, timeout=30)
+            try:
+                index = build(conn)
+            finally:
+                conn.close()
+        except (OSError, sqlite3.Error) as e:
+            self.last_error = str(e)
+            return
+        with self._lock:
+            if self._index is None or index.seq >= self._index.seq:
+                self._index = index
+            self.last_error = None
+
+    @staticmethod
+    def _read_changes(conn, since, until):
+        """读取 (since, until] 之间的变更，数量明显超过增量上限时提前停止 (之后会全量重建)。"""
+        changes = []
+        for batch in iter_changes(conn, since):
+            changes.extend(change for change in batch if change['seq'] <= until)
+            if batch[-1]['seq'] >= until or len(changes) > MAX_INCREMENTAL_CELLS * 2:
+                break
+        return changes
+
+    def invalidate(self):
+        with self._lock:
+            self._index = None
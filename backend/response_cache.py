@@ -0,0 +1,75 @@
+"""
+汇总类 GET 接口的进程内响应缓存。
+
+键为 (路径, 规范化后的查询参数)，值为 JSON 响应体，并记录计算时的数据版本:
+    数据版本 = (变更日志的最大 seq, 字典表版本号)
+事实表、车辆表的写入由触发器记入变更日志 (见 journal.py)，字典表的写入递增
+cache_versions 中的版本号 (见 dict_cache.py)，因此任何进程的写入都会使旧的缓存项失效。
+读取时只需一次很小的查询取得当前版本。
+
+缓存按 LRU 淘汰；版本不一致的缓存项在读取时丢弃。
+"""
+import sqlite3
+import threading
+from collections import OrderedDict
+
+DEFAULT_MAX_ENTRIES = 512
+
+
+def data_version(conn):
+    """当前数据版本 (seq, 字典表版本)；尚未执行 migrations 时返回 None (不缓存)。"""
+    try:
+        row = conn.execute("""
+            SELECT (SELECT MAX(seq) FROM change_journal),
+                   (SELECT version FROM cache_versions WHERE name = 'dictionary')
+        """).fetchone()
+    except sqlite3.OperationalError:
+        return None
+    return row[0] or 0, row[1] or 0
+
+
+def request_key(path, args):
+    """
+    (路径, 查询参数) -> 缓存键。参数按名称排序，空值视为未提供
+    (各接口对空字符串和缺省参数的处理相同)，因此参数顺序不同的同一请求共用一个缓存项。
+    """
+    return path, tuple(sorted((name, value) for name, value in args.items(multi=True) if value != ''))
+
+
+class ResponseCache:
+    """线程安全的 LRU 缓存: key -> (数据版本, 响应体)。"""
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, version):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != version:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, version, body):
+        with self._lock:
+            self._entries[key] = (version, body)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'max_entries': self.max_entries,
+                    'hits': self.hits, 'misses': self.misses}
@@ -0,0 +1,397 @@
+"""
+汇总接口的近似查询模式 (approx=true): 按 (部门, 月份) 分层抽样，返回估计值和置信区间。
+
+每张事实表按 "车辆当前所属部门 × 记录月份" 分层，每层随机保留至多 SAMPLE_PER_STRATUM 行，
+只保存每层的总行数 N、样本数 n 以及样本值的和与平方和。对任意月份区间和部门，
+金额、里程等合计用分层估计量:
+    估计值 = Σ N_h · 样本均值_h
+    方差   = Σ N_h² · (1 - n_h / N_h) · s_h² / n_h
+置信区间为 估计值 ± Z · sqrt(方差)。行数不超过 SAMPLE_PER_STRATUM 的层全部保留，
+其结果是精确的 (方差为 0)；记录数类指标直接取各层的 N，也是精确的。
+
+查询只在层的数组上计算，与记录总数无关。
+(修改) 构建时对每张表做一次分组聚合得到各层的行数，行数不超过 SAMPLE_PER_STRATUM 的层
+直接使用聚合结果；更大的层再单独用 ORDER BY random() LIMIT 抽样，不再对整张表排序。
+首次构建在后台线程中进行，完成之前近似请求改用精确结果 (approximate 为 false)。
+(修改) 数据变化后按变更日志 (见 journal.py) 增量维护: 只重新抽样受影响的层
+(写入记录所在的 部门 × 月份，以及调整部门的车辆涉及的各层)，样本与数据库保持同步；
+整表重新导入或受影响的层过多时在后台重建，期间继续使用旧样本。
+返回结果中的 sample.as_of_seq 给出样本对应的数据版本。
+"""
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+from fixed_point import column_scales, value_sql
+from granularity import month_bucket, month_label, month_number
+from journal import has_gap, iter_changes, latest_seq
+from partitions import partition_source
+from range_index import DAILY_SOURCES, RECORD_COUNTS, SOURCES, database_file, read_snapshot, to_json_numbers
+
+SAMPLE_PER_STRATUM = 64
+# 单次同步中需要重新抽样的层超过该数量时改为后台重建
+MAX_INCREMENTAL_STRATA = 500
+CONFIDENCE = 0.95
+Z_SCORE = 1.959964
+
+# 事实表 -> {指标: 被抽样的列}；记录数指标不需要抽样 (见 RECORD_COUNTS)
+SAMPLED_COLUMNS = {
+    'monthly_fuel_summary': {
+        'total_distance': 'distance_driven',
+        'total_fuel': 'total_fuel_amount',
+        'total_fuel_cost': 'total_fuel_cost',
+    },
+    'violations': {},
+    'maintenance': {'total_maintenance_cost': 'maintenance_cost'},
+}
+# 指标 -> 事实表
+METRIC_TABLES = {metric: table for table, (_, aggregates) in SOURCES.items() for metric in aggregates}
+
+
+def _sample_values(conn, table):
+    """被抽样各列的 SQL 表达式 (v0, v1, ...) 和对应的 和 / 平方和 聚合表达式。"""
+    # (修改) 定点存储的列换算回原单位后再抽样 (见 fixed_point.py)
+    scales = column_scales(conn)
+    columns = list(SAMPLED_COLUMNS[table].values())
+    values = ', '.join(f"COALESCE({value_sql(scales, table, column, 't')}, 0) AS v{i}" for i, column in enumerate(columns))
+    moments = ', '.join(f"SUM(v{i}), SUM(v{i} * v{i})" for i in range(len(columns)))
+    return values, moments
+
+
+def _stratum_filter(table, department, period):
+    """
+    某一层的 WHERE 条件和参数。部门按车辆当前所属部门，None 为不属于任何部门的记录；
+    period 为 'YYYY-MM' 或 None (无时间的记录)。有月份时附加时间列的条件，以便使用 (vehicle_id, 时间) 索引。
+    """
+    if department is None:
+        clauses = ["(t.vehicle_id IS NULL OR t.vehicle_id NOT IN "
+                   "(SELECT vehicle_id FROM vehicles WHERE department_id IS NOT NULL))"]
+        params = []
+    else:
+        clauses = ["t.vehicle_id IN (SELECT vehicle_id FROM vehicles WHERE department_id = ?)"]
+        params = [department]
+    if period is not None and table in DAILY_SOURCES:
+        clauses.append(f"t.{DAILY_SOURCES[table]} GLOB ?")
+        params.append(f'{period}*')
+    elif period is not None:
+        clauses.append("t.year = ? AND t.month = ?")
+        params.extend((int(period[:4]), int(period[5:])))
+    clauses.append(f"({SOURCES[table][0]}) IS ?")
+    params.append(period)
+    return ' AND '.join(clauses), params
+
+
+def _read_stratum(conn, table, department, period, per_stratum):
+    """重新抽样一层，返回与 _read_strata 相同格式的一行；该层已没有记录时返回 None。"""
+    source = partition_source(conn, table, period, period)
+    where, params = _stratum_filter(table, department, period)
+    if not SAMPLED_COLUMNS[table]:
+        count = conn.execute(f"SELECT COUNT(*) FROM {source} t WHERE {where}", params).fetchone()[0]
+        return (department, period, count, count) if count else None
+    values, moments = _sample_values(conn, table)
+    row = conn.execute(f"""
+        SELECT (SELECT COUNT(*) FROM {source} t WHERE {where}), COUNT(*), {moments}
+        FROM (SELECT {values} FROM {source} t WHERE {where} ORDER BY random() LIMIT ?)
+    """, params + params + [per_stratum]).fetchone()
+    return (department, period) + tuple(row) if row[0] else None
+
+
+def _read_strata(conn, table, per_stratum):
+    """
+    每层一行: (department_id, 'YYYY-MM' 或 None, N, n, sum_1, sumsq_1, sum_2, sumsq_2, ...)。
+    (修改) 一次分组聚合得到各层的行数以及全部行的和与平方和；行数不超过 per_stratum 的层
+    即为全部保留，更大的层再单独抽样 (LIMIT 只保留 per_stratum 行，不对整张表排序)。
+    """
+    period_sql = SOURCES[table][0]
+    source = partition_source(conn, table)
+    if not SAMPLED_COLUMNS[table]:
+        return conn.execute(f"""
+            SELECT v.department_id, {period_sql} AS period, COUNT(*), COUNT(*)
+            FROM {source} t
+            LEFT JOIN vehicles v ON v.vehicle_id = t.vehicle_id
+            GROUP BY v.department_id, period
+        """).fetchall()
+    values, moments = _sample_values(conn, table)
+    rows = conn.execute(f"""
+        SELECT department_id, period, COUNT(*), COUNT(*), {moments}
+        FROM (
+            SELECT v.department_id, {period_sql} AS period, {values}
+            FROM {source} t
+            LEFT JOIN vehicles v ON v.vehicle_id = t.vehicle_id
+        )
+        GROUP BY department_id, period
+    """).fetchall()
+    return [tuple(row) if row[2] <= per_stratum else _read_stratum(conn, table, row[0], row[1], per_stratum)
+            for row in rows]
+
+
+class StrataTable:
+    """一张事实表的分层样本 (只读)。"""
+
+    def __init__(self, table, rows):
+        self.table = table
+        self.metrics = list(SAMPLED_COLUMNS[table])
+        # (部门, 月份) -> 该层的一行，增量更新时按层替换
+        self.rows = {(row[0], row[1]): row for row in rows}
+        self.departments = [row[0] for row in rows]
+        months = [month_number(row[1]) for row in rows]
+        self.months = np.array([-1 if m is None else m for m in months], dtype=np.int64)
+        self.population = np.array([row[2] for row in rows], dtype=float)
+        self.sampled = np.array([row[3] for row in rows], dtype=float)
+        moments = np.array([row[4:] for row in rows], dtype=float).reshape(len(rows), 2 * len(self.metrics))
+        sums, sumsqs = moments[:, 0::2], moments[:, 1::2]
+
+        n = self.sampled[:, None]
+        N = self.population[:, None]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean = np.where(n > 0, sums / n, 0.0)
+            variance = np.where(n > 1, (sumsqs - n * mean ** 2) / (n - 1), 0.0)
+            # 每层总体合计的估计值及其方差 (含有限总体校正，全部保留的层方差为 0)
+            self.estimates = N * mean
+            self.variances = np.where(n > 0, N ** 2 * (1 - n / N) * np.maximum(variance, 0.0) / n, 0.0)
+
+    def replace(self, strata):
+        """返回替换了部分层的新对象；strata 为 {(部门, 月份): 新的一行或 None (该层已没有记录)}。"""
+        rows = dict(self.rows)
+        for key, row in strata.items():
+            if row is None:
+                rows.pop(key, None)
+            else:
+                rows[key] = row
+        return StrataTable(self.table, list(rows.values()))
+
+    def mask(self, start_month=None, end_month=None, department_id=None):
+        """选出落在月份区间 (同时给出起止月份时才筛选) 和部门内的层。"""
+        selected = np.ones(len(self.months), dtype=bool)
+        if start_month and end_month:
+            start, end = month_number(start_month), month_number(end_month)
+            if start is None or end is None:
+                return np.zeros(len(self.months), dtype=bool)
+            selected &= (self.months >= start) & (self.months <= end)
+        if department_id is not None:
+            selected &= np.array([d == department_id for d in self.departments], dtype=bool)
+        return selected
+
+    def totals(self, selected):
+        """所选层的 (估计值, 方差)，按 [记录数指标] + 抽样指标 的顺序。"""
+        count = self.population[selected].sum()
+        return (np.concatenate(([count], self.estimates[selected].sum(axis=0))),
+                np.concatenate(([0.0], self.variances[selected].sum(axis=0))))
+
+
+def interval(estimate, variance):
+    """估计值和方差 -> {'estimate', 'low', 'high', 'margin'}。"""
+    margin = Z_SCORE * float(np.sqrt(variance))
+    estimate, low, high, margin = to_json_numbers(np.array([estimate, estimate - margin, estimate + margin, margin]))
+    return {'estimate': estimate, 'low': low, 'high': high, 'margin': margin}
+
+
+class StratifiedSample:
+    """某一时刻各事实表的分层样本 (只读)。"""
+
+    def __init__(self, seq, tables, built_at, departments):
+        self.seq = seq
+        self.tables = tables
+        self.built_at = built_at
+        # 抽样时各车辆所属的部门，用于发现调整部门的车辆
+        self.departments = departments
+
+    def _metric_values(self, table, selected):
+        strata = self.tables[table]
+        estimates, variances = strata.totals(selected)
+        names = [RECORD_COUNTS[table]] + strata.metrics
+        return {name: (estimates[i], variances[i]) for i, name in enumerate(names)}
+
+    def totals(self, metrics, start_month=None, end_month=None, department_id=None):
+        """返回 {指标: {'estimate', 'low', 'high', 'margin'}}；department_id 为 None 时为整个车队。"""
+        result = {}
+        for table in dict.fromkeys(METRIC_TABLES[m] for m in metrics):
+            strata = self.tables[table]
+            values = self._metric_values(table, strata.mask(start_month, end_month, department_id))
+            result.update((m, interval(*values[m])) for m in metrics if m in values)
+        return result
+
+    def department_totals(self, metrics, start_month=None, end_month=None):
+        """返回 {department_id: {指标: 区间}}，只包含有记录的部门。"""
+        departments = set()
+        for table in dict.fromkeys(METRIC_TABLES[m] for m in metrics):
+            departments.update(d for d in self.tables[table].departments if d is not None)
+        return {dept: self.totals(metrics, start_month, end_month, dept) for dept in departments}
+
+    def series(self, table, granularity, start_month=None, end_month=None, department_id=None):
+        """
+        按粒度返回趋势: (实际粒度, 标签列表, {指标: 估计值列表}, {指标: 误差幅度列表})。
+        样本只区分到月份，按周请求时回退为按月；无时间的记录不计入趋势。
+        """
+        if granularity == 'week':
+            granularity = 'month'
+        strata = self.tables[table]
+        selected = strata.mask(start_month, end_month, department_id) & (strata.months >= 0)
+        buckets = {}
+        for i in np.flatnonzero(selected):
+            buckets.setdefault(month_bucket(int(strata.months[i]), granularity), []).append(i)
+        labels = sorted(buckets)
+        names = [RECORD_COUNTS[table]] + strata.metrics
+        estimates, margins = {name: [] for name in names}, {name: [] for name in names}
+        for label in labels:
+            rows = np.zeros(len(strata.months), dtype=bool)
+            rows[buckets[label]] = True
+            for name, (estimate, variance) in self._metric_values(table, rows).items():
+                ci = interval(estimate, variance)
+                estimates[name].append(ci['estimate'])
+                margins[name].append(ci['margin'])
+        return granularity, labels, estimates, margins
+
+    def describe(self):
+        """样本的基本信息，随近似结果一起返回。"""
+        return {
+            'as_of_seq': self.seq,
+            'built_at': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.built_at)),
+            'confidence': CONFIDENCE,
+            'strata': sum(len(strata.months) for strata in self.tables.values()),
+            'sampled_rows': int(sum(strata.sampled.sum() for strata in self.tables.values())),
+            'population_rows': int(sum(strata.population.sum() for strata in self.tables.values())),
+        }
+
+
+def _vehicle_departments(conn):
+    return dict(conn.execute('SELECT vehicle_id, department_id FROM vehicles').fetchall())
+
+
+def build(conn, per_stratum=SAMPLE_PER_STRATUM):
+    """扫描各事实表，重新抽样。"""
+    with read_snapshot(conn):
+        seq = latest_seq(conn)
+        departments = _vehicle_departments(conn)
+        tables = {table: StrataTable(table, _read_strata(conn, table, per_stratum)) for table in SAMPLED_COLUMNS}
+    return StratifiedSample(seq, tables, time.time(), departments)
+
+
+def _period(value):
+    """日志中的月份 -> 与分层相同的 'YYYY-MM'，无法识别时为 None。"""
+    month = month_number(value)
+    return None if month is None else month_label(month)
+
+
+def apply_changes(conn, sample, seq, changes, per_stratum=SAMPLE_PER_STRATUM):
+    """
+    按变更重新抽样受影响的层，返回 seq 时刻的新样本；需要全量重建时返回 None。
+    受影响的层: 写入记录在修改前后所属的 (部门, 月份)，部门取车辆在抽样时和当前的所属部门；
+    调整部门 (以及新增、删除) 的车辆在原部门和新部门中有记录的各层。
+    """
+    strata = set()
+    for change in changes:
+        table, op = change['table_name'], change['op']
+        if op == 'reload':
+            return None
+        if table == 'vehicles':
+            if change['old_vehicle_id'] != change['new_vehicle_id'] and op in ('update', 'move'):
+                return None
+            continue
+        if table not in SAMPLED_COLUMNS:
+            continue
+        sides = {'insert': ('new',), 'delete': ('old',)}.get(op, ('old', 'new'))
+        for side in sides:
+            strata.add((table, change[f'{side}_vehicle_id'], _period(change[f'{side}_period'])))
+        if len(strata) > MAX_INCREMENTAL_STRATA:
+            return None
+
+    departments = _vehicle_departments(conn)
+    moved = {vid for vid in set(departments) | set(sample.departments)
+             if departments.get(vid) != sample.departments.get(vid)}
+    for vid in moved:
+        for table in SAMPLED_COLUMNS:
+            source = partition_source(conn, table)
+            for (period,) in conn.execute(f"SELECT DISTINCT {SOURCES[table][0]} FROM {source} t "
+                                          f"WHERE t.vehicle_id = ?", (vid,)):
+                strata.add((table, vid, period))
+        if len(strata) > MAX_INCREMENTAL_STRATA:
+            return None
+
+    affected = {}
+    for table, vid, period in strata:
+        for department in {sample.departments.get(vid), departments.get(vid)}:
+            affected.setdefault(table, set()).add((department, period))
+    tables = dict(sample.tables)
+    for table, keys in affected.items():
+        tables[table] = tables[table].replace(
+            {key: _read_stratum(conn, table, key[0], key[1], per_stratum) for key in keys})
+    return StratifiedSample(seq, tables, time.time(), departments)
+
+
+class SampleStore:
+    """
+    进程内共享的分层样本。sync(conn) 按变更日志增量更新样本。
+    首次使用和需要全量重建时在后台线程中构建，期间返回旧样本 (首次为 None)。
+    """
+
+    def __init__(self, per_stratum=SAMPLE_PER_STRATUM):
+        self.per_stratum = per_stratum
+        self._lock = threading.Lock()
+        self._sample = None
+        self._build_thread = None
+        self.last_error = None
+
+    @property
+    def building(self):
+        thread = self._build_thread
+        return thread is not None and thread.is_alive()
+
+    def sync(self, conn):
+        """返回与数据库同步的样本；还没有样本 (正在后台构建) 时返回 None。"""
+        seq = latest_seq(conn)
+        sample = self._sample
+        if sample is not None and sample.seq == seq:
+            return sample
+        with self._lock:
+            sample = self._sample
+            if self.building or (sample is not None and sample.seq == seq):
+                return sample
+            updated = self._update(conn, sample) if sample is not None else None
+            if updated is None and not database_file(conn):
+                updated = build(conn, self.per_stratum)
+            if updated is None:
+                self._start_build(database_file(conn))
+            else:
+                sample = self._sample = updated
+            return sample
+
+    def _update(self, conn, sample):
+        with read_snapshot(conn):
+            seq = latest_seq(conn)
+            if seq == sample.seq:
+                return sample
+            if seq < sample.seq or has_gap(conn, sample.seq):
+                return None
+            changes = []
+            for batch in iter_changes(conn, sample.seq):
+                changes.extend(change for change in batch if change['seq'] <= seq)
+                if batch[-1]['seq'] >= seq or len(changes) > MAX_INCREMENTAL_STRATA * 2:
+                    break
+            return apply_changes(conn, sample, seq, changes, self.per_stratum)
+
+    def _start_build(self, db_file):
+        thread = threading.Thread(target=self._build, args=(db_file,), name='sample-build', daemon=True)
+        self._build_thread = thread
+        thread.start()
+
+    def _build(self, db_file):
+        try:
+            conn = sqlite3.connect(db_file, timeout=30)
+            try:
+                sample = build(conn, self.per_stratum)
+            finally:
+                conn.close()
+        except (OSError, sqlite3.Error) as e:
+            self.last_error = str(e)
+            return
+        with self._lock:
+            if self._sample is None or sample.seq >= self._sample.seq:
+                self._sample = sample
+            self.last_error = None
+
+    def invalidate(self):
+        with self._lock:
+            self._sample = None
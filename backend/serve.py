@@ -0,0 +1,60 @@
+"""
+生产环境启动器: 使用 Gunicorn 以多进程方式运行 app.py。
+
+示例:
+    python serve.py                          # 使用 gunicorn.conf.py 中的默认值
+    python serve.py --workers 8 --threads 4  # 8 核服务器
+    python serve.py --bind 127.0.0.1:8000
+
+平滑重载 (重新加载字典表并逐个替换 worker):
+    kill -HUP <master pid>
+
+调优说明见 gunicorn.conf.py 文件头部。
+"""
+import argparse
+import os
+import sys
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+CONFIG_FILE = os.path.join(SCRIPT_DIR, 'gunicorn.conf.py')
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='宣城车e管后端生产环境启动器')
+    parser.add_argument('--bind', help='监听地址，默认 0.0.0.0:5000')
+    parser.add_argument('--workers', type=int, help='worker 进程数，默认等于 CPU 核数 (最多 12)')
+    parser.add_argument('--threads', type=int, help='每个 worker 的线程数，默认 4')
+    parser.add_argument('--timeout', type=int, help='请求超时秒数，默认 120')
+    parser.add_argument('--db', help='数据库文件路径，覆盖默认的 data/vehicle_data_optimized.db')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    try:
+        from gunicorn.app.wsgiapp import WSGIApplication
+    except ImportError:
+        sys.exit("未安装 gunicorn (仅支持 Linux/macOS)，请先执行: pip install gunicorn")
+
+    # 命令行参数通过环境变量传给 gunicorn.conf.py，保证两种启动方式的行为一致
+    overrides = {
+        'FLEET_BIND': args.bind,
+        'FLEET_WORKERS': args.workers,
+        'FLEET_THREADS': args.threads,
+        'FLEET_TIMEOUT': args.timeout,
+        'FLEET_DB_FILE': args.db,
+    }
+    for key, value in overrides.items():
+        if value is not None:
+            os.environ[key] = str(value)
+
+    # app:app 需要从 backend 目录导入
+    os.chdir(SCRIPT_DIR)
+    sys.path.insert(0, SCRIPT_DIR)
+    sys.argv = ['gunicorn', '-c', CONFIG_FILE, 'app:app']
+    WSGIApplication("%(prog)s [OPTIONS] [APP_MODULE]").run()
+
+
+if __name__ == '__main__':
+    main()
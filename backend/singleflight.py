@@ -0,0 +1,197 @@
+"""
+相同请求的合并执行 (single-flight)。
+
+多个并发请求的键相同 (路由 + 规范化参数，见 response_cache.request_key) 且数据版本相同时，
+只有第一个请求 (leader) 真正计算，其余请求等待并共享它的结果。
+
+- 进程内: 按键登记正在进行的计算，其他线程在 threading.Event 上等待。
+- 跨进程 (设置 FLEET_SINGLEFLIGHT_DIR 时启用，gunicorn 多 worker 时默认启用，见 gunicorn.conf.py): 各 worker 的 leader 再用
+  fcntl.flock 对 "<目录>/<键的哈希>.lock" 加排他锁，拿到锁后先查看同名 .json 文件中
+  是否已有其他 worker 为同一数据版本写好的结果，有则直接使用，否则计算后写入。
+  不支持 fcntl 的平台 (Windows) 只在进程内合并。
+  (修改) 文件锁以 LOCK_NB 轮询，等待期间其他 worker 写好结果就直接使用；超过 timeout 仍拿不到锁时本地计算。
+  (新增) 每隔 PRUNE_INTERVAL 秒清理一次超过 RESULT_MAX_AGE 秒未被使用的 .lock / .json 文件。
+
+结果为 (状态码, mimetype, 响应体, 是否可缓存)，不可缓存的结果不写入文件；leader 出错时等待者各自重新计算，不共享异常。
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+FLIGHT_TIMEOUT = 120
+LOCK_POLL_INTERVAL = 0.05
+RESULT_MAX_AGE = 3600
+PRUNE_INTERVAL = 300
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+
+
+class SingleFlight:
+    """按 (键, 数据版本) 合并并发的相同计算，线程安全。"""
+
+    def __init__(self, shared_dir=None, timeout=FLIGHT_TIMEOUT):
+        self.shared_dir = shared_dir if fcntl is not None else None
+        if self.shared_dir:
+            os.makedirs(self.shared_dir, exist_ok=True)
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._pruned_at = time.monotonic()
+        self.computed = 0
+        self.shared = 0
+
+    def do(self, key, version, compute):
+        """返回 compute() 的结果 (状态码, mimetype, 响应体, 是否可缓存)；并发的相同调用只计算一次。"""
+        flight = (key, version)
+        with self._lock:
+            call = self._calls.get(flight)
+            leader = call is None
+            if leader:
+                call = self._calls[flight] = _Call()
+
+        if not leader:
+            if call.done.wait(self.timeout) and call.result is not None:
+                self.shared += 1
+                return call.result
+            # leader 超时或出错，自行计算
+            return compute()
+
+        try:
+            call.result = self._compute_shared(key, version, compute) if self.shared_dir else self._run(compute)
+            return call.result
+        finally:
+            with self._lock:
+                del self._calls[flight]
+            call.done.set()
+
+    def _run(self, compute):
+        self.computed += 1
+        return compute()
+
+    def _compute_shared(self, key, version, compute):
+        """跨进程: 持有文件锁期间读取或生成同一数据版本的结果；等锁超时则不再等待，本地计算。"""
+        self._maybe_prune()
+        digest = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+        lock_path = os.path.join(self.shared_dir, f'{digest}.lock')
+        result_path = os.path.join(self.shared_dir, f'{digest}.json')
+        deadline = time.monotonic() + self.timeout
+        with open(lock_path, 'a') as lock_file:
+            while True:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except OSError:
+                    pass
+                # 结果文件以 os.replace 整体替换，不持有锁也能安全读取
+                result = self._read_result(result_path, version)
+                if result is not None:
+                    self.shared += 1
+                    return result
+                if time.monotonic() >= deadline:
+                    return self._run(compute)
+                time.sleep(LOCK_POLL_INTERVAL)
+            try:
+                result = self._read_result(result_path, version)
+                if result is not None:
+                    self.shared += 1
+                    return result
+                result = self._run(compute)
+                if result[0] == 200 and result[3]:
+                    self._write_result(result_path, version, result)
+                return result
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _maybe_prune(self):
+        """每 PRUNE_INTERVAL 秒最多一次: 删除长时间未使用的结果文件及其锁文件。"""
+        now = time.monotonic()
+        with self._lock:
+            if now - self._pruned_at < PRUNE_INTERVAL:
+                return
+            self._pruned_at = now
+        prune_shared_dir(self.shared_dir)
+
+    @staticmethod
+    def _read_result(path, version):
+        try:
+            with open(path, 'rb') as f:
+                header = json.loads(f.readline())
+                body = f.read()
+        except (OSError, ValueError):
+            return None
+        if header.get('version') != list(version):
+            return None
+        try:
+            # 以修改时间记录最近一次使用，避免仍在使用的结果被清理
+            os.utime(path)
+        except OSError:
+            pass
+        return header['status'], header['mimetype'], body, True
+
+    @staticmethod
+    def _write_result(path, version, result):
+        status, mimetype, body, _ = result
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(json.dumps({'version': list(version), 'status': status, 'mimetype': mimetype}).encode('utf-8'))
+                f.write(b'\n')
+                f.write(body)
+            os.replace(tmp_path, path)
+        except OSError:
+            pass
+
+    def stats(self):
+        with self._lock:
+            in_flight = len(self._calls)
+        return {'computed': self.computed, 'shared': self.shared, 'in_flight': in_flight,
+                'cross_process': bool(self.shared_dir)}
+
+
+def prune_shared_dir(shared_dir, max_age=RESULT_MAX_AGE):
+    """
+    删除共享目录中超过 max_age 秒未使用的结果 (.json)、对应的锁文件和残留的临时文件，返回删除的文件数。
+    锁文件只在能拿到锁时删除；极少数情况下仍可能有进程持有已删除的锁文件，其后果只是同一结果被重复计算一次。
+    """
+    cutoff = time.time() - max_age
+    removed = 0
+    try:
+        names = os.listdir(shared_dir)
+    except OSError:
+        return 0
+    for name in names:
+        path = os.path.join(shared_dir, name)
+        digest, ext = os.path.splitext(name)
+        if ext not in ('.lock', '.json', '.tmp') or name.startswith('warmup.'):
+            continue
+        try:
+            if os.path.getmtime(path) >= cutoff:
+                continue
+            if ext == '.lock':
+                # 对应的结果仍在使用时保留锁文件 (打开锁文件不会更新它的修改时间)
+                result_path = os.path.join(shared_dir, f'{digest}.json')
+                if os.path.exists(result_path) and os.path.getmtime(result_path) >= cutoff:
+                    continue
+                with open(path, 'a') as lock_file:
+                    try:
+                        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except OSError:
+                        continue
+                    os.remove(path)
+            else:
+                os.remove(path)
+            removed += 1
+        except OSError:
+            continue
+    return removed
@@ -0,0 +1,173 @@
+"""
+分析查询使用的只读快照库 (可选，设置 FLEET_READ_SNAPSHOT=1 启用)。
+
+概览、部门、车辆等汇总接口从快照读取，数据管理的写入仍在主库进行，
+长时间的分析查询与批量写入互不阻塞。
+
+- 刷新: 用 SQLite 在线备份 API 把主库复制到临时文件，改为回滚日志模式后原子地改名为快照文件。
+  已经打开的连接继续读旧文件，新连接读新文件，快照文件本身从不被原地修改，
+  因此可以用 mode=ro&immutable=1 打开 (不加锁、不检查文件变化) 并启用较大的 mmap。
+- 写入后: (修改) app.py 的 publish_change 调用 refresh_later()，由后台线程刷新快照，
+  变更事件在快照包含这次写入之后才发布，客户端收到事件后重新请求即可看到新数据。
+  连续的写入合并为一次复制，两次复制至少间隔 min_interval 秒 (FLEET_SNAPSHOT_MIN_INTERVAL，默认 1)；
+  复制前用非阻塞的 fcntl.flock 对 "<快照>.lock" 加锁，其他进程正在刷新时本进程不重复复制，
+  稍后再比较数据版本，对方的快照已包含这次写入时直接发布事件。
+- 定时: 快照文件超过 max_age 秒未刷新时，下一次读取会比较主库和快照的数据版本
+  (见 response_cache.data_version)，不同则刷新，用于发现导入脚本等其他程序的写入。
+
+多个 worker 共用同一个快照文件，各自的临时文件名带进程号，最后一次改名生效。
+"""
+import os
+import sqlite3
+import threading
+import time
+
+from response_cache import data_version
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+SNAPSHOT_SUFFIX = '.snapshot'
+SNAPSHOT_MAX_AGE = int(os.environ.get('FLEET_SNAPSHOT_MAX_AGE', 60))
+SNAPSHOT_MIN_INTERVAL = float(os.environ.get('FLEET_SNAPSHOT_MIN_INTERVAL', 1))
+SNAPSHOT_MMAP_SIZE = 1024 * 1024 * 1024
+
+
+class ReadSnapshot:
+    """主库 db_file 的只读快照。connect() 返回快照上的连接，refresh() 按需刷新。"""
+
+    def __init__(self, db_file, path=None, max_age=SNAPSHOT_MAX_AGE, mmap_size=SNAPSHOT_MMAP_SIZE,
+                 min_interval=SNAPSHOT_MIN_INTERVAL):
+        self.db_file = db_file
+        self.path = path or db_file + SNAPSHOT_SUFFIX
+        self.max_age = max_age
+        self.mmap_size = mmap_size
+        self.min_interval = min_interval
+        self._lock = threading.Lock()
+        self.refreshes = 0
+        # (新增) 后台刷新: 待刷新标记、刷新后要调用的回调、刷新线程和上次刷新的时间
+        self._pending_lock = threading.Lock()
+        self._dirty = False
+        self._callbacks = []
+        self._thread = None
+        self._refreshed_at = 0.0
+        self.skipped = 0
+
+    def _open(self):
+        conn = sqlite3.connect(f'file:{self.path}?mode=ro&immutable=1', uri=True)
+        conn.execute(f'PRAGMA mmap_size = {int(self.mmap_size)}')
+        return conn
+
+    def _is_current(self, primary):
+        if not os.path.exists(self.path):
+            return False
+        snapshot = self._open()
+        try:
+            return data_version(snapshot) == data_version(primary)
+        finally:
+            snapshot.close()
+
+    def refresh(self, force=False):
+        """主库的数据版本与快照不同 (或 force) 时重新复制，返回是否刷新了快照。"""
+        with self._lock:
+            primary = sqlite3.connect(self.db_file)
+            try:
+                if not force and self._is_current(primary):
+                    # 记录本次检查的时间，max_age 之内不再比较
+                    os.utime(self.path)
+                    return False
+                tmp_path = f'{self.path}.{os.getpid()}.tmp'
+                target = sqlite3.connect(tmp_path)
+                try:
+                    primary.backup(target)
+                    # 快照以 immutable 方式打开，不能依赖 WAL 文件
+                    target.execute('PRAGMA journal_mode = DELETE')
+                except sqlite3.Error:
+                    target.close()
+                    os.remove(tmp_path)
+                    raise
+                target.close()
+            finally:
+                primary.close()
+            os.replace(tmp_path, self.path)
+            self.refreshes += 1
+            return True
+
+    def refresh_later(self, callback=None):
+        """
+        (新增) 在后台刷新快照，立即返回。callback 在快照包含调用之前的写入后 (或刷新出错时) 调用；
+        短时间内的多次调用合并为一次复制。
+        """
+        with self._pending_lock:
+            if callback is not None:
+                self._callbacks.append(callback)
+            self._dirty = True
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._refresh_loop, name='snapshot-refresh', daemon=True)
+                self._thread.start()
+
+    def _refresh_loop(self):
+        while True:
+            delay = self.min_interval - (time.monotonic() - self._refreshed_at)
+            if delay > 0:
+                time.sleep(delay)
+            with self._pending_lock:
+                if not self._dirty:
+                    self._thread = None
+                    return
+                self._dirty = False
+                callbacks, self._callbacks = self._callbacks, []
+            try:
+                done = self._try_refresh() is not None
+            except (OSError, sqlite3.Error):
+                # 刷新失败时照常发布事件，下一次写入或 max_age 到期时再刷新
+                done = True
+            self._refreshed_at = time.monotonic()
+            if not done:
+                # 其他进程正在刷新，稍后比较版本 (对方的快照可能已经包含这些写入)
+                with self._pending_lock:
+                    self._dirty = True
+                    self._callbacks[:0] = callbacks
+                continue
+            for callback in callbacks:
+                try:
+                    callback()
+                except (OSError, sqlite3.Error):
+                    pass
+
+    def _try_refresh(self):
+        """持有跨进程的刷新锁时执行 refresh()；其他进程正在刷新时返回 None。"""
+        if fcntl is None:
+            return self.refresh()
+        with open(f'{self.path}.lock', 'a') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                self.skipped += 1
+                return None
+            try:
+                return self.refresh()
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def connect(self):
+        """返回快照上的只读连接；快照不存在时先创建，超过 max_age 时先检查是否需要刷新。"""
+        try:
+            age = time.time() - os.path.getmtime(self.path)
+        except OSError:
+            self.refresh(force=True)
+        else:
+            if age > self.max_age and not self._lock.locked():
+                # (修改) 其他进程正在刷新时不等待，继续读当前的快照
+                self._try_refresh()
+        return self._open()
+
+    def stats(self):
+        try:
+            age = round(time.time() - os.path.getmtime(self.path), 1)
+        except OSError:
+            age = None
+        return {'path': self.path, 'age_seconds': age, 'refreshes': self.refreshes, 'skipped': self.skipped,
+                'pending': self._dirty}
@@ -0,0 +1,92 @@
+"""
+先暂存、后切换的批量写入，读者不会看到清空或只导入了一半的表。
+
+- 全量重建 (be/import_data.py): 在单独的暂存库文件 (<数据库>.staging) 中建表、导入、
+  建索引并执行 migrations (触发器、汇总表)，完成后由 swap_in() 一次性替换正式库。
+  替换使用 SQLite 备份 API 一步复制全部页面: WAL 模式下复制的页面写入 WAL，
+  正在读的连接继续读旧快照，完全不需要等待；回滚日志模式下读者只在复制期间短暂等待。
+  导入失败时正式库保持不变。
+- 上传 (app.py upload_file): append_frame() 先把数据写入 temp 库中的临时表
+  (不占用正式库的写锁)，再用一条 INSERT ... SELECT 追加，写锁只持有这一条语句的时间。
+  (修改) 临时表和正式表的写入在同一个事务中提交，调用方此前在同一连接上未提交的写入
+  (上传时新建的字典表名称) 随之一起提交或回滚，失败的追加不会留下孤立的字典表记录。
+
+替换时暂存库的变更日志 seq 和字典表版本号接在正式库之后继续递增，
+各进程的响应缓存、前缀和索引、字典表缓存因此都能发现数据已整体更换 (见 response_cache.py)。
+"""
+import os
+import sqlite3
+
+from migrations import JOURNAL_TABLES
+from response_cache import data_version
+
+STAGING_SUFFIX = '.staging'
+
+
+def staging_path(db_file):
+    """db_file 对应的暂存库路径。"""
+    return db_file + STAGING_SUFFIX
+
+
+def discard_staging(db_file):
+    """删除上次未完成的暂存库 (包括日志文件)。"""
+    path = staging_path(db_file)
+    for suffix in ('', '-journal', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    return path
+
+
+def append_frame(conn, df, table):
+    """
+    把 DataFrame 追加到 table 并提交。数据先写入 temp 库的临时表，
+    再 INSERT ... SELECT 到正式表；失败时回滚，正式表不变。
+    (修改) 整个过程只提交一次，conn 上尚未提交的写入与追加的数据一起提交或回滚。
+    """
+    columns = ', '.join(df.columns)
+    staging_table = f"staging_{table}"
+    conn.execute(f"DROP TABLE IF EXISTS temp.{staging_table}")
+    conn.execute(f"CREATE TEMP TABLE {staging_table} AS SELECT {columns} FROM main.{table} WHERE 0")
+    try:
+        rows = df.astype(object).where(df.notna(), None).itertuples(index=False, name=None)
+        conn.executemany(
+            f"INSERT INTO temp.{staging_table} VALUES ({', '.join('?' for _ in df.columns)})", rows
+        )
+        conn.execute(f"INSERT INTO main.{table} ({columns}) SELECT {columns} FROM temp.{staging_table}")
+        conn.commit()
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+    finally:
+        conn.execute(f"DROP TABLE IF EXISTS temp.{staging_table}")
+
+
+def carry_versions(live, staged):
+    """让暂存库的 seq 和字典表版本号接在正式库之后，并为每张表记一条 reload。"""
+    version = data_version(live)
+    if version is None:
+        return
+    seq, dictionary_version = version
+    staged.execute("UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = 'change_journal'", (seq,))
+    staged.executemany("INSERT INTO change_journal (table_name, op) VALUES (?, 'reload')",
+                       [(table_name,) for table_name in JOURNAL_TABLES])
+    staged.execute("UPDATE cache_versions SET version = MAX(version, ?) + 1 WHERE name = 'dictionary'",
+                   (dictionary_version,))
+    staged.commit()
+
+
+def swap_in(staging_file, db_file):
+    """用暂存库一次性替换正式库，然后删除暂存库。正式库不存在时直接改名。"""
+    if not os.path.exists(db_file):
+        os.replace(staging_file, db_file)
+        return
+    live = sqlite3.connect(db_file)
+    staged = sqlite3.connect(staging_file)
+    try:
+        carry_versions(live, staged)
+        # pages=-1: 一步复制全部页面，读者看到的要么是旧库，要么是新库
+        staged.backup(live, pages=-1)
+    finally:
+        staged.close()
+        live.close()
+    discard_staging(db_file)
@@ -0,0 +1,69 @@
+"""
+测试共用的 fixture: 按 be/import_data.py 的表结构建一个小型数据库并执行 migrations。
+
+运行: cd backend && python -m pytest tests
+"""
+import importlib.util
+import os
+import random
+import sqlite3
+import sys
+
+import pytest
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, BACKEND_DIR)
+
+from migrations import migrate  # noqa: E402
+
+
+def _import_data():
+    """be/import_data.py 中的建表语句 (与正式数据库相同的结构)。"""
+    path = os.path.join(BACKEND_DIR, '..', 'be', 'import_data.py')
+    spec = importlib.util.spec_from_file_location('import_data', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def db_file(tmp_path):
+    """数据库文件路径 (已建表、写入测试数据并执行 migrations)。"""
+    path = str(tmp_path / 'fleet.db')
+    import_data = _import_data()
+    conn = sqlite3.connect(path)
+    for sql in import_data.TABLES.values():
+        conn.execute(sql)
+    rng = random.Random(7)
+    conn.executemany('INSERT INTO departments (department_id, name) VALUES (?, ?)',
+                     [(i, f'部门{i}') for i in range(1, 5)])
+    for vid in range(1, 41):
+        conn.execute('INSERT INTO vehicles (vehicle_id, plate_number, department_id) VALUES (?, ?, ?)',
+                     (vid, f'皖P{vid:05d}', rng.randint(1, 4)))
+    for year in (2024, 2025):
+        for month in range(1, 13):
+            for vid in range(1, 41):
+                distance = rng.randint(200, 3000)
+                conn.execute('INSERT INTO monthly_fuel_summary (plate_number, vehicle_id, year, month, '
+                             'distance_driven, total_fuel_amount, total_fuel_cost) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                             (f'皖P{vid:05d}', vid, year, month, distance, distance * 0.08, distance * 0.6))
+                if rng.random() < 0.3:
+                    conn.execute('INSERT INTO violations (plate_number, vehicle_id, violation_time) VALUES (?, ?, ?)',
+                                 (f'皖P{vid:05d}', vid, f'{year}-{month:02d}-{rng.randint(1, 28):02d} 10:00:00'))
+                if rng.random() < 0.2:
+                    conn.execute('INSERT INTO maintenance (plate_number, vehicle_id, request_time, maintenance_cost) '
+                                 'VALUES (?, ?, ?, ?)',
+                                 (f'皖P{vid:05d}', vid, f'{year}-{month:02d}-{rng.randint(1, 28):02d} 09:00:00',
+                                  rng.randint(100, 3000)))
+    conn.commit()
+    migrate(conn)
+    conn.commit()
+    conn.close()
+    return path
+
+
+@pytest.fixture
+def conn(db_file):
+    conn = sqlite3.connect(db_file)
+    yield conn
+    conn.close()
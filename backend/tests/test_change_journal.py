@@ -0,0 +1,78 @@
+"""
+变更日志 (change_journal): 通过接口写入的每一行只记一条日志，且带有最终的 vehicle_id。
+
+运行: cd backend && python -m pytest tests
+"""
+import io
+
+import pandas as pd
+import pytest
+
+import app as app_module
+from events import EventBroker
+
+
+@pytest.fixture
+def client(db_file, monkeypatch):
+    monkeypatch.setattr(app_module, 'DB_FILE', db_file)
+    # 事件不写入共享文件，写入后也不在后台预热
+    monkeypatch.setattr(app_module, 'EVENT_BROKER', EventBroker())
+    monkeypatch.setattr(app_module.WARMER, 'enabled', False)
+    return app_module.app.test_client()
+
+
+def journal_since(conn, seq):
+    return conn.execute('SELECT table_name, op, pk, new_vehicle_id FROM change_journal WHERE seq > ? ORDER BY seq',
+                        (seq,)).fetchall()
+
+
+def latest(conn):
+    return conn.execute('SELECT MAX(seq) FROM change_journal').fetchone()[0]
+
+
+def test_one_insert_per_inserted_violation(client, conn):
+    since = latest(conn)
+    response = client.post('/api/data/batch', json={'operations': [
+        {'op': 'insert', 'table': 'violations',
+         'data': {'plate_number': '皖P00003', 'violation_time': '2025-03-05 10:00:00', 'violation_location': ' 新地点 '}},
+        {'op': 'insert', 'table': 'violations',
+         'data': {'plate_number': '皖P00004', 'violation_time': '2025-03-06 10:00:00', 'violation_location': '新地点'}},
+        {'op': 'insert', 'table': 'violations',
+         'data': {'plate_number': '皖P99999', 'violation_time': '2025-03-07 10:00:00', 'violation_location': ''}},
+    ]})
+    assert response.status_code == 200
+    assert client.post('/api/data/violations', json={
+        'plate_number': '皖P00005', 'violation_time': '2025-03-08 10:00:00', 'violation_location': '另一地点',
+    }).status_code == 201
+
+    frame = pd.DataFrame({'车牌号': ['皖P00006', '皖P00007'], '违章时间': ['2025-03-09 10:00:00', '2025-03-10 10:00:00'],
+                          '违章地点': ['新地点', '上传地点']})
+    buffer = io.BytesIO()
+    frame.to_excel(buffer, index=False)
+    buffer.seek(0)
+    response = client.post('/api/upload/violations', data={'file': (buffer, 'violations.xlsx')},
+                           content_type='multipart/form-data')
+    assert response.status_code == 200, response.get_json()
+
+    entries = journal_since(conn, since)
+    assert [op for _, op, _, _ in entries] == ['insert'] * 6
+    assert len({pk for _, _, pk, _ in entries}) == 6
+    assert [vehicle_id for _, _, _, vehicle_id in entries] == [3, 4, None, 5, 6, 7]
+
+    rows = conn.execute('''
+        SELECT v.violation_location, l.name FROM violations v LEFT JOIN violation_locations l USING (location_id)
+        WHERE v.violation_id IN (SELECT pk FROM change_journal WHERE seq > ?) ORDER BY v.violation_id
+    ''', (since,)).fetchall()
+    assert [name for _, name in rows] == ['新地点', '新地点', None, '另一地点', '新地点', '上传地点']
+    counts = dict(conn.execute("SELECT l.name, t.count FROM top_counts t JOIN violation_locations l "
+                               "ON l.location_id = t.key_id WHERE t.kind = 'location' AND t.period = '2025-03'"))
+    assert counts == {'新地点': 3, '另一地点': 1, '上传地点': 1}
+
+
+def test_update_journals_once_with_final_vehicle(client, conn):
+    since = latest(conn)
+    violation_id = conn.execute('SELECT MIN(violation_id) FROM violations').fetchone()[0]
+    assert client.put(f'/api/data/violations/{violation_id}', json={
+        'plate_number': '皖P00009', 'violation_location': '改后地点',
+    }).status_code == 200
+    assert journal_since(conn, since) == [('violations', 'update', violation_id, 9)]
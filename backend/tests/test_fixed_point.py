@@ -0,0 +1,67 @@
+"""
+定点整数存储模式 (fixed_point.py): 模式切换、写入前的换算和舍入。
+
+运行: cd backend && python -m pytest tests
+"""
+import sqlite3
+
+import pandas as pd
+
+from fixed_point import SCALED_COLUMNS, column_scales, frame_to_storage, from_storage, set_fixed_point, to_storage
+
+
+def fuel_rows(conn):
+    return conn.execute('SELECT rowid, total_fuel_amount, total_fuel_cost FROM monthly_fuel_summary '
+                        'ORDER BY rowid').fetchall()
+
+
+def test_enable_disable_round_trip(db_file):
+    conn = sqlite3.connect(db_file, isolation_level=None)
+    try:
+        conn.execute("INSERT INTO maintenance (plate_number, vehicle_id, request_time, maintenance_cost) "
+                     "VALUES ('皖P00001', 1, '2025-06-10 09:00:00', '待定')")
+        before = fuel_rows(conn)
+        since = conn.execute('SELECT MAX(seq) FROM change_journal').fetchone()[0]
+
+        assert set_fixed_point(conn, True) == list(SCALED_COLUMNS)
+        assert column_scales(conn) == SCALED_COLUMNS
+        assert set_fixed_point(conn, True) == []
+        enabled = fuel_rows(conn)
+        assert all(isinstance(fuel, int) and isinstance(cost, int) for _, fuel, cost in enabled)
+        assert [(rowid, round(fuel * 1000), round(cost * 100)) for rowid, fuel, cost in before] == enabled
+        # 换算不逐行记日志，每张表一条 reload
+        assert conn.execute('SELECT table_name, op FROM change_journal WHERE seq > ? ORDER BY seq',
+                            (since,)).fetchall() == [(table_name, 'reload') for table_name in SCALED_COLUMNS]
+
+        assert set_fixed_point(conn, False) == list(SCALED_COLUMNS)
+        assert column_scales(conn) == {}
+        assert [(rowid, round(fuel, 3), round(cost, 2)) for rowid, fuel, cost in before] == fuel_rows(conn)
+        # 文本值在两个方向上都保持不变
+        assert conn.execute("SELECT maintenance_cost FROM maintenance WHERE typeof(maintenance_cost) = 'text'"
+                            ).fetchall() == [('待定',)]
+    finally:
+        conn.close()
+
+
+def test_to_storage_rounds_half_away_from_zero():
+    scales = {'maintenance': {'maintenance_cost': 100}}
+    values = [0.125, -0.125, 1.005, 2.675, '12.345', 3, None, '']
+    stored = [to_storage(scales, 'maintenance', {'maintenance_cost': value})['maintenance_cost'] for value in values]
+    assert stored == [13, -13, 101, 268, 1235, 300, None, '']
+
+    df = pd.DataFrame({'maintenance_cost': [0.125, -0.125, 1.005, 2.675, 12.345, 3, None]})
+    converted = frame_to_storage(scales, 'maintenance', df)['maintenance_cost']
+    assert str(converted.dtype) == 'Int64'
+    assert list(converted[:6]) == [13, -13, 101, 268, 1235, 300]
+    assert pd.isna(converted[6])
+    assert df['maintenance_cost'][0] == 0.125
+
+
+def test_text_values_untouched():
+    scales = {'maintenance': {'maintenance_cost': 100}}
+    record = {'maintenance_cost': '待定', 'service_details': '更换机油'}
+    assert to_storage(scales, 'maintenance', record) == record
+    assert from_storage(scales, 'maintenance', record) == record
+    assert from_storage(scales, 'maintenance', {'maintenance_cost': 12345}) == {'maintenance_cost': 123.45}
+    assert from_storage(scales, 'maintenance', {'maintenance_cost': 12300}) == {'maintenance_cost': 123}
+    assert to_storage({}, 'maintenance', {'maintenance_cost': 1.005}) == {'maintenance_cost': 1.005}
@@ -0,0 +1,87 @@
+"""
+导入数据的解析和校验 (ingest.py): 日期、数值、车牌号和字典表名称。
+
+运行: cd backend && python -m pytest tests
+"""
+import pandas as pd
+
+from ingest import coerce_numbers, parse_dates, validate_frame
+
+IDS = {'department_id': {1, 2}, 'violation_type_id': {1, 2}, 'provider_id': {1}}
+PLATES = {'皖P00001': 1, '皖P00002': 2}
+
+
+def test_parse_dates_chinese_and_separators():
+    values = pd.Series(['2020年3月5日', '2020/3/5 10时30分', '2020.3.5 8:05:09', '2020-03-05 10:30:00',
+                        '2020年3月5日 10时30分15秒', None])
+    dates, invalid = parse_dates(values, with_time=True)
+    assert list(dates) == ['2020-03-05', '2020-03-05 10:30:00', '2020-03-05 08:05:09', '2020-03-05 10:30:00',
+                           '2020-03-05 10:30:15', None]
+    assert not invalid.any()
+
+    dates, _ = parse_dates(pd.Series(['2020/3/5 10时30分']))
+    assert list(dates) == ['2020-03-05']
+
+
+def test_parse_dates_rejects_invalid_values():
+    values = pd.Series(['2020年3月5日xyz', '2020-02-30', 'abc', '2020-03-05 25:00', '', '2020-03-05'])
+    dates, invalid = parse_dates(values)
+    assert list(invalid) == [True, True, True, True, False, False]
+    assert list(dates) == [None, None, None, None, None, '2020-03-05']
+
+
+def test_coerce_numbers_strips_separators_and_currency():
+    numbers, invalid = coerce_numbers(pd.Series(['1,200.5元', '￥3，000', ' 42 ', '', 'abc']))
+    assert list(numbers[:3]) == [1200.5, 3000.0, 42.0]
+    assert pd.isna(numbers[3]) and pd.isna(numbers[4])
+    assert list(invalid) == [False, False, False, False, True]
+
+
+def test_integer_columns_reject_fractions():
+    numbers, invalid = coerce_numbers(pd.Series(['12', '12.0', '12.5', '1,000']), integer=True)
+    assert list(invalid) == [False, False, True, False]
+    assert numbers[0] == 12 and numbers[1] == 12 and numbers[3] == 1000
+    assert pd.isna(numbers[2])
+
+
+def test_unknown_plates_reject_or_warn():
+    df = pd.DataFrame({'plate_number': ['皖p·00001', '皖P99999'], 'violation_time': ['2025-01-02', '2025-01-03']})
+
+    accepted, report = validate_frame(df, 'violations', PLATES, IDS)
+    assert list(accepted['plate_number']) == ['皖P00001']
+    assert list(accepted['vehicle_id']) == [1]
+    assert report.rejected_rows == 1
+    assert report.errors[0]['row'] == 3 and report.errors[0]['error'] == '车牌号不存在'
+
+    accepted, report = validate_frame(df, 'violations', PLATES, IDS, unknown_plates='warn')
+    assert list(accepted['plate_number']) == ['皖P00001', '皖P99999']
+    assert pd.isna(accepted['vehicle_id'].iloc[1])
+    assert report.rejected_rows == 0 and len(report.warnings) == 1
+
+
+def test_dictionary_names_resolved_only_for_accepted_rows():
+    df = pd.DataFrame({
+        'plate_number': ['皖P00001', '皖P00002', '皖P00001', '皖P99999'],
+        'violation_time': ['2025-01-02', '2025-01-03', '2025-01-04', '2025-01-05'],
+        'violation_type_id': [2, '闯红灯', None, None],
+        'violation_type': [None, None, ' 超速 ', '违停'],
+    })
+    calls = []
+
+    def resolve(table, names):
+        calls.append((table, sorted(names)))
+        return {'闯红灯': 7, '超速': 8, '违停': 9}
+
+    accepted, report = validate_frame(df, 'violations', PLATES, IDS, resolve=resolve)
+    assert list(accepted['violation_type_id']) == [2, 7, 8]
+    assert 'violation_type' not in accepted.columns
+    # 被拒绝的行 (车牌号不存在) 中的名称不会被创建
+    assert calls == [('violation_types', ['超速', '闯红灯'])]
+    assert report.rejected_rows == 1
+
+
+def test_unknown_dictionary_ids_rejected():
+    df = pd.DataFrame({'plate_number': ['皖P00001', '皖P00002'], 'violation_type_id': [1, 5]})
+    accepted, report = validate_frame(df, 'violations', PLATES, IDS)
+    assert list(accepted['violation_type_id']) == [1]
+    assert report.error_counts == {'violation_type_id: 引用的 ID 不存在': 1}
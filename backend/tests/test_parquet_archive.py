@@ -0,0 +1,49 @@
+"""
+Parquet 导出 (parquet_archive.py): 列类型转换和清单中记录的无法转换的值。
+
+运行: cd backend && python -m pytest tests
+"""
+import sqlite3
+
+import pytest
+
+pa = pytest.importorskip('pyarrow')
+
+from parquet_archive import ParquetArchive, _convert, export  # noqa: E402
+
+
+def test_convert_rounds_instead_of_truncating():
+    assert _convert(12345.7, pa.int64()) == 12346
+    assert _convert(-2.6, pa.int64()) == -3
+    assert _convert('12.5', pa.int64()) == 12
+    assert _convert('13.5', pa.int64()) == 14
+    assert _convert(' 42 ', pa.int64()) == 42
+    assert _convert(2 ** 62 + 1, pa.int64()) == 2 ** 62 + 1
+    assert _convert('1.5', pa.float64()) == 1.5
+    assert _convert(7, pa.string()) == '7'
+    assert _convert(None, pa.int64()) is None
+    for value in ('abc', float('nan'), float('inf')):
+        with pytest.raises(ValueError):
+            _convert(value, pa.int64())
+
+
+def test_export_reports_values_coerced_to_null(db_file, tmp_path):
+    conn = sqlite3.connect(db_file, isolation_level=None)
+    try:
+        conn.execute("INSERT INTO maintenance (plate_number, vehicle_id, request_time, current_mileage) "
+                     "VALUES ('皖P00001', 1, '2025-06-10 09:00:00', 12345.7)")
+        conn.execute("INSERT INTO maintenance (plate_number, vehicle_id, request_time, current_mileage) "
+                     "VALUES ('皖P00002', 2, '2025-06-11 09:00:00', '约1万')")
+        out_dir = str(tmp_path / 'parquet')
+        export(conn, out_dir)
+        archive = ParquetArchive(out_dir)
+        assert archive.manifest['coerced'] == {'maintenance': {'2025-06': {'current_mileage': 1}}}
+        mileage = archive.read_partition('maintenance', '2025-06', ['current_mileage']).column(0).to_pylist()
+        assert 12346 in mileage and 12345 not in mileage
+
+        # 分区重写后不再有无法转换的值，清单中的记录随之移除
+        conn.execute("UPDATE maintenance SET current_mileage = 10000 WHERE current_mileage = '约1万'")
+        export(conn, out_dir)
+        assert ParquetArchive(out_dir).manifest['coerced'] == {}
+    finally:
+        conn.close()
@@ -0,0 +1,90 @@
+"""
+前缀和索引 (range_index.py) 的增量更新: 经过各种写入之后，与全量构建的结果一致。
+
+运行: cd backend && python -m pytest tests
+"""
+import numpy as np
+
+import range_index
+
+
+WINDOWS = [(None, None), ('2024-03', '2025-01'), ('2025-02', '2025-02'), ('2023-01', '2030-12'), ('2026-01', '2026-12')]
+
+
+def assert_same(actual, expected):
+    """两个索引在所有公开的查询上结果相同。"""
+    assert actual.months == expected.months
+    assert actual.department_ids == expected.department_ids
+    keys = sorted((k for k in set(actual.vehicle_keys) | set(expected.vehicle_keys) if k is not None)) + [None]
+    for window in WINDOWS:
+        assert np.allclose(actual.vehicle_totals(keys, *window), expected.vehicle_totals(keys, *window))
+        assert actual.fleet_totals(*window) == expected.fleet_totals(*window)
+        assert actual.department_totals(*window) == expected.department_totals(*window)
+        for table in range_index.SOURCES:
+            for granularity in ('week', 'month', 'quarter', 'year'):
+                for department in [None] + expected.department_ids:
+                    a = actual.series(table, granularity, *window, department_id=department)
+                    b = expected.series(table, granularity, *window, department_id=department)
+                    assert a[:2] == b[:2], (table, granularity, window, department)
+                    for metric in b[2]:
+                        assert np.allclose(a[2][metric], b[2][metric]), (table, granularity, window, department)
+
+
+def sync_incrementally(index, conn):
+    """同步并确认走的是增量路径 (没有后台重建)。"""
+    result = index.sync(conn)
+    assert not index.rebuilding
+    assert result.seq == range_index.latest_seq(conn)
+    return result
+
+
+def test_incremental_updates_match_full_build(conn):
+    index = range_index.RangeIndex()
+    index.sync(conn)
+
+    steps = [
+        # 新增、修改、删除事实记录
+        "INSERT INTO violations (vehicle_id, violation_time) VALUES (3, '2025-03-05 10:00:00')",
+        "UPDATE monthly_fuel_summary SET distance_driven = distance_driven + 1234 WHERE summary_id <= 5",
+        "UPDATE maintenance SET request_time = '2024-06-01 08:00:00' WHERE maintenance_id <= 3",
+        "DELETE FROM violations WHERE violation_id <= 7",
+        "INSERT INTO violations (vehicle_id, violation_time) VALUES (NULL, NULL)",
+        "UPDATE maintenance SET vehicle_id = 10 WHERE maintenance_id = 4",
+        # 车辆其他信息的修改、调整部门、新增和删除车辆
+        "UPDATE vehicles SET manager = '张三' WHERE vehicle_id = 2",
+        "UPDATE vehicles SET department_id = 1 WHERE vehicle_id IN (5, 6, 7)",
+        "INSERT INTO vehicles (vehicle_id, plate_number, department_id) VALUES (41, '皖P00041', 4)",
+        "INSERT INTO violations (vehicle_id, violation_time) VALUES (41, '2025-06-30 08:00:00')",
+        "INSERT INTO maintenance (vehicle_id, request_time, maintenance_cost) VALUES (99, '2025-01-02', 50)",
+        "INSERT INTO vehicles (vehicle_id, plate_number, department_id) VALUES (99, '皖P00099', 2)",
+        "DELETE FROM vehicles WHERE vehicle_id = 8",
+        # 新的月份 (在预留范围内)，以及删除最早的月份
+        "INSERT INTO maintenance (vehicle_id, request_time, maintenance_cost) VALUES (1, '2026-03-02', 5)",
+        "INSERT INTO monthly_fuel_summary (vehicle_id, year, month, distance_driven) VALUES (2, 2026, 4, 10)",
+        "DELETE FROM monthly_fuel_summary WHERE year = 2024 AND month = 1",
+        "DELETE FROM violations WHERE violation_time LIKE '2024-01%'",
+        "DELETE FROM maintenance WHERE request_time LIKE '2024-01%'",
+    ]
+    for sql in steps:
+        conn.execute(sql)
+        conn.commit()
+        assert_same(sync_incrementally(index, conn), range_index.build(conn))
+
+    # 同一批中车辆调整部门并修改其记录
+    conn.execute("UPDATE vehicles SET department_id = 3 WHERE vehicle_id = 12")
+    conn.execute("UPDATE violations SET violation_time = '2025-02-14 12:00:00' WHERE vehicle_id = 12")
+    conn.execute("INSERT INTO maintenance (vehicle_id, request_time, maintenance_cost) VALUES (12, '2025-02-15', 7)")
+    conn.commit()
+    assert_same(sync_incrementally(index, conn), range_index.build(conn))
+
+
+def test_rebuild_in_background_serves_old_index(conn):
+    index = range_index.RangeIndex()
+    old = index.sync(conn)
+    # 早于月份轴起点的记录需要全量重建
+    conn.execute("INSERT INTO violations (vehicle_id, violation_time) VALUES (1, '2019-05-01 08:00:00')")
+    conn.commit()
+    assert index.sync(conn) is old
+    index._rebuild_thread.join()
+    assert index.last_error is None
+    assert_same(index.sync(conn), range_index.build(conn))
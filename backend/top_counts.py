@@ -0,0 +1,98 @@
+"""
+违章地点、违章类型、维保单位的 Top-N 查询。
+
+计数表 top_counts 按 (维度, 月份, 键) 保存记录数，由触发器精确维护
+(见 migrations.py 中的 add_top_counts)。查询只汇总所选月份内的计数行，
+数据量与 "月数 × 不同取值数" 成正比，与违章/维保记录的总数无关。
+"""
+from granularity import month_number
+
+# 支持的维度
+TOP_KINDS = ('location', 'violation_type', 'provider')
+DEFAULT_TOP_N = 10
+MAX_TOP_N = 100
+# SQLite 单条语句的参数个数有上限，IN (...) 查询分批进行
+LOOKUP_CHUNK_SIZE = 500
+
+
+def parse_top_n(value):
+    """校验 n 参数 (1 ~ MAX_TOP_N)，未提供时为 DEFAULT_TOP_N。"""
+    if value in (None, ''):
+        return DEFAULT_TOP_N
+    try:
+        n = int(value)
+    except ValueError:
+        raise ValueError('n 必须是整数')
+    if not 1 <= n <= MAX_TOP_N:
+        raise ValueError(f'n 必须在 1 到 {MAX_TOP_N} 之间')
+    return n
+
+
+def _period_filter(start_month, end_month):
+    """返回 (WHERE 片段, 参数)；月份格式不正确时返回 None (结果为空)。"""
+    if not (start_month and end_month):
+        return '', []
+    if month_number(start_month) is None or month_number(end_month) is None:
+        return None
+    return 'AND t.period BETWEEN ? AND ?', [start_month, end_month]
+
+
+def top_items(conn, kind, n, start_month=None, end_month=None, names=None):
+    """
+    返回某个维度在时间范围内记录数最多的 n 项: [{'id', 'name', 'count'}]，按 count 降序。
+    违章地点的名称来自 violation_locations，计数相同时按名称排序；
+    违章类型和维保单位的名称由 names ({id: 名称}，即字典表缓存) 提供，
+    计数相同时按 id 排序，不在 names 中的 id 被跳过。
+    """
+    period = _period_filter(start_month, end_month)
+    if period is None:
+        return []
+    period_sql, params = period
+
+    if kind == 'location':
+        rows = conn.execute(f"""
+            SELECT t.key_id, l.name, SUM(t.count) AS count
+            FROM top_counts t
+            JOIN violation_locations l ON l.location_id = t.key_id
+            WHERE t.kind = 'location' {period_sql}
+            GROUP BY t.key_id
+            HAVING SUM(t.count) > 0
+            ORDER BY count DESC, l.name
+            LIMIT ?
+        """, params + [n]).fetchall()
+        return [{'id': row[0], 'name': row[1], 'count': row[2]} for row in rows]
+
+    names = names or {}
+    items = []
+    for key_id, count in conn.execute(f"""
+        SELECT t.key_id, SUM(t.count) AS count
+        FROM top_counts t
+        WHERE t.kind = ? {period_sql}
+        GROUP BY t.key_id
+        HAVING SUM(t.count) > 0
+        ORDER BY count DESC, t.key_id
+    """, [kind] + params):
+        if key_id in names:
+            items.append({'id': key_id, 'name': names[key_id], 'count': count})
+            if len(items) == n:
+                break
+    return items
+
+
+def intern_locations(conn, names):
+    """
+    (新增) 把违章地点文本登记到 violation_locations (不提交)，返回 {地点: location_id}。
+    地点与触发器中一样只去掉首尾空格 (SQLite 的 trim)，空地点被忽略。
+    写入方在插入违章记录之前解析出 location_id，触发器不必再回写该行，
+    变更日志中每条新记录只有一条 insert (见 migrations.py 中的 INTERN_LOCATION_SQL)。
+    """
+    names = list(dict.fromkeys(str(name).strip(' ') for name in names if name is not None and str(name).strip(' ')))
+    if not names:
+        return {}
+    conn.executemany('INSERT OR IGNORE INTO violation_locations (name) VALUES (?)', [(name,) for name in names])
+    location_ids = {}
+    for start in range(0, len(names), LOOKUP_CHUNK_SIZE):
+        chunk = names[start:start + LOOKUP_CHUNK_SIZE]
+        location_ids.update(conn.execute(
+            f"SELECT name, location_id FROM violation_locations WHERE name IN ({','.join('?' for _ in chunk)})", chunk))
+    return location_ids
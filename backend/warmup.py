@@ -0,0 +1,231 @@
+"""
+缓存预热: 启动时和数据版本变化后，在后台线程池中预先请求常用的汇总接口，
+使结果进入响应缓存 (见 response_cache.py)，第一个用户不必承担冷查询的开销。
+
+预热的请求形态 (request_shapes):
+- 概览页、部门总览: 全部时间、今年以来、最近 MAX_WARMUP_MONTHS 个月中的每个月
+- 每个部门的详情页: 全部时间、今年以来
+- 车辆总览第一页: 按每项指标降序，全部时间、今年以来
+"今年以来" 以数据中最新的月份为准 (历史数据导入后也能命中)。
+
+线程池大小 (FLEET_WARMUP_THREADS，默认 2) 即并发上限，避免占满 worker 的线程和 CPU。
+数据在预热过程中再次变化时，尚未开始的旧任务直接放弃。
+
+(新增) 数据变化后等 FLEET_WARMUP_DEBOUNCE 秒 (默认 5) 内不再变化才开始预热，连续写入只预热最后的版本。
+(新增) 指定共享目录 (FLEET_SINGLEFLIGHT_DIR，gunicorn 多 worker 时默认设置) 时整个服务只预热一次: 各 worker 用非阻塞的
+       fcntl.flock 争抢 "<目录>/warmup.lock"，拿到锁的 worker 执行预热，结果经 single-flight 的
+       结果文件共享给其他 worker (见 singleflight.py)，完成的版本记录在 "<目录>/warmup.json"；
+       没拿到锁的 worker 稍后重试，发现该版本已预热过就不再重复。
+"""
+import json
+import os
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from urllib.parse import urlencode
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+WARMUP_THREADS = int(os.environ.get('FLEET_WARMUP_THREADS', 2))
+WARMUP_DEBOUNCE = float(os.environ.get('FLEET_WARMUP_DEBOUNCE', 5))
+MAX_WARMUP_MONTHS = 24
+VEHICLE_SORT_FIELDS = ('mileage', 'fuel', 'violations', 'maintenance')
+VEHICLE_PAGE_SIZE = 10
+def _url(path, params=None):
+    return f"{path}?{urlencode(params)}" if params else path
+
+
+def request_shapes(months, department_ids):
+    """
+    枚举需要预热的 URL。months 为数据覆盖的月份 ('YYYY-MM'，升序)，department_ids 为部门 ID。
+    参数与前端发出的请求一致，以便命中同一个缓存项。
+    """
+    ranges = [{}]
+    if months:
+        latest = months[-1]
+        ranges.append({'start_month': f"{latest[:4]}-01", 'end_month': latest})
+    periods = ranges + [{'start_month': month, 'end_month': month} for month in months[-MAX_WARMUP_MONTHS:]]
+
+    urls = []
+    for period in periods:
+        urls.append(_url('/api/overview/summary', period))
+        urls.append(_url('/api/department/summary', period))
+    for department_id in department_ids:
+        for period in ranges:
+            urls.append(_url(f'/api/department/detail/{department_id}', period))
+    for sort_by in VEHICLE_SORT_FIELDS:
+        for period in ranges:
+            urls.append(_url('/api/vehicle/summary', {
+                **period, 'sort_by': sort_by, 'sort_order': 'desc', 'page': 1, 'per_page': VEHICLE_PAGE_SIZE,
+            }))
+    return list(dict.fromkeys(urls))
+
+
+@contextmanager
+def _leader(path):
+    """非阻塞的跨进程文件锁，返回是否拿到锁；path 为 None 时 (只在进程内预热) 总是成功。"""
+    if path is None:
+        yield True
+        return
+    with open(path, 'a') as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+class Warmer:
+    """
+    按数据版本触发的预热器。schedule(version) 在版本变化时安排一轮预热，
+    同一版本只预热一次；请求通过 client_factory (Flask 的 test_client) 在进程内执行。
+    (新增) shared_dir 不为空时与其他进程协调，整个服务同一版本只预热一次 (见模块说明)。
+    """
+
+    def __init__(self, client_factory, shapes, threads=WARMUP_THREADS, shared_dir=None, debounce=WARMUP_DEBOUNCE):
+        self._client_factory = client_factory
+        self._shapes = shapes
+        self._threads = max(1, threads)
+        self.shared_dir = shared_dir if fcntl is not None else None
+        if self.shared_dir:
+            os.makedirs(self.shared_dir, exist_ok=True)
+        self.debounce = debounce
+        self.enabled = True
+        self._lock = threading.Lock()
+        self._round_lock = threading.Lock()
+        self._executor = None
+        self._timer = None
+        self._version = None
+        self._pending = None
+        self._generation = 0
+        self.completed = 0
+        self.failed = 0
+        self.rounds = 0
+
+    def schedule(self, version):
+        """(修改) 数据版本变化时安排一轮预热，在数据 debounce 秒内不再变化后于后台开始。"""
+        if not self.enabled or version is None or version in (self._version, self._pending):
+            return
+        with self._lock:
+            if version in (self._version, self._pending):
+                return
+            self._pending = version
+            # 正在进行的旧版本预热中尚未开始的请求直接放弃
+            self._generation += 1
+            self._start_timer()
+
+    def warm_now(self, version):
+        """预热并等待完成，然后关闭线程池 (用于 gunicorn master 在 fork 之前)。"""
+        self._warm(version)
+        self.shutdown()
+
+    def shutdown(self):
+        """取消尚未开始的预热，等待进行中的一轮结束并关闭线程池。"""
+        with self._lock:
+            self._pending = None
+            self._generation += 1
+            timer, self._timer = self._timer, None
+        if timer is not None:
+            timer.cancel()
+        with self._round_lock:
+            with self._lock:
+                executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    def _start_timer(self):
+        """(持有 self._lock 时调用) 重新开始计时，到期后在后台预热 self._pending。"""
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = threading.Timer(self.debounce, self._run_pending)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _run_pending(self):
+        version = self._pending
+        if version is None:
+            return
+        try:
+            done = self._warm(version)
+        except (OSError, sqlite3.Error):
+            done = True
+        with self._lock:
+            if self._pending != version:
+                # 等待期间数据又变化了，新的计时器已经安排好
+                return
+            if done:
+                self._pending = None
+                self._timer = None
+            else:
+                # 其他 worker 正在预热 (可能是更早的版本)，稍后再看
+                self._start_timer()
+
+    def _warm(self, version):
+        """执行一轮预热并等待完成；其他进程持有预热锁时返回 False，本版本已预热过 (或已完成) 时返回 True。"""
+        lock_path = os.path.join(self.shared_dir, 'warmup.lock') if self.shared_dir else None
+        with self._round_lock, _leader(lock_path) as leader:
+            if not leader:
+                return False
+            if self._read_warmed() == version:
+                self._version = version
+                return True
+            with self._lock:
+                self._version = version
+                generation = self._generation
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self._threads, thread_name_prefix='warmup')
+                executor = self._executor
+            futures = []
+            try:
+                for url in self._shapes():
+                    futures.append(executor.submit(self._fetch, generation, url))
+            except RuntimeError:
+                # 线程池已关闭 (解释器正在退出)，放弃剩余的预热
+                pass
+            wait(futures)
+            self.rounds += 1
+            if generation == self._generation:
+                self._write_warmed(version)
+            return True
+
+    def _read_warmed(self):
+        """共享目录中记录的最近一次完整预热的数据版本。"""
+        if not self.shared_dir:
+            return None
+        try:
+            with open(os.path.join(self.shared_dir, 'warmup.json'), encoding='utf-8') as f:
+                return tuple(json.load(f)['version'])
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def _write_warmed(self, version):
+        if not self.shared_dir:
+            return
+        path = os.path.join(self.shared_dir, 'warmup.json')
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'version': list(version)}, f)
+            os.replace(tmp_path, path)
+        except OSError:
+            pass
+
+    def _fetch(self, generation, url):
+        if generation != self._generation:
+            # 数据又变化了，这一轮的结果已经过期
+            return None
+        with self._client_factory() as client:
+            status = client.get(url).status_code
+        if status == 200:
+            self.completed += 1
+        else:
+            self.failed += 1
+        return status
@@ -5,12 +5,26 @@ import sqlite3
 import pandas as pd
 import re
 import os
+import sys
+from datetime import date
 
 # --- Configuration ---
 # Build paths relative to this script file
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
-DB_FILE = os.path.join(SCRIPT_DIR, '..', 'backend', 'data', 'vehicle_data_optimized.db')
+BACKEND_DIR = os.path.join(SCRIPT_DIR, '..', 'backend')
+DB_FILE = os.path.join(BACKEND_DIR, 'data', 'vehicle_data_optimized.db')
 DATA_DIR = os.path.join(SCRIPT_DIR, '..', 'temp/')
+# Year for fuel rows whose month cell has no year (e.g. "3月"); see fuel_year()
+FUEL_YEAR = os.environ.get('FLEET_FUEL_YEAR')
+
+# Share the schema upgrades (version table, triggers, ...) with the backend
+sys.path.insert(0, BACKEND_DIR)
+from migrations import migrate  # noqa: E402
+from dict_cache import DictionaryCache  # noqa: E402
+from ingest import load_known_keys, validate_frame  # noqa: E402
+from staging import discard_staging, swap_in  # noqa: E402
+from fixed_point import FIXED_POINT, set_fixed_point  # noqa: E402
+from maintenance import analyze  # noqa: E402
 
 
 # --- Optimized Database Schema ---
@@ -53,10 +67,12 @@ TABLES = {
         CREATE TABLE IF NOT EXISTS violations (
             violation_id INTEGER PRIMARY KEY,
             plate_number TEXT,
+            vehicle_id INTEGER,
             violation_time DATETIME,
             violation_location TEXT,
             violation_type_id INTEGER,
             FOREIGN KEY (plate_number) REFERENCES vehicles (plate_number),
+            FOREIGN KEY (vehicle_id) REFERENCES vehicles (vehicle_id),
             FOREIGN KEY (violation_type_id) REFERENCES violation_types (violation_type_id)
         )
     """,
@@ -64,6 +80,7 @@ TABLES = {
         CREATE TABLE IF NOT EXISTS maintenance (
             maintenance_id INTEGER PRIMARY KEY AUTOINCREMENT,
             plate_number TEXT,
+            vehicle_id INTEGER,
             order_number TEXT,
             provider_id INTEGER,
             request_time DATETIME,
@@ -73,6 +90,7 @@ TABLES = {
             service_details TEXT,
             maintenance_cost NUMERIC(10, 2),
             FOREIGN KEY (plate_number) REFERENCES vehicles (plate_number),
+            FOREIGN KEY (vehicle_id) REFERENCES vehicles (vehicle_id),
             FOREIGN KEY (provider_id) REFERENCES service_providers (provider_id)
         )
     """,
@@ -80,6 +98,7 @@ TABLES = {
         CREATE TABLE IF NOT EXISTS monthly_fuel_summary (
             summary_id INTEGER PRIMARY KEY AUTOINCREMENT,
             plate_number TEXT,
+            vehicle_id INTEGER,
             year INTEGER,
             month INTEGER,
             total_fuel_cost NUMERIC(10, 2),
@@ -90,7 +109,8 @@ TABLES = {
             avg_consumption_per_100km DECIMAL(10, 2),
             card_number TEXT,
             notes TEXT,
-            FOREIGN KEY (plate_number) REFERENCES vehicles (plate_number)
+            FOREIGN KEY (plate_number) REFERENCES vehicles (plate_number),
+            FOREIGN KEY (vehicle_id) REFERENCES vehicles (vehicle_id)
         )
     """
 }
@@ -100,21 +120,30 @@ INDEXES = [
     "CREATE INDEX IF NOT EXISTS idx_violations_plate_number ON violations (plate_number);",
     "CREATE INDEX IF NOT EXISTS idx_violations_time ON violations (violation_time);",
     "CREATE INDEX IF NOT EXISTS idx_maintenance_plate_number ON maintenance (plate_number);",
-    "CREATE INDEX IF NOT EXISTS idx_fuel_summary_plate_year_month ON monthly_fuel_summary (plate_number, year, month);"
+    "CREATE INDEX IF NOT EXISTS idx_fuel_summary_plate_year_month ON monthly_fuel_summary (plate_number, year, month);",
+    "CREATE INDEX IF NOT EXISTS idx_violations_vehicle_id ON violations (vehicle_id, violation_time);",
+    "CREATE INDEX IF NOT EXISTS idx_maintenance_vehicle_id ON maintenance (vehicle_id, request_time);",
+    "CREATE INDEX IF NOT EXISTS idx_monthly_fuel_summary_vehicle_id ON monthly_fuel_summary (vehicle_id, year, month);"
 ]
 
-def setup_database():
+def setup_database(db_file=DB_FILE):
     """Create database, tables, and indexes without deleting the file."""
-    conn = sqlite3.connect(DB_FILE)
+    conn = sqlite3.connect(db_file)
     cursor = conn.cursor()
     
     print("--- Setting up database ---")
 
+    # Let the backend reclaim free pages in small steps (see backend/maintenance.py).
+    # Only takes effect on a new, empty file such as the staging database.
+    cursor.execute("PRAGMA auto_vacuum = INCREMENTAL;")
+
     # Clear existing data from tables to ensure a fresh import
     table_names = list(TABLES.keys())
     # Drop tables in reverse order of creation to respect foreign key constraints
     for table_name in reversed(table_names):
         cursor.execute(f"DROP TABLE IF EXISTS {table_name};")
+    # Dropping the tables also dropped the backend's triggers; re-run every migration afterwards
+    cursor.execute("PRAGMA user_version = 0;")
     print(" - Cleared existing tables.")
 
     print(" - Creating tables...")
@@ -219,6 +248,41 @@ def import_data():
     finally:
         conn.close()
 
+# Name -> id lookups for departments / violation types / providers; unseen names are created in batches
+DICTIONARIES = DictionaryCache()
+
+
+def validate_for_import(conn, df, table):
+    """
+    Runs the shared vectorized validation (see backend/ingest.py) and prints the reject report.
+    Fact rows whose plate is not in 'vehicles' are still imported (with a NULL vehicle_id) and only reported.
+    Dictionary values given by name are resolved (and created when unseen) through DICTIONARIES.
+    """
+    plate_map, ids = load_known_keys(conn)
+    df, report = validate_frame(df, table, plate_map, ids, unknown_plates='warn',
+                                resolve=lambda table_name, names: DICTIONARIES.get_or_create(conn, table_name, names))
+    for line in report.summary_lines():
+        print(f" - {line}")
+    return df
+
+
+def fuel_year(conn):
+    """
+    Default year for fuel rows without one: FLEET_FUEL_YEAR when set, otherwise the latest year
+    of the violation / maintenance records imported in the same run, otherwise the current year.
+    """
+    if FUEL_YEAR:
+        return int(FUEL_YEAR)
+    row = conn.execute("""
+        SELECT MAX(y) FROM (
+            SELECT MAX(substr(violation_time, 1, 4)) AS y FROM violations
+            UNION ALL
+            SELECT MAX(substr(request_time, 1, 4)) FROM maintenance
+        ) WHERE y GLOB '[0-9][0-9][0-9][0-9]'
+    """).fetchone()
+    return int(row[0]) if row[0] else date.today().year
+
+
 def import_fuel_summary(conn):
     """Imports and transforms the monthly fuel summary data."""
     print(" - Importing fuel summary data...")
@@ -233,21 +297,18 @@ def import_fuel_summary(conn):
         # Get a dictionary of original column names by index for later renaming
         original_columns = {i: name for i, name in enumerate(df.columns)}
 
-        # 1. Clean up numeric columns first using their index
-        df.iloc[:, 8] = pd.to_numeric(df.iloc[:, 8], errors='coerce').fillna(0).astype(int)   # 里 程数
-        df.iloc[:, 6] = pd.to_numeric(df.iloc[:, 6], errors='coerce').fillna(0).astype(int)   # 月初公里数
-        df.iloc[:, 7] = pd.to_numeric(df.iloc[:, 7], errors='coerce').fillna(0).astype(int)   # 月末公里数
-        df.iloc[:, 4] = pd.to_numeric(df.iloc[:, 4], errors='coerce').fillna(0)             # 加油金额
-        df.iloc[:, 5] = pd.to_numeric(df.iloc[:, 5], errors='coerce').fillna(0)             # 加油数量
-        df.iloc[:, 9] = pd.to_numeric(df.iloc[:, 9], errors='coerce').fillna(0)             # 百公里油耗
-            
-        # 2. Extract year and month
+        # 1. Extract year and month
         # (修正) 根据刚才的检查，月份信息在第12列 (索引为11), 而不是 "备注" 列
-        df['month'] = df[original_columns.get(11)].str.extract(r'(\d+)月') # Unnamed: 11 列
+        period = df[original_columns.get(11)].astype('string')  # Unnamed: 11 列
+        df['month'] = period.str.extract(r'(\d+)月', expand=False)
         df['month'] = pd.to_numeric(df['month'], errors='coerce').fillna(0).astype(int)
-        df['year'] = 2025
+        # The year comes from the cell when present (e.g. "2024年12月"), instead of a hard-coded 2025
+        default_year = fuel_year(conn)
+        df['year'] = pd.to_numeric(period.str.extract(r'(\d{4})年', expand=False), errors='coerce')
+        print(f" - {int(df['year'].isna().sum())} fuel rows without a year are assigned to {default_year}.")
+        df['year'] = df['year'].fillna(default_year).astype(int)
 
-        # 3. Now, rename the columns to English names for the database
+        # 2. Now, rename the columns to English names for the database
         column_map = {
             original_columns.get(1): 'plate_number',
             original_columns.get(3): 'card_number',
@@ -260,10 +321,17 @@ def import_fuel_summary(conn):
             original_columns.get(10): 'notes'
         }
         df.rename(columns=column_map, inplace=True)
+
+        # 3. Validate: plate normalization, numeric coercion and month range checks, vehicle_id resolution.
+        #    Blank numeric cells are still stored as 0, as before.
+        df = validate_for_import(conn, df, 'monthly_fuel_summary')
+        numeric_columns = ['total_fuel_cost', 'total_fuel_amount', 'start_month_mileage', 'end_month_mileage',
+                           'distance_driven', 'avg_consumption_per_100km']
+        df[numeric_columns] = df[numeric_columns].fillna(0)
         
         # --- Prepare final DataFrame for SQL import ---
         df_to_db = df[[
-            'plate_number', 'year', 'month', 'total_fuel_cost', 'total_fuel_amount',
+            'plate_number', 'vehicle_id', 'year', 'month', 'total_fuel_cost', 'total_fuel_amount',
             'start_month_mileage', 'end_month_mileage', 'distance_driven',
             'avg_consumption_per_100km', 'card_number', 'notes'
         ]]
@@ -280,57 +348,47 @@ def import_fuel_summary(conn):
 
 
 def main():
-    setup_database()
-    
-    conn = sqlite3.connect(DB_FILE)
+    """
+    Full reload. Everything (tables, indexes, triggers and rollups) is built in a separate staging file
+    and swapped into DB_FILE in one step at the end, so the running backend keeps serving the old data
+    until then and never sees half-loaded tables. On failure DB_FILE is left untouched.
+    """
+    staging_file = discard_staging(DB_FILE)
+    setup_database(staging_file)
+
+    conn = sqlite3.connect(staging_file)
     try:
-        import_dictionary_data(conn)
         import_business_data(conn)
         import_fuel_summary(conn)
         conn.commit()
+        print(f" - Database schema upgraded to version {migrate(conn)}.")
+        # FLEET_FIXED_POINT=1: store money as cents and fuel as millilitres (see backend/fixed_point.py)
+        if FIXED_POINT:
+            print(f" - Fixed-point storage enabled for: {', '.join(set_fixed_point(conn, True))}.")
+        # Fresh query planner statistics for the new tables and indexes
+        analyze(conn)
+        print(" - Statistics collected (ANALYZE).")
     except Exception as e:
         print(f"A critical error occurred: {e}")
         conn.rollback()
-    finally:
         conn.close()
-    
-    print("\n--- Full Data Import Process Finished ---")
-
-# We refactor the original import_data into two more focused functions
-def import_dictionary_data(conn):
-    """Populates the dictionary tables and returns mapping dictionaries."""
-    print("\n--- Step 1: Populating Dictionary Tables ---")
-    
-    # Departments
-    df_vehicles_raw = pd.read_csv(os.path.join(DATA_DIR, '1-车辆基本信息.csv'), encoding='utf-8')
-    departments = pd.DataFrame(df_vehicles_raw.iloc[:, 1].unique(), columns=['name'])
-    departments.to_sql('departments', conn, if_exists='append', index=False)
-    print(f" - Populated 'departments' with {len(departments)} unique records.")
-   
-    # Violation Types
-    df_violations_raw = pd.read_csv(os.path.join(DATA_DIR, '2-车辆违章数据（1-6月份）_汇总表.csv'), encoding='utf-8')
-    violation_types = pd.DataFrame(df_violations_raw.iloc[:, 5].unique(), columns=['description'])
-    violation_types.to_sql('violation_types', conn, if_exists='append', index=False)
-    print(f" - Populated 'violation_types' with {len(violation_types)} unique records.")
+        discard_staging(DB_FILE)
+        print(f" - {DB_FILE} was not changed.")
+        return
+    conn.close()
 
-    # Service Providers
-    df_maint_raw = pd.read_csv(os.path.join(DATA_DIR, '3-车辆维保数据_3-维修保养明细.csv'), encoding='utf-8')
-    providers = pd.DataFrame(df_maint_raw.iloc[:, 1].unique(), columns=['name'])
-    providers.to_sql('service_providers', conn, if_exists='append', index=False)
-    print(f" - Populated 'service_providers' with {len(providers)} unique records.")
+    print(" - Swapping the staged database in...")
+    swap_in(staging_file, DB_FILE)
+    print("\n--- Full Data Import Process Finished ---")
 
 def import_business_data(conn):
-    """Imports the main business data tables using mappings from dictionary tables."""
-    print("\n--- Step 2: Importing Business Data ---")
-
-    # Create Mappings
-    df_dep_map = pd.read_sql('SELECT * FROM departments', conn)
-    dep_map = pd.Series(df_dep_map.department_id.values, index=df_dep_map.name).to_dict()
-    df_vt_map = pd.read_sql('SELECT * FROM violation_types', conn)
-    vt_map = pd.Series(df_vt_map.violation_type_id.values, index=df_vt_map.description).to_dict()
-    df_sp_map = pd.read_sql('SELECT * FROM service_providers', conn)
-    sp_map = pd.Series(df_sp_map.provider_id.values, index=df_sp_map.name).to_dict()
-    
+    """
+    Imports the main business data tables.
+    Departments, violation types and providers are passed by name and resolved by the validator,
+    which creates unseen names in order of first appearance (see validate_for_import).
+    """
+    print("\n--- Importing Business Data ---")
+
     # Import Vehicles
     df_vehicles_raw = pd.read_csv(os.path.join(DATA_DIR, '1-车辆基本信息.csv'), encoding='utf-8')
     df_vehicles_raw.columns = [
@@ -338,24 +396,20 @@ def import_business_data(conn):
         'brand_2', 'displacement', 'capacity', 'registration_date_str',
         'purchase_price', 'age', 'notes'
     ]
-    df_vehicles_raw['plate_number'] = df_vehicles_raw['plate_number'].str.strip()
     df_vehicles_raw['brand_model'] = df_vehicles_raw['brand_1'].fillna('') + df_vehicles_raw['brand_2'].fillna('')
-    def parse_date(date_str):
-        if pd.isna(date_str): return None
-        match = re.search(r'(\d{4})年(\d{1,2})月(\d{1,2})日', str(date_str))
-        return f"{match.groups()[0]}-{int(match.groups()[1]):02d}-{int(match.groups()[2]):02d}" if match else None
-    df_vehicles_raw['registration_date'] = df_vehicles_raw['registration_date_str'].apply(parse_date)
-    df_vehicles_raw['department_id'] = df_vehicles_raw['department_name'].map(dep_map)
-    df_vehicles_to_db = df_vehicles_raw[['vehicle_id', 'plate_number', 'department_id', 'manager', 'brand_model', 'displacement', 'capacity', 'registration_date', 'purchase_price', 'notes']]
+    # Plates, Chinese registration dates and numbers are normalized column-wise by the shared validator
+    df_vehicles_raw['registration_date'] = df_vehicles_raw['registration_date_str']
+    df_vehicles_to_db = df_vehicles_raw[['vehicle_id', 'plate_number', 'department_name', 'manager', 'brand_model', 'displacement', 'capacity', 'registration_date', 'purchase_price', 'notes']]
+    df_vehicles_to_db = validate_for_import(conn, df_vehicles_to_db, 'vehicles')
     df_vehicles_to_db.to_sql('vehicles', conn, if_exists='append', index=False)
     print(f" - Imported {len(df_vehicles_to_db)} records into 'vehicles'.")
 
     # Import Violations
     df_violations_raw = pd.read_csv(os.path.join(DATA_DIR, '2-车辆违章数据（1-6月份）_汇总表.csv'), encoding='utf-8')
     df_violations_raw.columns = ['violation_id', 'plate_number', 'department', 'violation_time', 'violation_location', 'violation_type_desc']
-    df_violations_raw['plate_number'] = df_violations_raw['plate_number'].str.strip()
-    df_violations_raw['violation_type_id'] = df_violations_raw['violation_type_desc'].map(vt_map)
-    df_violations_to_db = df_violations_raw[['violation_id', 'plate_number', 'violation_time', 'violation_location', 'violation_type_id']]
+    df_violations_raw['violation_type'] = df_violations_raw['violation_type_desc']
+    df_violations_to_db = df_violations_raw[['violation_id', 'plate_number', 'violation_time', 'violation_location', 'violation_type']]
+    df_violations_to_db = validate_for_import(conn, df_violations_to_db, 'violations')
     df_violations_to_db.to_sql('violations', conn, if_exists='append', index=False)
     print(f" - Imported {len(df_violations_to_db)} records into 'violations'.")
 
@@ -367,8 +421,8 @@ def import_business_data(conn):
         'last_maintenance_date', 'last_maintenance_mileage',
         'service_details', 'maintenance_cost'
     ]
-    df_maint_raw['provider_id'] = df_maint_raw['provider_name'].map(sp_map)
-    df_maint_to_db = df_maint_raw[['plate_number', 'order_number', 'provider_id', 'request_time', 'delivery_time', 'current_mileage', 'last_maintenance_mileage', 'service_details', 'maintenance_cost']]
+    df_maint_to_db = df_maint_raw[['plate_number', 'order_number', 'provider_name', 'request_time', 'delivery_time', 'current_mileage', 'last_maintenance_mileage', 'service_details', 'maintenance_cost']]
+    df_maint_to_db = validate_for_import(conn, df_maint_to_db, 'maintenance')
     df_maint_to_db.to_sql('maintenance', conn, if_exists='append', index=False)
     print(f" - Imported {len(df_maint_to_db)} records into 'maintenance'.")
 
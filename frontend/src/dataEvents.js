@@ -0,0 +1,65 @@
+// (新增) 订阅后端推送的数据变更事件 (Server-Sent Events)
+// 所有页面共享同一个 EventSource 连接，没有订阅者时自动关闭连接。
+// 事件格式: { table, op, plates: [...], departments: [...], months: [...] | null }
+// months 为 null 表示影响所有月份 (例如车辆信息变更)。
+import { onMounted, onUnmounted } from 'vue';
+
+const API_BASE_URL = 'http://127.0.0.1:5000';
+
+let source = null;
+const listeners = new Set();
+
+const dispatch = (message) => {
+  const event = JSON.parse(message.data);
+  listeners.forEach((listener) => listener(event));
+};
+
+// 后端连接数已满时返回 503，EventSource 不会自动重连，稍后重新建立连接
+const RECONNECT_DELAY_MS = 10000;
+let reconnectTimer = null;
+
+const connect = () => {
+  reconnectTimer = null;
+  source = new EventSource(`${API_BASE_URL}/api/events`);
+  source.addEventListener('change', dispatch);
+  source.onerror = () => {
+    if (source && source.readyState === EventSource.CLOSED) {
+      source = null;
+      reconnectTimer = setTimeout(connect, RECONNECT_DELAY_MS);
+    }
+  };
+};
+
+const subscribe = (listener) => {
+  listeners.add(listener);
+  if (!source && !reconnectTimer) connect();
+};
+
+const unsubscribe = (listener) => {
+  listeners.delete(listener);
+  if (listeners.size > 0) return;
+  if (source) {
+    source.close();
+    source = null;
+  }
+  if (reconnectTimer) {
+    clearTimeout(reconnectTimer);
+    reconnectTimer = null;
+  }
+};
+
+// 判断事件影响的月份是否落在 [startMonth, endMonth] 范围内 (格式 YYYY-MM，字符串可直接比较)
+export const affectsMonths = (event, startMonth, endMonth) => {
+  if (!event.months) return true;
+  if (!startMonth || !endMonth) return event.months.length > 0;
+  return event.months.some((month) => month >= startMonth && month <= endMonth);
+};
+
+// 在组件挂载期间订阅数据变更事件，shouldRefresh(event) 返回 true 时调用 refresh()
+export const useDataChanges = (shouldRefresh, refresh) => {
+  const listener = (event) => {
+    if (shouldRefresh(event)) refresh();
+  };
+  onMounted(() => subscribe(listener));
+  onUnmounted(() => unsubscribe(listener));
+};